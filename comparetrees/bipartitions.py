@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+
+"""Calculate bipartition-based tree distances for whole tree collections.
+
+Parse all trees once, encode each tree as set of bipartitions over a
+shared taxon index, and calculate Robinson-Foulds, weighted
+Robinson-Foulds and Euclidean branch length distances between the trees
+of whole collections at once, either pairwise (one original tree for
+each reconstructed tree), one-vs-many, or all-vs-all.
+
+Unless the trees are declared rooted, they are compared as unrooted
+trees, as dendropy does for trees without rooting information.
+
+"""
+
+import sys
+import argparse
+import multiprocessing
+
+import numpy
+import newick
+
+
+class TreeCollection:
+    """A collection of trees, stored as bipartitions.
+
+    Each tree is stored as sorted array of bipartition IDs with the
+    corresponding branch lengths. All trees, in this collection and in
+    others sharing the same `taxa` and `bipartitions` dictionaries, use
+    the same IDs for the same bipartitions, so comparing trees reduces to
+    set operations on integer arrays.
+
+    """
+    def __init__(self, trees=(), taxa=None, bipartitions=None,
+                 rooted=False):
+        self.taxa = {} if taxa is None else taxa
+        self.bipartitions = {} if bipartitions is None else bipartitions
+        self.rooted = rooted
+        ids = []
+        lengths = []
+        for tree in trees:
+            tree_ids, tree_lengths = self.encode(tree)
+            ids.append(tree_ids)
+            lengths.append(tree_lengths)
+        self.sizes = numpy.array([len(i) for i in ids], dtype=int)
+        self.tree = numpy.repeat(numpy.arange(len(ids)), self.sizes)
+        if ids:
+            self.ids = numpy.concatenate(ids)
+            self.lengths = numpy.concatenate(lengths)
+        else:
+            self.ids = numpy.zeros(0, dtype=int)
+            self.lengths = numpy.zeros(0)
+        self.offsets = numpy.concatenate([[0], numpy.cumsum(self.sizes)])
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def encode(self, tree):
+        """Encode a newick.Node as arrays of bipartition IDs and lengths.
+
+        Bipartitions are bitmasks over the taxon index. For unrooted
+        trees, a bipartition is represented by the side which does not
+        contain the first taxon of the tree, and the two root edges, which
+        form the same bipartition, are merged. Like in dendropy, the edge
+        above the root is the bipartition of all taxa, with the length of
+        the root (0 if it has none).
+
+        """
+        masks = {}
+        below = {}
+        leaves = 0
+        for node in tree.walk(mode="postorder"):
+            if node.descendants:
+                mask = 0
+                for child in node.descendants:
+                    mask |= below.pop(id(child))
+            else:
+                mask = 1 << self.taxa.setdefault(node.name, len(self.taxa))
+                leaves |= mask
+            below[id(node)] = mask
+            if node is not tree:
+                masks.setdefault(mask, []).append(node.length)
+        first = leaves & -leaves
+
+        splits = {}
+        for mask, lengths in masks.items():
+            if not self.rooted and mask & first:
+                mask = leaves ^ mask
+            if mask and mask != leaves:
+                splits[mask] = splits.get(mask, 0) + sum(lengths)
+        splits[leaves] = tree.length
+        ids = numpy.array([
+            self.bipartitions.setdefault(mask, len(self.bipartitions))
+            for mask in splits], dtype=int)
+        lengths = numpy.array(list(splits.values()), dtype=float)
+        order = numpy.argsort(ids)
+        return ids[order], lengths[order]
+
+    def reference(self, i):
+        """Return the bipartition IDs and lengths of the `i`th tree."""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.ids[start:end], self.lengths[start:end]
+
+
+def compare_one_to_many(ids, lengths, trees):
+    """Compare one tree with all trees of a collection.
+
+    Return arrays with the Robinson-Foulds, weighted Robinson-Foulds and
+    squared Euclidean distances between the tree given by sorted
+    bipartition `ids` and `lengths`, and each tree in `trees`.
+
+    """
+    n = len(trees)
+    position = numpy.searchsorted(ids, trees.ids)
+    position[position == len(ids)] = 0
+    shared = (ids[position] == trees.ids) if len(ids) else (
+        numpy.zeros(len(trees.ids), dtype=bool))
+    other = numpy.where(shared, lengths[position] if len(ids) else 0, 0.)
+
+    matched = numpy.bincount(trees.tree, weights=shared, minlength=n)
+    rf = trees.sizes + len(ids) - 2 * matched
+
+    # Bipartitions of the reference tree missing from a tree contribute
+    # their full length, those missing from the reference contribute the
+    # full length of the other tree's branch.
+    difference = numpy.abs(trees.lengths - other)
+    wrf = (numpy.bincount(trees.tree, weights=difference, minlength=n) +
+           lengths.sum() -
+           numpy.bincount(trees.tree, weights=other, minlength=n))
+    euclidean = (
+        numpy.bincount(trees.tree, weights=difference ** 2, minlength=n) +
+        (lengths ** 2).sum() -
+        numpy.bincount(trees.tree, weights=other ** 2, minlength=n))
+    return rf, wrf, euclidean
+
+
+def compare_pairs(trees1, trees2):
+    """Compare the `i`th tree of `trees1` with the `i`th tree of `trees2`.
+
+    Return the Robinson-Foulds, weighted Robinson-Foulds and squared
+    Euclidean distances, for as many pairs as the shorter collection has
+    trees.
+
+    """
+    n = min(len(trees1), len(trees2))
+    width = max(len(trees1.bipartitions), len(trees2.bipartitions)) + 1
+    keys1 = trees1.tree * width + trees1.ids
+    keys2 = trees2.tree * width + trees2.ids
+    _, in1, in2 = numpy.intersect1d(
+        keys1, keys2, assume_unique=True, return_indices=True)
+    tree = trees1.tree[in1]
+    l1 = trees1.lengths[in1]
+    l2 = trees2.lengths[in2]
+
+    def total(trees, weights=None):
+        return numpy.bincount(trees.tree, weights=weights, minlength=n)[:n]
+
+    def shared(weights=None):
+        return numpy.bincount(tree, weights=weights, minlength=n)[:n]
+
+    rf = trees1.sizes[:n] + trees2.sizes[:n] - 2 * shared()
+    wrf = (total(trees1, trees1.lengths) - shared(l1) +
+           total(trees2, trees2.lengths) - shared(l2) +
+           shared(numpy.abs(l1 - l2)))
+    euclidean = (total(trees1, trees1.lengths ** 2) - shared(l1 ** 2) +
+                 total(trees2, trees2.lengths ** 2) - shared(l2 ** 2) +
+                 shared((l1 - l2) ** 2))
+    return rf, wrf, euclidean
+
+
+def finish(distance, measures, trees1, trees2):
+    """Pick the distance measure from the result of a comparison."""
+    rf, wrf, euclidean = measures
+    if distance in {"rf", "unweighted_robinson_foulds", "symmetric",
+                    "bipartition"}:
+        return rf.astype(int)
+    elif distance == "nrf":
+        # The bipartition of all taxa is in every tree, so it never counts.
+        maximum = numpy.maximum(trees1 - 1, 0) + numpy.maximum(trees2 - 1, 0)
+        return numpy.where(maximum > 0, rf / numpy.maximum(maximum, 1), 0.)
+    elif distance in {"wrf", "weighted_robinson_foulds"}:
+        return wrf
+    elif distance == "euclidean":
+        return numpy.sqrt(numpy.maximum(euclidean, 0))
+    raise ValueError("Unknown distance {:}".format(distance))
+
+
+distances = ["rf", "unweighted_robinson_foulds", "nrf",
+             "wrf", "weighted_robinson_foulds",
+             "euclidean", "bipartition", "symmetric"]
+
+_collection = None
+
+
+def _store_collection(trees):
+    global _collection
+    _collection = trees
+
+
+def _compare_row(args):
+    i, distance = args
+    ids, lengths = _collection.reference(i)
+    return finish(distance, compare_one_to_many(ids, lengths, _collection),
+                  len(ids), _collection.sizes)
+
+
+def all_vs_all(trees, distance="rf", processes=1):
+    """Generate the rows of the distance matrix between all trees."""
+    tasks = ((i, distance) for i in range(len(trees)))
+    if processes == 1:
+        _store_collection(trees)
+        yield from map(_compare_row, tasks)
+    else:
+        with multiprocessing.Pool(
+                processes, initializer=_store_collection,
+                initargs=(trees,)) as pool:
+            yield from pool.imap(_compare_row, tasks, chunksize=16)
+
+
+def read_trees(file, taxa, bipartitions, rooted=False):
+    """Read a file with one Newick tree per line into a TreeCollection."""
+    return TreeCollection(
+        (newick.loads(line)[0] for line in file if line.strip()),
+        taxa, bipartitions, rooted)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "original",
+        type=argparse.FileType('r'),
+        help="File with original trees")
+    parser.add_argument(
+        "reconstructed",
+        type=argparse.FileType('r'),
+        nargs="?",
+        help="File with reconstructed trees. If not given, compare all"
+        " original trees with each other.")
+    parser.add_argument(
+        "--output", "-o",
+        type=argparse.FileType('w'),
+        default=sys.stdout,
+        help="Output filename, one distance (or one row of the distance"
+        " matrix) per line")
+    parser.add_argument(
+        "--distance",
+        choices=distances,
+        default="rf",
+        help="The function to use to calculate the distance between trees. "
+        "One of " + ", ".join(distances))
+    parser.add_argument(
+        "--rooted", action="store_true",
+        default=False,
+        help="Compare the trees as rooted trees")
+    parser.add_argument(
+        "--processes", "-p", type=int,
+        default=1,
+        help="Number of processes for all-vs-all comparisons")
+
+    args = parser.parse_args()
+
+    taxa = {}
+    bipartitions = {}
+    original = read_trees(args.original, taxa, bipartitions, args.rooted)
+    if args.reconstructed is None:
+        for row in all_vs_all(original, args.distance, args.processes):
+            print(*row, sep="\t", file=args.output)
+    else:
+        reconstructed = read_trees(
+            args.reconstructed, taxa, bipartitions, args.rooted)
+        if len(original) == 1:
+            # If there was only one original tree, compare it with _each_
+            # reconstructed tree.
+            ids, lengths = original.reference(0)
+            result = finish(
+                args.distance,
+                compare_one_to_many(ids, lengths, reconstructed),
+                len(ids), reconstructed.sizes)
+        else:
+            result = finish(
+                args.distance,
+                compare_pairs(original, reconstructed),
+                original.sizes[:len(reconstructed)],
+                reconstructed.sizes[:len(original)])
+        for value in result:
+            print(value, file=args.output)
@@ -6,8 +6,14 @@ import sys
 import argparse
 import bisect
 import random
+import functools
+import multiprocessing
+
+import numpy
 import newick
 
+from simuling.tree import Tree
+
 
 def create_balanced_random_tree(taxa, branch_length=random.random):
     """Generate a random tree.
@@ -77,6 +83,126 @@ def create_random_tree(taxa, branch_length=random.random):
     return clades[0]
 
 
+def random_merges(rng, n_taxa, batch):
+    """Draw random tree topologies for a batch of trees.
+
+    Like `create_random_tree`, repeatedly join two random clades. Nodes
+    0, …, n_taxa-1 are the leaves, node n_taxa + k is created in the k-th
+    merge. Return a (batch, n_taxa - 1, 2) array of the two children
+    joined in each merge.
+
+    """
+    clades = numpy.tile(numpy.arange(n_taxa), (batch, 1))
+    merges = numpy.empty((batch, n_taxa - 1, 2), dtype=int)
+    rows = numpy.arange(batch)
+    for k, m in enumerate(range(n_taxa, 1, -1)):
+        i = rng.integers(m, size=batch)
+        j = rng.integers(m - 1, size=batch)
+        j += j >= i
+        merges[:, k, 0] = clades[rows, i]
+        merges[:, k, 1] = clades[rows, j]
+        # Put the new clade in place of the first one, and fill the gap
+        # left by the second one with the last active clade.
+        clades[rows, i] = n_taxa + k
+        clades[rows, j] = clades[rows, m - 1]
+    return merges
+
+
+def balanced_merges(rng, n_taxa, lengths):
+    """Draw roughly height-balanced tree topologies for a batch of trees.
+
+    Like `create_balanced_random_tree`, repeatedly join the two lowest
+    clades, given the branch `lengths` of all nodes, numbered as in
+    `random_merges`.
+
+    """
+    batch = len(lengths)
+    order = numpy.argsort(lengths[:, :n_taxa], axis=1, kind="stable")
+    heights = numpy.take_along_axis(lengths, order, axis=1)
+    merges = numpy.empty((batch, n_taxa - 1, 2), dtype=int)
+    for k in range(n_taxa - 1):
+        merges[:, k] = order[:, :2]
+        height = heights[:, :2].mean(axis=1) + lengths[:, n_taxa + k]
+        order, heights = order[:, 2:], heights[:, 2:]
+        # Insert the new clade after all clades of lower or equal height.
+        position = (heights <= height[:, None]).sum(axis=1)
+        columns = numpy.arange(order.shape[1] + 1)
+        source = numpy.clip(
+            columns - (columns > position[:, None]), 0, order.shape[1] - 1)
+        new = columns == position[:, None]
+        if order.shape[1]:
+            order = numpy.take_along_axis(order, source, axis=1)
+            heights = numpy.take_along_axis(heights, source, axis=1)
+        else:
+            order = numpy.empty((batch, 1), dtype=int)
+            heights = numpy.empty((batch, 1))
+        order[new] = n_taxa + k
+        heights[new] = height
+    return merges
+
+
+def preorder(merges):
+    """Calculate the pre-order position of each node from the merges.
+
+    Return a (batch, nodes) array with the pre-order index of each node
+    and a (batch, nodes) array of parents in pre-order numbering.
+
+    """
+    batch, n_inner, _ = merges.shape
+    n_taxa = n_inner + 1
+    n_nodes = n_taxa + n_inner
+    rows = numpy.arange(batch)
+    # Children are always created before their parent, so increasing node
+    # number is a post-order walk, and decreasing a pre-order walk.
+    size = numpy.ones((batch, n_nodes), dtype=int)
+    for k in range(n_inner):
+        size[:, n_taxa + k] += (size[rows, merges[:, k, 0]] +
+                                size[rows, merges[:, k, 1]])
+    position = numpy.zeros((batch, n_nodes), dtype=int)
+    parent = numpy.full((batch, n_nodes), -1)
+    for k in range(n_inner - 1, -1, -1):
+        first, second = merges[:, k, 0], merges[:, k, 1]
+        start = position[:, n_taxa + k]
+        position[rows, first] = start + 1
+        position[rows, second] = start + 1 + size[rows, first]
+        parent[rows, start + 1] = start
+        parent[rows, start + 1 + size[rows, first]] = start
+    return position, parent
+
+
+def create_trees(taxa, rng, batch, min_length, max_length,
+                 balanced=False):
+    """Generate a batch of random trees with uniform branch lengths.
+
+    Return a list of `Tree` objects.
+
+    """
+    n_taxa = len(taxa)
+    lengths = rng.uniform(min_length, max_length,
+                          size=(batch, 2 * n_taxa - 1))
+    if n_taxa == 1:
+        return [Tree([-1], length, taxa) for length in lengths]
+    if balanced:
+        merges = balanced_merges(rng, n_taxa, lengths)
+    else:
+        merges = random_merges(rng, n_taxa, batch)
+    position, parent = preorder(merges)
+    names = numpy.full((batch, 2 * n_taxa - 1), None, dtype=object)
+    names[numpy.arange(batch)[:, None], position[:, :n_taxa]] = list(taxa)
+    lengths_in_order = numpy.empty_like(lengths)
+    numpy.put_along_axis(lengths_in_order, position, lengths, axis=1)
+    return [Tree(*tree) for tree in zip(parent, lengths_in_order, names)]
+
+
+def generate_batch(seed, batch, taxa, min_length, max_length,
+                   balanced=False):
+    """Generate a batch of trees in Newick format from a SeedSequence."""
+    rng = numpy.random.Generator(numpy.random.PCG64(seed))
+    return [tree.newick() + ";\n"
+            for tree in create_trees(taxa, rng, batch,
+                                     min_length, max_length, balanced)]
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=__doc__)
 
@@ -87,30 +213,42 @@ if __name__ == "__main__":
                         nargs="+", default=list("ABCDEFGHIJKLMN"),
                         help="Taxon names")
     parser.add_argument('--max', type=int, default=1100,
-                        help="Minimum number of change events along a branch")
-    parser.add_argument('--min', type=int, default=900,
                         help="Maximum number of change events along a branch")
+    parser.add_argument('--min', type=int, default=900,
+                        help="Minimum number of change events along a branch")
     parser.add_argument("--output", "-o", default=sys.stdout,
                         type=argparse.FileType('w'),
                         help="Filename to write the tree to.")
-    parser.add_argument("--seed", "-s",
+    parser.add_argument("--seed", "-s", type=int,
                         help="Random number generator seed.")
     parser.add_argument(
-        "--balanced", dest="generator", action="store_const",
-        const=create_balanced_random_tree,
-        default=create_random_tree,
+        "--balanced", action="store_true",
+        default=False,
         help="Create a tree with roughly balanced node heights")
+    parser.add_argument(
+        "--batch-size", type=int, default=1000,
+        help="Number of trees to generate at once. Each batch has its own"
+        " random number stream derived from the seed, so for a given seed"
+        " and batch size, the output does not depend on --processes.")
+    parser.add_argument(
+        "--processes", "-p", type=int, default=1,
+        help="Number of batches to generate in parallel")
 
     args = parser.parse_args()
 
-    if args.seed:
-        random.seed(args.seed)
-
-    for i in range(args.t):
-        tree = args.generator(
-            args.taxa, branch_length=lambda: (
-                random.random() * (args.max - args.min) + args.min))
-
-        args.output.write(
-            tree.newick)
-        args.output.write(";\n")
+    n_batches = -(-args.t // args.batch_size)
+    seeds = numpy.random.SeedSequence(args.seed).spawn(n_batches)
+    sizes = [min(args.batch_size, args.t - b * args.batch_size)
+             for b in range(n_batches)]
+    generate = functools.partial(
+        generate_batch, taxa=args.taxa,
+        min_length=args.min, max_length=args.max,
+        balanced=args.balanced)
+    if args.processes == 1:
+        batches = map(generate, seeds, sizes)
+    else:
+        pool = multiprocessing.Pool(args.processes)
+        batches = pool.starmap(generate, zip(seeds, sizes))
+
+    for trees in batches:
+        args.output.writelines(trees)
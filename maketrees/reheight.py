@@ -10,7 +10,9 @@ adjusting branch lengths.
 import argparse
 import sys
 
-import newick
+import numpy
+
+from simuling.tree import load
 
 
 def normalize_tree(root, mean=lambda x: sum(x) / len(x)):
@@ -36,6 +38,34 @@ def normalize_tree(root, mean=lambda x: sum(x) / len(x)):
     return root.length, root
 
 
+def normalize(tree, mean=lambda x: sum(x) / len(x)):
+    """Ensure all leaves of an array-backed Tree have equal depth.
+
+    This does the same as `normalize_tree`, but in a single iterative
+    post-order pass over the arrays, so it works for trees of any depth.
+    Branch lengths are adjusted in place, missing lengths count as 0.
+
+    """
+    children = tree.children
+    length = numpy.nan_to_num(tree.length)
+    height = numpy.zeros(len(tree))
+    # In pre-order, every node comes after its ancestor, so walking the
+    # nodes backwards visits every subtree before its root.
+    for node in range(len(tree) - 1, -1, -1):
+        if not children[node]:
+            continue
+        heights = [length[c] + height[c] for c in children[node]]
+        node_height = mean(heights)
+        for c, ht in zip(children[node], heights):
+            if ht - length[c] > node_height:
+                node_height = ht - length[c]
+        for c, ht in zip(children[node], heights):
+            length[c] += node_height - ht
+        height[node] = node_height
+    tree.length[1:] = length[1:]
+    return length[0] + height[0], tree
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(__doc__.split("\n")[0])
     parser.add_argument(
@@ -58,7 +88,7 @@ if __name__ == "__main__":
         help="Use maximum to calculate new branch height")
 
     args = parser.parse_args()
-    trees = newick.load(args.trees)
-    for tree in trees:
-        normalize_tree(tree, args.acc)
-    newick.dump(trees, args.output)
+    for tree in load(args.trees):
+        normalize(tree, args.acc)
+        args.output.write(tree.newick())
+        args.output.write(";\n")
@@ -5,44 +5,194 @@
 From a csv file mapping (Language_ID, Feature_ID) pairs to values,
 construct a tree using the neighbor joining algorithm.
 
+The distance methods work on NumPy arrays, but otherwise follow
+Biopython's `DistanceTreeConstructor` step by step (including the
+naming of inner nodes and the breaking of ties), so they write the same
+Newick trees as Biopython's `NewickIO.Writer` would.
+
 """
 
+import re
 import sys
-import pandas
 import argparse
+import functools
+import multiprocessing
+
+import numpy
+import pandas
+
+
+def presence_matrix(wordlist, column="Value"):
+    """Encode the values of each language as presence/absence matrix.
+
+    Return the sorted language IDs and a boolean languages × values matrix
+    which is True where the language has that value in `column`. The
+    language IDs keep their type, so numeric IDs are sorted as numbers,
+    like `groupby` would sort them.
+
+    """
+    language_index, languages = pandas.factorize(
+        wordlist["Language_ID"], sort=True)
+    value_index, _ = pandas.factorize(wordlist[column])
+    known = (language_index >= 0) & (value_index >= 0)
+    matrix = numpy.zeros((len(languages), value_index.max() + 1), dtype=bool)
+    matrix[language_index[known], value_index[known]] = True
+    return languages, matrix
+
+
+def hamming_distances(matrix, block_size=2 ** 23):
+    """Calculate the Hamming distances between the rows of a 0/1 matrix.
+
+    The size of the symmetric difference of two sets is |A| + |B| - 2|A∩B|,
+    and all intersections are calculated using matrix products. The
+    matrix products need floating point numbers, so the columns are
+    converted in blocks of about `block_size` entries at a time.
+
+    """
+    rows, columns = matrix.shape
+    counts = matrix.sum(axis=1, dtype=float)
+    intersections = numpy.zeros((rows, rows))
+    step = max(1, block_size // max(rows, 1))
+    for start in range(0, columns, step):
+        block = matrix[:, start:start + step].astype(float)
+        intersections += block @ block.T
+    distances = counts[:, None] + counts[None, :] - 2 * intersections
+    numpy.fill_diagonal(distances, 0)
+    return distances
+
 
-from Bio.Phylo.TreeConstruction import _DistanceMatrix
-from Bio.Phylo.TreeConstruction import DistanceTreeConstructor
-from Bio.Phylo.NewickIO import Writer
+unquoted_label = re.compile(r"[^\s\(\)\[\]\'\:\;\,]+")
+
+
+def label(name):
+    """Format a node name for Newick, quoting it if necessary."""
+    if unquoted_label.fullmatch(name):
+        return name
+    return "'{:}'".format(name.replace("'", "''"))
+
+
+def subtree(clade, length):
+    """Format a clade, given as (children, label) pair, with branch length.
+    """
+    children, name = clade
+    text = name + ":" + "%1.8g" % (float(length) or 0.0)
+    if children is None:
+        return text
+    return "(" + ",".join(children) + ")" + text
+
+
+def nj(names, distances):
+    """Construct a Neighbor Joining tree, and return it as Newick string.
+
+    `distances` is a square matrix of distances between the taxa `names`.
+    Only O(n²) memory is used.
+
+    """
+    dm = numpy.array(distances, dtype=float)
+    clades = [(None, label(str(name))) for name in names]
+    if len(dm) == 1:
+        return subtree(clades[0], 0) + ";"
+    elif len(dm) == 2:
+        length = dm[1, 0] / 2.0
+        return subtree(([subtree(clades[1], length),
+                         subtree(clades[0], dm[1, 0] - length)],
+                        "Inner"), 0) + ";"
+
+    inner_count = 0
+    while len(dm) > 2:
+        n = len(dm)
+        # Summing sequentially (like cumsum does) keeps the floating point
+        # values, and thus the breaking of ties, identical to Biopython.
+        node_dist = numpy.cumsum(dm, axis=1)[:, -1] / (n - 2)
+        q = dm - node_dist[:, None] - node_dist[None, :]
+        q[~numpy.tri(n, k=-1, dtype=bool)] = numpy.inf
+        min_i, min_j = divmod(int(numpy.argmin(q)), n)
+        if (min_i, min_j) == (1, 0):
+            min_i, min_j = 0, 1
+
+        inner_count += 1
+        length = (dm[min_i, min_j] +
+                  node_dist[min_i] - node_dist[min_j]) / 2.0
+        inner_clade = ([subtree(clades[min_i], length),
+                        subtree(clades[min_j], dm[min_i, min_j] - length)],
+                       "Inner" + str(inner_count))
+        clades[min_j] = inner_clade
+        del clades[min_i]
+
+        others = numpy.ones(n, dtype=bool)
+        others[[min_i, min_j]] = False
+        new = (dm[min_i] + dm[min_j] - dm[min_i, min_j]) / 2.0
+        dm[min_j, others] = new[others]
+        dm[others, min_j] = new[others]
+        dm = numpy.delete(numpy.delete(dm, min_i, axis=0), min_i, axis=1)
+
+    if clades[0] is inner_clade:
+        root = (clades[0][0] + [subtree(clades[1], dm[1, 0])], clades[0][1])
+    else:
+        root = (clades[1][0] + [subtree(clades[0], dm[1, 0])], clades[1][1])
+    return subtree(root, 0) + ";"
+
+
+def upgma(names, distances):
+    """Construct an UPGMA tree, and return it as Newick string.
+
+    Like Biopython, the distance of a new cluster is the plain average of
+    the distances of its two parts.
+
+    """
+    dm = numpy.array(distances, dtype=float)
+    clades = [(None, label(str(name))) for name in names]
+    heights = [0.0 for name in names]
+    if len(dm) == 1:
+        return subtree(clades[0], 0) + ";"
+
+    inner_count = 0
+    while len(dm) > 1:
+        n = len(dm)
+        rows, columns = numpy.tril_indices(n, -1)
+        lower = dm[rows, columns]
+        # Biopython takes the last of several minimal entries.
+        last = len(lower) - 1 - int(numpy.argmin(lower[::-1]))
+        min_i, min_j = rows[last], columns[last]
+        min_dist = lower[last]
+
+        inner_count += 1
+        length_i = min_dist * 1.0 / 2 - heights[min_i]
+        length_j = min_dist * 1.0 / 2 - heights[min_j]
+        inner_clade = ([subtree(clades[min_i], length_i),
+                        subtree(clades[min_j], length_j)],
+                       "Inner" + str(inner_count))
+        heights[min_j] = max(heights[min_i] + length_i,
+                             heights[min_j] + length_j)
+        clades[min_j] = inner_clade
+        del clades[min_i]
+        del heights[min_i]
+
+        others = numpy.ones(n, dtype=bool)
+        others[[min_i, min_j]] = False
+        new = (dm[min_i] + dm[min_j]) / 2
+        dm[min_j, others] = new[others]
+        dm[others, min_j] = new[others]
+        dm = numpy.delete(numpy.delete(dm, min_i, axis=0), min_i, axis=1)
+    return subtree(inner_clade, 0) + ";"
 
 
 def nj_wordlist(
         wordlist,
         column="Value",
-        method=DistanceTreeConstructor.nj):
+        method=nj):
     """Create a tree using Hamming distances.
 
     From the CLDF Dataframe `wordlist`, create a tree using a distance
     method (neighbor joining, the default, or UPGMA) based on the
     Hamming distance (size of the symmetric difference) of
-    presence/absence of the set of values in `column`.
+    presence/absence of the set of values in `column`. Return the tree
+    in Newick format.
 
     """
     wordlist = pandas.read_csv(wordlist, sep="\t")
-    cogids = []
-    languages = []
-    for language, data in wordlist.groupby("Language_ID"):
-        languages.append(language)
-        cogids.append(set(data[column]))
-
-    dm = _DistanceMatrix(languages, [
-        [len(cogids[i] ^ cogids[j])
-         for j in range(i + 1)]
-        for i in range(len(cogids))])
-
-    constructor = DistanceTreeConstructor()
-    tree = method(constructor, dm)
-    return tree
+    languages, matrix = presence_matrix(wordlist, column)
+    return method(languages, hamming_distances(matrix))
 
 
 if __name__ == "__main__":
@@ -51,7 +201,6 @@ if __name__ == "__main__":
         "to word list data")
     parser.add_argument(
         "wordlist", nargs="+",
-        type=argparse.FileType('r'),
         help="The word list input files")
     parser.add_argument(
         "--output", "-o",
@@ -64,15 +213,24 @@ if __name__ == "__main__":
         help="The column to calculate the Hamming distances on")
     parser.add_argument(
         "--upgma",
-        default=DistanceTreeConstructor.nj,
+        default=nj,
         dest="method",
-        action="store_const", const=DistanceTreeConstructor.upgma,
+        action="store_const", const=upgma,
         help="Use UPGMA instead of NJ to construct the tree")
+    parser.add_argument(
+        "--processes", "-p", type=int,
+        default=1,
+        help="Number of word lists to process in parallel")
 
     args = parser.parse_args()
 
-    trees = []
-    for wordlist in args.wordlist:
-        trees.append(nj_wordlist(wordlist, args.value_column))
+    build = functools.partial(
+        nj_wordlist, column=args.value_column, method=args.method)
+    if args.processes == 1:
+        trees = map(build, args.wordlist)
+    else:
+        pool = multiprocessing.Pool(args.processes)
+        trees = pool.imap(build, args.wordlist)
 
-    Writer(trees).write(args.output)
+    for tree in trees:
+        args.output.write(tree + "\n")
@@ -6,15 +6,293 @@ Provide functions and a cli interface to sample Swadesh-style word
 lists with cognate coding and cognate class presence/absence tables
 from input whole-vocabulary word lists.
 
+The vocabulary is read in chunks of rows, and each chunk is reduced to
+grouped weight sums before the next one is read, so the whole input
+never has to be held in memory.
+
 """
 
-import collections
+import os
+import csv
 import sys
 import argparse
-import csv
+import tempfile
+
+import numpy
+import pandas
+
+from simuling.cache import cache_directory
+
+
+COLUMNS = {"Language_ID", "Feature_ID", "Weight",
+           "Concept_CogID", "Global_CogID"}
+
+
+def read_vocabulary(file, chunksize=2 ** 20):
+    """Read a tab-separated whole-vocabulary word list in chunks of rows.
+
+    `file` is a file object or a path. Paths ending in .gz or .zst are
+    decompressed while reading, and "-" stands for the standard input.
+
+    """
+    if file == "-":
+        file = sys.stdin
+    return pandas.read_csv(
+        file, sep="\t", chunksize=chunksize,
+        usecols=lambda column: column in COLUMNS,
+        dtype={"Language_ID": str, "Feature_ID": str,
+               "Concept_CogID": str, "Global_CogID": str,
+               "Weight": float},
+        keep_default_na=False)
+
+
+def combine(parts, how):
+    """Combine partial aggregates of chunks.
+
+    Partial results are Series with a (Multi)Index. They are combined by
+    grouping the index again using the reduction `how`. Groups stay in
+    order of their first appearance.
+
+    """
+    data = pandas.concat(parts)
+    return data.groupby(level=list(range(data.index.nlevels)),
+                        sort=False).agg(how)
+
+
+class Aggregates:
+    """Per-group aggregates of a vocabulary, computed in one pass.
+
+    `weights` sums the weights of each (concept, language, cognate class),
+    and `activation` holds the maximum weight of each (language, global
+    cognate class). Only the aggregates listed in `needs` are computed. If
+    `concepts` is given, `weights` only covers the concepts which are in
+    `concepts` when upper-cased.
+
+    All samplers working on the same aggregates share them, and also share
+    the derived weights with cognate classes split by concept.
+
+    """
+    def __init__(self, chunks, needs=("weights", "activation"),
+                 concepts=None, max_parts=16):
+        weights = []
+        activation = []
+        for chunk in chunks:
+            if "weights" in needs:
+                rows = chunk
+                if concepts is not None:
+                    rows = chunk[chunk["Feature_ID"].str.upper().isin(
+                        concepts)]
+                weights.append(rows.groupby(
+                    ["Feature_ID", "Language_ID", "Concept_CogID"],
+                    sort=False)["Weight"].sum())
+                if len(weights) > max_parts:
+                    weights = [combine(weights, "sum")]
+            if "activation" in needs:
+                activation.append(chunk.groupby(
+                    ["Language_ID", "Global_CogID"],
+                    sort=False)["Weight"].max())
+                if len(activation) > max_parts:
+                    activation = [combine(activation, "max")]
+        self.weights = combine(weights, "sum") if weights else None
+        self.activation = combine(activation, "max") if activation else None
+        self._split_weights = None
+
+    @classmethod
+    def of(cls, vocabulary, needs):
+        """Aggregate chunks of vocabulary rows, unless that is done already.
+        """
+        if isinstance(vocabulary, cls):
+            return vocabulary
+        return cls(vocabulary, needs)
+
+    def concept_weights(self, cross_semantic_cognates=False):
+        """Return the weights of (concept, language, cognate class) triples.
+
+        Unless `cross_semantic_cognates`, cognate classes are split by
+        concept.
 
+        """
+        if cross_semantic_cognates:
+            return self.weights
+        if self._split_weights is None:
+            self._split_weights = split_cognate_classes(self.weights)
+        return self._split_weights
+
+
+def split_cognate_classes(weights):
+    """Make sure cognate classes do not span concepts.
+
+    Number the (concept, cognate class) pairs in the order they first
+    appear in `weights`.
+
+    """
+    pairs = pandas.MultiIndex.from_arrays([
+        weights.index.get_level_values("Feature_ID"),
+        weights.index.get_level_values("Concept_CogID")])
+    codes, _ = pandas.factorize(pairs)
+    return weights.set_axis(pandas.MultiIndex.from_arrays([
+        weights.index.get_level_values("Feature_ID"),
+        weights.index.get_level_values("Language_ID"),
+        codes], names=weights.index.names))
+
+
+def most_common(weights, max_synonyms):
+    """Keep the `max_synonyms` heaviest words of each concept and language.
+
+    Ties are broken by order of first appearance.
+
+    """
+    weights = weights.sort_values(ascending=False, kind="stable")
+    return weights.groupby(
+        level=["Feature_ID", "Language_ID"],
+        sort=False).head(max_synonyms)
+
+
+class WordList:
+    """A sampled word list, with one value (or '-') per row."""
+    def __init__(self, table):
+        self.table = table
+
+    def write_cldf(self, file):
+        writer = csv.writer(file)
+        writer.writerow(("Language_ID", "Feature_ID", "Value"))
+        writer.writerows(self.table.itertuples(index=False))
 
-from pyconcepticon.api import Concepticon
+    def presence_matrix(self):
+        """Binarize the word list.
+
+        Every (concept, value) pair becomes a presence/absence character.
+        Characters are missing in a language that has no value, or '-',
+        for their concept.
+
+        """
+        data = self.table[self.table["Value"] != "-"]
+        languages, language_index = _index(self.table["Language_ID"])
+        features, feature_index = _index(data["Feature_ID"])
+        pairs = pandas.MultiIndex.from_arrays(
+            [data["Feature_ID"], data["Value"].astype(str)])
+        character_index, characters = pandas.factorize(pairs)
+        feature_of = features.get_indexer(
+            characters.get_level_values(0))
+        present_languages = languages.get_indexer(data["Language_ID"])
+        return PresenceMatrix(
+            languages,
+            pandas.Index(["{:}_{:}".format(f, v) for f, v in characters]),
+            present_languages, character_index,
+            features=features,
+            feature_of=feature_of,
+            known=(present_languages, feature_index))
+
+
+def _index(values):
+    codes, uniques = pandas.factorize(values)
+    return pandas.Index(uniques), codes
+
+
+class PresenceMatrix:
+    """A sparse presence/absence matrix of languages × characters.
+
+    Only the (language, character) index pairs of present cells are
+    stored. If `features` are given, each character belongs to the feature
+    `feature_of[character]`, and the (language, feature) index pairs in
+    `known` list which features have data for a language. All characters
+    of other features are missing in that language.
+
+    """
+    def __init__(self, languages, characters,
+                 language_index, character_index,
+                 features=None, feature_of=None, known=None):
+        self.languages = languages
+        self.characters = characters
+        n = len(characters)
+        self.present = numpy.unique(
+            numpy.asarray(language_index, dtype=numpy.int64) * n +
+            numpy.asarray(character_index, dtype=numpy.int64))
+        self.features = features
+        self.feature_of = feature_of
+        if known is not None:
+            known_language, known_feature = known
+            self.known = numpy.unique(
+                numpy.asarray(known_language, dtype=numpy.int64) *
+                len(features) +
+                numpy.asarray(known_feature, dtype=numpy.int64))
+
+    def presence_matrix(self):
+        return self
+
+    def rows(self, symbols=b"01?"):
+        """Generate (language, row) pairs, with rows as byte strings."""
+        n = len(self.characters)
+        absent, present, missing = symbols
+        bounds = numpy.searchsorted(
+            self.present, numpy.arange(len(self.languages) + 1) * n)
+        if self.features is not None:
+            m = len(self.features)
+            known_bounds = numpy.searchsorted(
+                self.known, numpy.arange(len(self.languages) + 1) * m)
+        for i, language in enumerate(self.languages):
+            if self.features is None:
+                row = numpy.full(n, absent, dtype=numpy.uint8)
+            else:
+                row = numpy.full(n, missing, dtype=numpy.uint8)
+                known = self.known[
+                    known_bounds[i]:known_bounds[i + 1]] - i * m
+                row[numpy.isin(self.feature_of, known)] = absent
+            row[self.present[bounds[i]:bounds[i + 1]] - i * n] = present
+            yield language, row.tobytes()
+
+    def write_cldf(self, file):
+        """Write the matrix as CLDF-like list of all cells."""
+        writer = csv.writer(file)
+        writer.writerow(("Language_ID", "Feature_ID", "Value"))
+        terminator = writer.dialect.lineterminator
+        labels = [_csv_field(c) for c in self.characters]
+        # One pre-formatted line ending per cell value, so every language
+        # is written using vectorized selection and a single join.
+        endings = numpy.array([
+            ["," + label + ",False" + terminator for label in labels],
+            ["," + label + ",True" + terminator for label in labels],
+            ["," + label + "," + terminator for label in labels]],
+            dtype=object)
+        columns = numpy.arange(len(labels))
+        for language, row in self.rows(symbols=b"\x00\x01\x02"):
+            language = _csv_field(language)
+            cells = endings[numpy.frombuffer(row, dtype=numpy.uint8),
+                            columns]
+            file.write(language + language.join(cells))
+
+
+def _csv_field(value):
+    value = str(value)
+    if any(c in value for c in ',"\r\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def write_fasta(matrix, file):
+    """Write a presence/absence matrix as FASTA alignment."""
+    for language, row in matrix.rows():
+        file.write(">{:}\n{:}\n".format(language, row.decode("ascii")))
+
+
+def write_nexus(matrix, file):
+    """Write a presence/absence matrix as binary NEXUS data block."""
+    file.write("#NEXUS\n\nBEGIN DATA;\n")
+    file.write("  DIMENSIONS NTAX={:d} NCHAR={:d};\n".format(
+        len(matrix.languages), len(matrix.characters)))
+    file.write('  FORMAT DATATYPE=STANDARD MISSING=? GAP=- SYMBOLS="01";\n')
+    file.write("  MATRIX\n")
+    for language, row in matrix.rows():
+        file.write("    {:}  {:}\n".format(
+            _nexus_name(language), row.decode("ascii")))
+    file.write("  ;\nEND;\n")
+
+
+def _nexus_name(name):
+    name = str(name)
+    if any(not c.isalnum() and c not in "_.-" for c in name):
+        return "'" + name.replace("'", "''") + "'"
+    return name
 
 
 def swadesh_sampler(vocabulary, n_items=200, max_synonyms=1,
@@ -26,42 +304,38 @@ def swadesh_sampler(vocabulary, n_items=200, max_synonyms=1,
     concepts.
 
     """
-    basic_concepts = collections.Counter()
-    words_for_concept = {}
-    languages = set()
-    if not cross_semantic_cognates:
-        set_mapper = {}
-    for i, line in enumerate(vocabulary):
-        concept = line["Feature_ID"]
-        language = line["Language_ID"]
-        weight = float(line["Weight"])
-        concept_set = line["Concept_CogID"]
-
-        if not cross_semantic_cognates:
-            concept_set = set_mapper.setdefault(
-                (concept, concept_set),
-                len(set_mapper))
-
-        languages.add(language)
-        basic_concepts[concept] += weight
-        synonyms = words_for_concept.setdefault(
-            concept, {}).setdefault(language, collections.Counter())
-        synonyms[concept_set] += weight
-
-    # Output
-    yield ("Language_ID", "Feature_ID", "Value")
-    for concept, sum_weight in basic_concepts.most_common(n_items):
-        for language in languages:
-            items = words_for_concept[concept].get(language)
-            if not items:
-                yield (language, concept, "-")
-            else:
-                for cognate_set, weight in items.most_common(max_synonyms):
-                    yield (language, concept, cognate_set)
+    weights = Aggregates.of(
+        vocabulary, swadesh_sampler.needs).concept_weights(
+            cross_semantic_cognates)
+    languages = weights.index.unique(level="Language_ID")
+
+    basic_concepts = weights.groupby(
+        level="Feature_ID", sort=False).sum().nlargest(n_items).index
+    weights = weights[
+        weights.index.get_level_values("Feature_ID").isin(basic_concepts)]
+    synonyms = most_common(weights, max_synonyms).index.to_frame(
+        index=False, name=["Feature_ID", "Language_ID", "Value"])
+
+    grid = pandas.MultiIndex.from_product(
+        [basic_concepts, languages], names=["Feature_ID", "Language_ID"])
+    missing = grid.difference(pandas.MultiIndex.from_frame(
+        synonyms[["Feature_ID", "Language_ID"]])).to_frame(index=False)
+    missing["Value"] = "-"
+
+    table = pandas.concat([synonyms, missing], ignore_index=True)
+    table["concept_rank"] = basic_concepts.get_indexer(table["Feature_ID"])
+    table["language_rank"] = languages.get_indexer(table["Language_ID"])
+    table = table.sort_values(["concept_rank", "language_rank"],
+                              kind="stable")
+    return WordList(table[["Language_ID", "Feature_ID", "Value"]])
+
 
+swadesh_sampler.needs = {"weights"}
+swadesh_sampler.concepts = None
 
-def conceptlist_sampler_factory(conceptlist, name):
-    """Create a Swadesh-like sampler for a given concept list."""
+
+def conceptlist_sampler_factory(glosses, name):
+    """Create a Swadesh-like sampler for a given list of concept glosses."""
     def conceptlist_sampler(vocabulary, cross_semantic_cognates=False,
                             max_synonyms=1, **kwargs):
         """Build a word list from a vocabulary.
@@ -71,37 +345,31 @@ def conceptlist_sampler_factory(conceptlist, name):
         list {:s}.
 
         """
-        words_for_concept = {concept.concepticon_gloss: {}
-                             for concept in conceptlist.concepts.values()}
-
-        if not cross_semantic_cognates:
-            set_mapper = {}
-        for i, line in enumerate(vocabulary):
-            concept = line["Feature_ID"].upper()
-            if concept not in words_for_concept:
-                continue
-
-            language = line["Language_ID"]
-            weight = float(line["Weight"])
-            concept_set = line["Concept_CogID"]
-
-            if not cross_semantic_cognates:
-                concept_set = set_mapper.setdefault(
-                    (concept, concept_set),
-                    len(set_mapper))
-
-            synonyms = words_for_concept[concept].setdefault(
-                language, collections.Counter())
-            synonyms[concept_set] += weight
-
-        # Output
-        yield ("Language_ID", "Feature_ID", "Value")
-        for concept, words in words_for_concept.items():
-            for language, items in words.items():
-                for cognate_set, weight in items.most_common(max_synonyms):
-                    yield (language, concept, cognate_set)
+        weights = Aggregates.of(
+            vocabulary, conceptlist_sampler.needs).concept_weights(
+                cross_semantic_cognates)
+        concepts = weights.index.get_level_values("Feature_ID").str.upper()
+        selected = concepts.isin(conceptlist_sampler.concepts)
+        weights = combine([pandas.Series(
+            weights.values[selected],
+            index=pandas.MultiIndex.from_arrays(
+                [concepts[selected]] +
+                [weights.index.get_level_values(level)[selected]
+                 for level in (1, 2)],
+                names=weights.index.names))], "sum")
+        languages = weights.index.unique(level="Language_ID")
+        table = most_common(weights, max_synonyms).index.to_frame(
+            index=False, name=["Feature_ID", "Language_ID", "Value"])
+        concepts = pandas.Index(glosses).drop_duplicates()
+        table["concept_rank"] = concepts.get_indexer(table["Feature_ID"])
+        table["language_rank"] = languages.get_indexer(table["Language_ID"])
+        table = table.sort_values(["concept_rank", "language_rank"],
+                                  kind="stable")
+        return WordList(table[["Language_ID", "Feature_ID", "Value"]])
     conceptlist_sampler.__doc__ = conceptlist_sampler.__doc__.format(
         name)
+    conceptlist_sampler.needs = {"weights"}
+    conceptlist_sampler.concepts = set(glosses)
     return conceptlist_sampler
 
 
@@ -112,52 +380,174 @@ def cognate_presence_sampler(vocabulary, min_activation=1, **kwargs):
     cognate class whether that cognate class is present
     (i.e. Weight>min_activation) or absent in the language.
     """
-    languages = set()
-    cognate_classes = set()
-    present = set()
-    for i, line in enumerate(vocabulary):
-        language = line["Language_ID"]
-        weight = float(line["Weight"])
-        cognate_class = line["Global_CogID"]
-        if weight > min_activation:
-            languages.add(language)
-            cognate_classes.add(cognate_class)
-            present.add((language, cognate_class))
-    # Output
-    yield ("Language_ID", "Feature_ID", "Value")
-    for language in languages:
-        for cognate_class in cognate_classes:
-            yield (language,
-                   cognate_class,
-                   (language, cognate_class) in present)
+    activation = Aggregates.of(
+        vocabulary, cognate_presence_sampler.needs).activation
+    present = activation[activation > min_activation].index
+    languages, language_index = _index(
+        present.get_level_values("Language_ID"))
+    cognate_classes, class_index = _index(
+        present.get_level_values("Global_CogID"))
+    return PresenceMatrix(languages, cognate_classes,
+                          language_index, class_index)
+
+
+cognate_presence_sampler.needs = {"activation"}
+cognate_presence_sampler.concepts = None
+
+
+def write_sample(sample, format, file):
+    """Write a sample as CLDF, or its presence matrix as FASTA or NEXUS."""
+    if format == "fasta":
+        write_fasta(sample.presence_matrix(), file)
+    elif format == "nexus":
+        write_nexus(sample.presence_matrix(), file)
+    else:
+        sample.write_cldf(file)
+    file.flush()
 
 
 samplers = {
     'swadesh': swadesh_sampler,
     'etymo': cognate_presence_sampler
 }
-cn = Concepticon()
-for name, conceptlist in cn.conceptlists.items():
-    samplers[name] = conceptlist_sampler_factory(conceptlist, name)
 
 
-if __name__ == '__main__':
+def conceptlist_glosses(name, cache=None, refresh=False):
+    """Load the Concepticon glosses of the concept list `name`.
+
+    Loading Concepticon is slow, so the glosses of each list are cached as
+    plain text, one gloss per line, in the directory `cache`.
+
+    """
+    if cache is None:
+        cache = cache_directory() / "conceptlists"
+    path = cache / "{:}.txt".format(name)
+    if not refresh:
+        try:
+            with path.open(encoding="utf-8") as cached:
+                return cached.read().splitlines()
+        except FileNotFoundError:
+            pass
+
+    from pyconcepticon.api import Concepticon
+    conceptlist = Concepticon().conceptlists[name]
+    glosses = [concept.concepticon_gloss
+               for concept in conceptlist.concepts.values()
+               if concept.concepticon_gloss]
+
+    cache.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file first, so that concurrent invocations never
+    # see a partial list.
+    with tempfile.NamedTemporaryFile(
+            "w", dir=str(cache), delete=False, encoding="utf-8") as file:
+        file.write("\n".join(glosses))
+    os.replace(file.name, str(path))
+    return glosses
+
+
+def get_sampler(name, refresh=False):
+    """Look up a sampler by name.
+
+    Samplers for Concepticon concept lists are only created when they are
+    first requested.
+
+    """
+    try:
+        return samplers[name]
+    except KeyError:
+        pass
+    samplers[name] = conceptlist_sampler_factory(
+        conceptlist_glosses(name, refresh=refresh), name)
+    return samplers[name]
+
+
+def parse_sampler(spec, parser):
+    """Parse a SAMPLER[:OPTION=VALUE,...] specification.
+
+    Options are long command line options of `parser`, without the leading
+    dashes, and are converted like them. Flags take no value, or a boolean
+    one. Return the sampler name and a dictionary of settings.
+
+    """
+    name, _, options = spec.partition(":")
+    settings = {}
+    for option in filter(None, options.split(",")):
+        key, has_value, value = option.partition("=")
+        key = "--" + key.strip().replace("_", "-")
+        action = parser._option_string_actions.get(key)
+        if action is None or action.dest in {
+                "samplers", "vocabulary_file", "chunksize",
+                "refresh_conceptlists", "help"}:
+            parser.error("Unknown sampler option {:}".format(option))
+        if action.nargs == 0:
+            if has_value and value.lower() not in {"1", "true", "yes"}:
+                continue
+            value = action.const
+        elif action.type is not None:
+            value = action.type(value)
+        if action.choices is not None and value not in action.choices:
+            parser.error("Invalid value for sampler option {:}".format(
+                option))
+        settings[action.dest] = value
+    return name, settings
+
+
+def shared_output(jobs):
+    """Find a file that several samplers opened separately for writing.
+
+    Samplers writing to the same stream, like the default output, write one
+    after the other, but separately opened files would overwrite each
+    other. Return the name of such a file, or None.
+
+    """
+    streams = {}
+    for sampler, settings in jobs:
+        output = settings["output"]
+        if output is sys.stdout:
+            continue
+        path = os.path.realpath(output.name)
+        if streams.setdefault(path, output) is not output:
+            return output.name
+    return None
+
+
+def argparser():
     parser = argparse.ArgumentParser(
         "Swadesh-sample a whole-vocabulary word list")
-    parser.add_argument("--vocabulary-file", type=argparse.FileType('r'),
-                        default=sys.stdin,
-                        help="CLDF word list of the complete lexicon")
+    parser.add_argument("--vocabulary-file", default="-",
+                        help="CLDF word list of the complete lexicon,"
+                        " possibly compressed with gzip or Zstandard")
     parser.add_argument("--output", "-o", type=argparse.FileType('w'),
                         default=sys.stdout)
-    parser.add_argument("--fasta", "-f", action="store_true", default=False,
+    parser.add_argument("--format", default="cldf",
+                        choices=["cldf", "fasta", "nexus"],
+                        help="Output format. FASTA and NEXUS output contain"
+                        " a binary presence/absence matrix.")
+    parser.add_argument("--fasta", "-f", action="store_const", const="fasta",
+                        dest="format",
                         help="Output in FASTA format, instead of CLDF")
-    parser.add_argument("--sampler", "-s", default="swadesh",
-                        choices=list(samplers.keys()),
-                        help="The sampling method to use")
+    parser.add_argument("--nexus", action="store_const", const="nexus",
+                        dest="format",
+                        help="Output a NEXUS data block, instead of CLDF")
+    parser.add_argument("--chunksize", type=int, default=2 ** 20,
+                        help="Number of vocabulary rows to read at once")
+    parser.add_argument("--sampler", "-s", action="append",
+                        dest="samplers", metavar="SAMPLER[:OPTION=VALUE,...]",
+                        help="The sampling method to use: swadesh, etymo,"
+                        " or the name of a Concepticon concept list."
+                        " Can be given multiple times, to feed all samplers"
+                        " from one pass over the vocabulary. Options, such"
+                        " as output=FILE or n-items=N, override the"
+                        " command line options for one sampler only."
+                        " (default: swadesh)")
+    parser.add_argument("--refresh-conceptlists", action="store_true",
+                        default=False,
+                        help="Reload concept lists from Concepticon, even if"
+                        " they are cached")
     group = parser.add_argument_group("Swadesh-style word lists")
     group.add_argument(
-        "--swadesh", action="store_const", const="swadesh",
-        dest="sampler",
+        "--swadesh", action="append_const", const="swadesh",
+        dest="samplers",
         help="""Sample a Swadesh word list of cognate classes in meaning
         slots. Equivalent to --sampler=swadesh""")
     group.add_argument(
@@ -175,8 +565,8 @@ if __name__ == '__main__':
     group = parser.add_argument_group(
         "Etymological dictionary-style word lists")
     group.add_argument(
-        "--etymo", action="store_const", const="etymo",
-        dest="sampler",
+        "--etymo", action="append_const", const="etymo",
+        dest="samplers",
         help="""Sample an etymological dictionary, i.e. a CLDF that lists for every
         known root whether or not that root has a reflex in the
         language.""")
@@ -184,14 +574,43 @@ if __name__ == '__main__':
         "--min-activation", type=float, default=1,
         help="""The minimum weight value of words in the vocabulary to be included
 in the etymological dictionary.""")
+    return parser
+
+
+if __name__ == '__main__':
+    parser = argparser()
     args = parser.parse_args()
 
-    data = csv.DictReader(args.vocabulary_file, dialect='excel-tab')
-    sampler = samplers[args.sampler](data, **vars(args))
-    if args.fasta:
-        ...
-        raise NotImplementedError("FASTA output is not available")
-    else:
-        writer = csv.writer(args.output)
-        sampler = samplers[args.sampler]
-        writer.writerows(sampler(data, **vars(args)))
+    jobs = []
+    for spec in args.samplers or ["swadesh"]:
+        name, options = parse_sampler(spec, parser)
+        try:
+            sampler = get_sampler(name, args.refresh_conceptlists)
+        except KeyError:
+            parser.error(
+                "Unknown sampler {:}: Use swadesh, etymo, or a Concepticon"
+                " concept list".format(name))
+        settings = dict(vars(args))
+        settings.update(options)
+        jobs.append((sampler, settings))
+    duplicate = shared_output(jobs)
+    if duplicate is not None:
+        parser.error("Several samplers would overwrite {:}: Give each"
+                     " sampler its own output file".format(duplicate))
+
+    needs = set()
+    concepts = set()
+    for sampler, settings in jobs:
+        needs |= sampler.needs
+        if "weights" in sampler.needs:
+            if sampler.concepts is None or concepts is None:
+                concepts = None
+            else:
+                concepts |= sampler.concepts
+
+    aggregates = Aggregates(
+        read_vocabulary(args.vocabulary_file, args.chunksize),
+        needs, concepts)
+    for sampler, settings in jobs:
+        write_sample(sampler(aggregates, **settings),
+                     settings["format"], settings["output"])
@@ -1,11 +1,8 @@
-from csvw import UnicodeReader
-from csvw.dsv_dialects import Dialect
-
-import matplotlib.pyplot as plt
-import pandas
-import os
+import functools
+from pathlib import Path
 
 from . import cli
+from .compression import open_input
 
 
 # This can be calculated from the data
@@ -218,10 +215,12 @@ def image_name(key):
 
 def properties(file):
     if not (file.name.startswith("long_branch_") and
-            file.name.endswith(".csv")):
+            file.name.endswith((".csv", ".csv.gz", ".csv.zst"))):
         return None
+    from csvw import UnicodeReader
+    from csvw.dsv_dialects import Dialect
     properties = {}
-    with UnicodeReader(file.open(), dialect=Dialect()) as reader:
+    with UnicodeReader(open_input(file), dialect=Dialect()) as reader:
         for line in reader:
             pass
         for line, argument in reader.comments:
@@ -230,23 +229,32 @@ def properties(file):
     return properties
 
 
-default_properties = cli.argparser().parse_args([])
-cli.phylogeny(default_properties)
-default_properties = {
-    "--{:s}".format(key): str(value)
-    for key, value in cli.echo(default_properties)}
+@functools.lru_cache()
+def default_properties():
+    """Return the command line arguments of a default simulation run.
+
+    The result maps option strings to values, like the parameters embedded
+    in the output of a simulation.
+
+    """
+    args = cli.argparser().parse_args([])
+    args.phylogeny = cli.phylogeny(args)
+    return {
+        "--{:s}".format(key): str(value)
+        for key, value in cli.echo(args)}
 
 
 def property_key(property):
     def key(file):
-        value = default_properties.get(property, True)
+        defaults = default_properties()
+        value = defaults.get(property, True)
         props = properties(file)
         if props is None:
             return None
         for k, v in props.items():
             if k == property:
                 value = v
-            elif k in default_properties and v != default_properties[k]:
+            elif k in defaults and v != defaults[k]:
                 return None
         return value
     return key
@@ -280,18 +288,20 @@ def synonymity(data):
 
 def load(key, path="../", sample_data=sample_data):
     """Load all files according to given key from directory path."""
+    import pandas
     n = {}
     p = {}
     s = {}
-    for file in os.listdir(path):
+    for file in Path(path).iterdir():
         weight = key(file)
         if weight is not None:
-            all_data = pandas.read_csv(
-                os.path.join(path, file),
-                sep=",",
-                na_values=[""],
-                keep_default_na=False,
-                encoding='utf-8')
+            with open_input(file) as data:
+                all_data = pandas.read_csv(
+                    data,
+                    sep=",",
+                    na_values=[""],
+                    keep_default_na=False,
+                    comment="#")
 
             for language_id, language_data in all_data.groupby("Language_ID"):
                 if int(language_id) > 8e6:
@@ -311,6 +321,7 @@ def load(key, path="../", sample_data=sample_data):
 
 
 def plot_something(n, labels, xlabel, ylabel, showfliers=True):
+    import matplotlib.pyplot as plt
     plt.boxplot([n[i] for i in labels], labels=labels, showfliers=showfliers)
 
     plt.xlabel(xlabel)
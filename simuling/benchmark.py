@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+"""Measure performance characteristics of the simulation tooling.
+
+`imports` measures the import time of simuling modules, which is paid
+for every `python3 -m simuling` run of a parameter sweep. `pickle`
+measures the cost of sending languages between processes.
+
+"""
+
+import sys
+import time
+import pickle
+import argparse
+import subprocess
+
+
+def import_times(module, python=sys.executable):
+    """Import `module` in a fresh interpreter and report import times.
+
+    Return a dictionary mapping every module imported along the way to its
+    cumulative import time in microseconds, as reported by `-X importtime`.
+
+    """
+    process = subprocess.run(
+        [python, "-X", "importtime", "-c", "import " + module],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    times = {}
+    for line in process.stderr.split("\n"):
+        if not line.startswith("import time:"):
+            continue
+        try:
+            own, cumulative, name = line[len("import time:"):].split("|")
+            times[name.strip()] = int(cumulative)
+        except ValueError:
+            # The header line
+            continue
+    return times
+
+
+def example_language(concepts=1000, edges=5000, steps=1000, seed=0):
+    """Simulate a language on a random semantic network for benchmarks.
+
+    The network is loaded from GML, like in a simulation run, so it is
+    cached and pickled by reference.
+
+    """
+    import networkx
+    import numpy
+    from .simulation import SemanticNetwork, Language, constant_zero
+    from collections import defaultdict
+    random = numpy.random.RandomState(seed)
+    graph = networkx.relabel_nodes(
+        networkx.gnm_random_graph(concepts, edges, seed=seed),
+        lambda i: "CONCEPT {:d}".format(i))
+    for u, v, data in graph.edges(data=True):
+        data["weight"] = random.randint(1, 20)
+    semantics = SemanticNetwork.load_from_gml(
+        networkx.generate_gml(graph), "weight")
+    language = Language({concept: defaultdict(constant_zero, {c: 100})
+                         for c, concept in enumerate(semantics)}, semantics)
+    for i in range(steps):
+        language.step(random=random)
+    return language
+
+
+class LegacyLanguage (dict):
+    """A dictionary that pickles like Language did before __reduce__."""
+
+
+def legacy_pickle(language, protocol=pickle.HIGHEST_PROTOCOL):
+    """Pickle a language like it was pickled before Language.__reduce__.
+
+    That is, as dictionary of defaultdicts, with all its attributes,
+    including the full semantic network.
+
+    """
+    semantics = language.semantics
+    network = type(semantics).__new__(type(semantics))
+    network.__dict__.update(semantics.__dict__)
+    # Without digest, the network cannot be pickled by reference.
+    network.__dict__.pop("_gml_digest", None)
+    legacy = LegacyLanguage(language)
+    legacy.__dict__.update(language.__dict__)
+    legacy.semantics = network
+    return pickle.dumps(legacy, protocol)
+
+
+def round_trip(dump, repeat=5):
+    """Return the size of `dump()` and the fastest dump + load time."""
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        data = dump()
+        pickle.loads(data)
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return len(data), best
+
+
+def imports(args):
+    for module in args.modules:
+        runs = [import_times(module) for i in range(args.repeat)]
+        best = min(runs, key=lambda times: times[module])
+        print("{:s}: {:.1f} ms".format(module, best[module] / 1000))
+        for name, duration in sorted(
+                best.items(), key=lambda x: -x[1])[1:args.top + 1]:
+            print("    {:s}: {:.1f} ms".format(name, duration / 1000))
+
+
+def pickling(args):
+    language = example_language(args.concepts, args.edges, args.steps)
+    print("Language with {:d} concepts and {:d} words".format(
+        len(language), sum(len(words) for words in language.values())))
+    for label, dump in [
+            ("Legacy pickle", lambda: legacy_pickle(language)),
+            ("Language pickle", lambda: pickle.dumps(
+                language, pickle.HIGHEST_PROTOCOL))]:
+        size, duration = round_trip(dump, args.repeat)
+        print("{:s}: {:d} bytes, {:.2f} ms".format(
+            label, size, duration * 1000))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--repeat", type=int, default=5,
+        help="Repeat each measurement this often, and report the fastest"
+        " run. (default: 5)")
+    benchmarks = parser.add_subparsers(dest="benchmark")
+    benchmarks.required = True
+
+    imports_parser = benchmarks.add_parser(
+        "imports", help="Measure import times")
+    imports_parser.set_defaults(run=imports)
+    imports_parser.add_argument(
+        "modules", nargs="*",
+        default=["simuling.cli", "simuling.analysis"],
+        help="The modules to import (default: simuling.cli and"
+        " simuling.analysis)")
+    imports_parser.add_argument(
+        "--top", type=int, default=10,
+        help="Show the slowest top-level imports of each module."
+        " (default: 10)")
+
+    pickle_parser = benchmarks.add_parser(
+        "pickle", help="Measure pickle size and round-trip time of languages")
+    pickle_parser.set_defaults(run=pickling)
+    pickle_parser.add_argument(
+        "--concepts", type=int, default=1000,
+        help="Number of concepts in the random network (default: 1000)")
+    pickle_parser.add_argument(
+        "--edges", type=int, default=5000,
+        help="Number of edges in the random network (default: 5000)")
+    pickle_parser.add_argument(
+        "--steps", type=int, default=1000,
+        help="Number of simulation steps for the language (default: 1000)")
+
+    args = parser.parse_args()
+    args.run(args)
@@ -0,0 +1,177 @@
+"""Cache root languages after a burn-in to equilibrium.
+
+Simulations often start with a long branch that only brings the root
+language to equilibrium, and that branch is the same for every run of a
+sweep. `burned_in` stores the language at the end of such a burn-in in
+the cache, keyed by everything that determines it, so later runs can
+load it instead of simulating it again. The cache is limited in size;
+the least recently used states are removed first.
+
+"""
+
+import os
+import numbers
+import hashlib
+import tempfile
+
+import numpy
+
+from .cache import cache_directory
+from .randomness import BlockRandom, bit_generators
+
+# The stream key of the burn-in. Node stream keys are empty (for the root)
+# or 16 bytes long, so this key cannot collide with them.
+BURN_IN = b"burn-in\0"
+
+# The version of the format of stored states, part of the cache key. States
+# of version 1 lacked the concepts without words.
+STATE_FORMAT = "2"
+
+
+def burn_in_key(language, steps, seed, rng):
+    """Describe a burn-in by a digest, or return None if it is not cacheable.
+
+    The digest covers the semantic network (by its GML digest, weight
+    attribute, neighbor factor and concept weight), the engine and its
+    settings, the initial language with all its words and weights in
+    order, the number of steps, the seed and the random number generator.
+    Burn-ins of networks that are not cached, or of languages with words
+    that are not integers or with concepts that are not strings, are not
+    cacheable.
+
+    """
+    network = language.semantics.registry_key()
+    if network is None:
+        return None
+    if not all(isinstance(concept, str) for concept in language):
+        return None
+    cls, digest, weight_attribute, neighbor_factor, concept_weight = network
+    key = hashlib.sha256("\0".join([
+        cls.__name__, digest, weight_attribute, repr(neighbor_factor),
+        str(concept_weight), type(language).__name__, language.scoring,
+        repr(getattr(language, "tolerance", None)),
+        str(steps), str(seed), rng, STATE_FORMAT]).encode("utf-8"))
+    for concept, words in language.items():
+        key.update("\n{:}".format(concept).encode("utf-8"))
+        for word, weight in words.items():
+            if not isinstance(word, numbers.Integral):
+                return None
+            key.update("\0{!r}\0{!r}".format(int(word), weight).encode(
+                "utf-8"))
+    return key.hexdigest()
+
+
+def burn_in_random(seed, rng="pcg64"):
+    """Create the random number stream for a burn-in.
+
+    Like `simuling.randomness.node_random`, but for the branch before the
+    root of the phylogeny.
+
+    """
+    if rng == "legacy":
+        return numpy.random.RandomState(seed % 2**32)
+    sequence = numpy.random.SeedSequence(
+        seed, spawn_key=tuple(numpy.frombuffer(BURN_IN, dtype=numpy.uint32)))
+    return BlockRandom(sequence, bit_generators[rng])
+
+
+def save_state(language, path):
+    """Store the words and weights of a language in NumPy's .npz format.
+
+    All concepts are stored, in order, including those without words.
+
+    """
+    concepts = list(language)
+    words = []
+    weights = []
+    for words_for_concept in language.values():
+        words.extend(words_for_concept)
+        weights.extend(words_for_concept.values())
+    path.parent.mkdir(parents=True, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=str(path.parent), suffix=".npz")
+    with os.fdopen(handle, "wb") as file:
+        numpy.savez(
+            file,
+            concepts=numpy.array(concepts, dtype=str),
+            counts=numpy.array([len(ws) for ws in language.values()],
+                               dtype=int),
+            words=numpy.array(words, dtype=numpy.int64),
+            weights=numpy.array(weights, dtype=float),
+            integral=numpy.array(all(isinstance(w, numbers.Integral)
+                                     for w in weights)))
+    os.replace(temporary, str(path))
+
+
+def load_state(language, path):
+    """Replace the words of a language by those stored by `save_state`."""
+    with numpy.load(str(path), allow_pickle=False) as arrays:
+        concepts = arrays["concepts"].tolist()
+        counts = arrays["counts"].tolist()
+        words = arrays["words"].tolist()
+        weights = arrays["weights"]
+        if arrays["integral"]:
+            weights = weights.astype(numpy.int64)
+        weights = weights.tolist()
+    language.clear()
+    start = 0
+    for concept, count in zip(concepts, counts):
+        # Recreate the concept even if it has no words, to keep the order.
+        words_for_concept = language[concept]
+        for word, weight in zip(words[start:start + count],
+                                weights[start:start + count]):
+            words_for_concept[word] = weight
+        start += count
+    return language
+
+
+def evict(directory, max_size):
+    """Remove the least recently used states until they fit `max_size` bytes.
+
+    """
+    states = []
+    for path in directory.glob("*.npz"):
+        try:
+            status = path.stat()
+        except FileNotFoundError:
+            continue
+        states.append((status.st_mtime, status.st_size, path))
+    states.sort()
+    total = sum(size for _, size, _ in states)
+    for _, size, path in states:
+        if total <= max_size:
+            break
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def burned_in(language, steps, seed=0, rng="pcg64", cache=True,
+              max_size=2 ** 30):
+    """Return a copy of a language after a burn-in of `steps` steps.
+
+    If `cache` is true, look the burned-in language up in the cache, or
+    store it there, and then shrink the cache to `max_size` bytes. Using a
+    cached state marks it as recently used. A language loaded from the
+    cache is equal to the one the burn-in would produce, including the
+    order of its words.
+
+    """
+    key = burn_in_key(language, steps, seed, rng) if cache else None
+    if key is not None:
+        directory = cache_directory() / "burn-in"
+        path = directory / (key + ".npz")
+        try:
+            result = load_state(language.copy(), path)
+            os.utime(str(path))
+            return result
+        except (OSError, ValueError, KeyError):
+            pass
+    result = language.copy()
+    result.advance(steps, random=burn_in_random(seed, rng))
+    if key is not None:
+        save_state(result, path)
+        evict(directory, max_size)
+    # A copy starts without cached scores, like a loaded state.
+    return result.copy()
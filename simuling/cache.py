@@ -0,0 +1,20 @@
+"""Locate the directory for cached intermediate results."""
+
+import os
+from pathlib import Path
+
+
+def cache_directory():
+    """Return the directory to cache intermediate results in.
+
+    This is $SIMULING_CACHE if set, otherwise the `simuling` subdirectory
+    of the user's cache directory.
+
+    """
+    cache = os.environ.get("SIMULING_CACHE")
+    if not cache:
+        cache = os.path.join(
+            os.environ.get("XDG_CACHE_HOME") or
+            os.path.expanduser("~/.cache"),
+            "simuling")
+    return Path(cache)
@@ -8,24 +8,16 @@ steps.
 
 """
 
-import itertools
-
 import os
-import argparse
 import tempfile
 from clldutils.path import Path
 
 import csvw
-import newick
 
 from ..cli import argparser as basic_argparser, run_and_write, prepare
+from ..compression import open_input
 
-from .util import cached_realdata, shared_vocabulary
-
-
-def mean(x):
-    x = list(x)
-    return sum(x)/len(x)
+from .util import cached_realdata, running_squared_error
 
 
 def argparser():
@@ -36,7 +28,7 @@ def argparser():
         "--realdata",
         default=open(os.path.join(os.path.dirname(__file__),
                                   "beijingdaxue1964.csv")),
-        type=argparse.FileType("r"),
+        type=open_input,
         help="Word list from real life")
     calibration.add_argument(
         "--minscale",
@@ -69,6 +61,11 @@ def argparser():
         "--threshold", "--sample-threshold",
         default=4,
         help="Weight threshold to sample a word")
+    calibration.add_argument(
+        "--abort-losing", action="store_true",
+        default=False,
+        help="Stop simulating a scale as soon as its squared error exceeds"
+        " that of both current bracket scales, instead of finishing all runs.")
     parser._option_string_actions["--output"].type = Path
     parser._option_string_actions["--output"].default = Path()
     parser._option_string_actions["--tree"].default = (
@@ -76,16 +73,6 @@ def argparser():
     return parser
 
 
-def scaled_copy_of(newick_tree, scale):
-    root = newick.Node(
-        name=newick_tree.name,
-        length=str(float(newick_tree.length) * scale))
-    for descendant in newick_tree.descendants:
-        scaled_copy = scaled_copy_of(descendant, scale)
-        root.add_descendant(scaled_copy)
-    return root
-
-
 def main():
     """Run the CLI."""
     parser = argparser()
@@ -112,8 +99,22 @@ def main():
             except ValueError:
                 ignore_singletons.add(i)
 
+    def ignored(l1, l2):
+        return ((l1, l2) in ignore_pairs or
+                l1 in ignore_singletons or
+                l2 in ignore_singletons)
+
     phylogeny = args.phylogeny
     root_language = args.root_language_data
+    if not args.taxa:
+        # Simulate only the languages that are compared with real data.
+        compared = {
+            language
+            for pair in realdata if not ignored(*pair)
+            for language in pair} & set(phylogeny.tree.name)
+        if compared:
+            args.taxa = sorted(compared)
+            phylogeny = phylogeny.tree.pruned(args.taxa).root
 
     with csvw.UnicodeWriter(
             Path("shared_vocabularies.csv").open("w")) as writer:
@@ -121,43 +122,56 @@ def main():
                         ["{:}:{:}".format(l1, l2) for l1, l2 in realdata])
         writer.writerow(["", "", ""] + list(realdata.values()))
 
-        def simulate_scale(scale, seed):
-            args.phylogeny = scaled_copy_of(phylogeny, scale)
-            args.tree = args.phylogeny.newick
+        def simulate_scale(scale, seed, bound=None):
+            """Simulate one run at `scale`, and return its squared error.
+
+            If `bound` is given, stop the simulation as soon as the squared
+            error exceeds it. The value returned is then only a lower bound
+            of the error a complete run would have had.
+
+            """
+            args.phylogeny = phylogeny.tree.scaled(scale).root
             args.output = "calibration_{:f}_{:d}.csv".format(scale, seed)
             args.seed = raw_seed + seed
             args.root_language_data = root_language.copy()
 
+            scores = {}
             squared_error = 0
-            for (l1, vocabulary1), (l2, vocabulary2) in (
-                    itertools.combinations(run_and_write(args), 2)):
-                # Normalize the key, that is, the pair (l1, l2)
-                if l1 > l2:
-                    l1, l2 = l2, l1
-                if (((l1, l2) in ignore_pairs or
-                     l1 in ignore_singletons or
-                     l2 in ignore_singletons)):
-                    continue
-                score = shared_vocabulary(vocabulary1, vocabulary2)
-                try:
-                    error = (realdata[l1, l2] - score)
-                    scores[l1, l2] = score
-                except KeyError:
-                    continue
-                squared_error += error ** 2
+            run = run_and_write(args)
+            for squared_error in running_squared_error(
+                    run, realdata, scores, ignore=ignored):
+                if bound is not None and squared_error > bound:
+                    # Closing the generator cancels the outstanding
+                    # simulation work.
+                    run.close()
+                    break
 
             writer.writerow([
                 args.output,
                 scale,
                 squared_error] + [
-                    scores[l1, l2] for l1, l2 in realdata])
+                    scores.get((l1, l2), "") for l1, l2 in realdata])
             return squared_error
 
+        def mean_error(scale, bound=None):
+            """Calculate the mean squared error of `args.sims` runs.
+
+            If `bound` is given, stop as soon as the mean is known to be
+            larger than `bound`, and return a lower bound of the mean.
+
+            """
+            total = 0
+            for seed in range(args.sims):
+                total += simulate_scale(
+                    scale, seed,
+                    None if bound is None else bound * args.sims - total)
+                if bound is not None and total > bound * args.sims:
+                    break
+            return total / args.sims
+
         sq_errors = {
-            lower: mean(simulate_scale(lower, seed)
-                        for seed in range(args.sims)),
-            upper: mean(simulate_scale(upper, seed)
-                        for seed in range(args.sims))}
+            lower: mean_error(lower),
+            upper: mean_error(upper)}
 
         try:
             # Take steps that are between the upper and lower scaling factor
@@ -170,9 +184,11 @@ def main():
                 for scale in [
                         (lower**2 * upper) ** (1 / 3),
                         (lower * upper**2) ** (1 / 3)]:
-                    sq_errors[scale] = mean(
-                        simulate_scale(scale, seed)
-                        for seed in range(args.sims))
+                    if args.abort_losing:
+                        bound = max(sq_errors[lower], sq_errors[upper])
+                    else:
+                        bound = None
+                    sq_errors[scale] = mean_error(scale, bound)
                     if ((sq_errors[scale] > sq_errors[lower] and
                          sq_errors[scale] > sq_errors[upper])):
                         raise StopIteration
@@ -16,6 +16,7 @@ import argparse
 import matplotlib.pyplot as plt
 
 from .util import cached_realdata, shared_vocabulary, read_wordlist
+from ..compression import open_input
 
 
 def plot_vocabulary(x, names, simulated, name=None, axis=None):
@@ -33,7 +34,7 @@ def main(args=sys.argv):
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument(
         "realdata",
-        type=argparse.FileType("r"),
+        type=open_input,
         help="Word list from real life")
     # parser.add_argument(
     #     "--no-legend",
@@ -42,7 +43,7 @@ def main(args=sys.argv):
     parser.add_argument(
         "simulationdata",
         nargs="*",
-        type=argparse.FileType("r"),
+        type=open_input,
         help="Wordlist given by the phylo simulation")
     parser.add_argument(
         "--figure-file",
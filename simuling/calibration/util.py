@@ -33,6 +33,39 @@ def shared_vocabulary(l1, l2, threshold=4):
     return score / n_features
 
 
+def running_squared_error(languages, realdata, scores=None,
+                          ignore=lambda l1, l2: False):
+    """Compare languages with the real data as soon as they are generated.
+
+    For every (name, vocabulary) pair from the iterable `languages`,
+    calculate the shared vocabulary with each earlier language it forms a
+    pair of `realdata` with, and yield the squared error accumulated so far.
+    Scores are stored in `scores`, if given. Languages which do not occur in
+    `realdata` are not kept around.
+
+    Because the squared error can only grow, a consumer can stop iterating
+    (and thus stop the simulation) as soon as the error is too large.
+
+    """
+    if scores is None:
+        scores = {}
+    relevant = set(itertools.chain.from_iterable(realdata))
+    seen = {}
+    squared_error = 0
+    for l1, vocabulary1 in languages:
+        if l1 in relevant:
+            for l2, vocabulary2 in seen.items():
+                # Normalize the key, that is, the pair (l1, l2)
+                pair = (l1, l2) if l1 < l2 else (l2, l1)
+                if pair not in realdata or ignore(*pair):
+                    continue
+                score = shared_vocabulary(vocabulary1, vocabulary2)
+                scores[pair] = score
+                squared_error += (realdata[pair] - score) ** 2
+            seen[l1] = vocabulary1
+        yield squared_error
+
+
 def cached_realdata(data):
     try:
         with open(os.path.join(
@@ -2,29 +2,31 @@
 
 """
 
+import os
+import sys
+import functools
 import collections
 import numpy.random
 
 import argparse
 import tempfile
-from clldutils.path import Path
+from pathlib import Path
 
-from csvw import UnicodeDictReader
-from csvw.dsv_dialects import Dialect
-import newick
-
-from .io import CommentedUnicodeWriter
+from .tree import Tree, parse, read_tree
+from .compression import open_input, open_output
 from .simulation import (simulate, Multiprocess,
                          SemanticNetworkWithConceptWeight, constant_zero,
-                         Language)
+                         Language, concept_weights, retention)
+from .leaping import LeapingLanguage
+from .kernel import KernelLanguage
+from .burnin import burned_in
 
-default_network = Path(__file__).absolute().parent / "network-3-families.gml"
+engines = {
+    "exact": Language,
+    "leaping": LeapingLanguage,
+    "kernel": KernelLanguage}
 
-concept_weights = {
-    "one": lambda degree: 1,
-    "degree": lambda degree: degree,
-    "square": lambda degree: degree ** 2,
-    "exponential": lambda degree: 2 ** degree}
+default_network = Path(__file__).absolute().parent / "network-3-families.gml"
 
 
 def parse_distribution_description(text, random):
@@ -44,12 +46,25 @@ def parse_distribution_description(text, random):
     return lambda: function(args)
 
 
+def input_file(path):
+    """Open an input file for argparse, like `argparse.FileType("r")`.
+
+    Files that cannot be opened are reported as usage errors.
+
+    """
+    try:
+        return open_input(path)
+    except (OSError, ValueError) as error:
+        raise argparse.ArgumentTypeError(
+            "can't open '{:}': {:}".format(path, error))
+
+
 def argparser():
     parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
     initialization = parser.add_argument_group(
         "Initializing the root language")
     initialization.add_argument(
-        "--wordlist", type=argparse.FileType("r"),
+        "--wordlist", type=input_file,
         help="Load the root language from this CLDF Wordlist. (default: Create"
         " a new language with exactly one word for each concept.)")
     initialization.add_argument(
@@ -62,10 +77,23 @@ def argparser():
         help="Random distribution to use when initializing the root language,"
         " if no weights are given in the CLDF Wordlist. (default: The"
         " distribution that always returns 100.)")
+    initialization.add_argument(
+        "--burn-in", type=int,
+        default=0,
+        help="Run this many steps on the root language before the root of the"
+        " tree, to bring it to equilibrium. Burned-in languages are cached"
+        " and reused by later runs with the same network, root language,"
+        " engine, seed and number of steps. (default: 0)")
+    initialization.add_argument(
+        "--burn-in-cache-size", type=float,
+        default=1024,
+        help="The maximal size of the cache of burned-in languages, in MiB."
+        " The least recently used languages are removed first. 0 disables"
+        " the cache. (default: 1024)")
     parameters = parser.add_argument_group(
         "Simulation parameters")
     parameters.add_argument(
-        "--semantic-network", type=argparse.FileType("r"),
+        "--semantic-network", type=input_file,
         help="The semantic network, given as GML file. (default: CLICS.)")
     parameters.add_argument(
         "--neighbor-factor", type=float,
@@ -86,6 +114,41 @@ def argparser():
         "--seed", type=int,
         default=0,
         help="The random number generator seed (default: 0)")
+    parameters.add_argument(
+        "--rng", choices=["pcg64", "philox", "legacy"],
+        default="pcg64",
+        help="The random number generator. Every node of the phylogeny gets"
+        " its own stream, derived from the seed and the position of the node"
+        " in the tree. 'legacy' uses the node-name based RandomState streams"
+        " of earlier versions, to reproduce old simulations (together with"
+        " '--scoring full'). (default: pcg64)")
+    parameters.add_argument(
+        "--scoring", choices=["cached", "full", "verify"],
+        default="cached",
+        help="How to calculate the scores of words for a concept. 'cached'"
+        " keeps the scores of each concept up to date while the language"
+        " changes, 'full' recomputes them whenever they are needed, like"
+        " earlier versions did, and 'verify' checks the cache against full"
+        " recomputation, which is slow. Because the order of the scores"
+        " breaks ties, 'full' gives different results than the other two."
+        " (default: cached)")
+    parameters.add_argument(
+        "--engine", choices=sorted(engines),
+        default="exact",
+        help="How to run the steps of the simulation. 'exact' runs them one"
+        " by one. 'leaping' advances in leaps of many steps, removing the"
+        " random units of weight of all steps of a leap at once, which is"
+        " faster for long branches but only approximate. 'kernel' runs all"
+        " steps of a branch in a kernel over flat arrays, compiled with Numba"
+        " if it is installed; it follows the same dynamics as 'exact', but"
+        " with its own random numbers and tie breaking. (default: exact)")
+    parameters.add_argument(
+        "--leap-tolerance", type=float,
+        default=LeapingLanguage.tolerance,
+        help="For the leaping engine, the expected fraction of its weight a"
+        " (concept, word) pair may lose during a leap before the loss"
+        " affects the simulation. Larger values mean longer leaps."
+        " (default: {:})".format(LeapingLanguage.tolerance))
     tree = parser.add_argument_group(
         "Shape of the phylogeny")
     tree.add_argument(
@@ -99,6 +162,11 @@ def argparser():
         help="If no tree is given, the log₂ of the maximum branch length"
         " of the long branch, i.e. N from the default value above."
         " (default: 20.)")
+    tree.add_argument(
+        "--taxa", nargs="+",
+        help="Simulate only the part of the tree needed for these nodes,"
+        " merging the branches where nothing splits off, and output only"
+        " their languages. (default: Simulate and output all named nodes.)")
     processing = parser.add_argument_group(
         "Processing")
     processing.add_argument(
@@ -109,47 +177,84 @@ def argparser():
         "--multiprocess", type=int,
         default=1,
         help="The number of parallel processes to run.")
+    processing.add_argument(
+        "--retain", choices=sorted(retention),
+        default="all",
+        help="Which generated languages to keep in memory after they have"
+        " been written, for further processing like calibration: 'all',"
+        " only the 'leaves' of the tree, or 'none'. Other languages are"
+        " dropped as soon as all their children have started."
+        " (default: all)")
     output = parser.add_argument_group(
         "Output")
     output.add_argument(
-        "--output", type=argparse.FileType("w"),
-        default=tempfile.mkstemp()[0],
+        "--output",
         help="The file to write output data to (in CLDF-like CSV)."
-        " (default: A temporary file.)")
+        " (default: A new temporary file.)")
     output.add_argument(
         "--embed-parameters", action="store_true",
         default=False,
         help="Echo the simulation parameters to comments in the CSV output"
         " file.")
+    output.add_argument(
+        "--min-weight", type=float,
+        help="Write only words with at least this weight for a concept."
+        " Filtered output cannot be used to --resume. (default: Write all"
+        " words.)")
+    output.add_argument(
+        "--top-k", type=int,
+        help="Write only this many words with the largest weights for"
+        " each concept. (default: Write all words.)")
+    output.add_argument(
+        "--relative", type=float,
+        help="Write only words whose weight for a concept is larger than this"
+        " fraction of the largest weight for the concept, like"
+        " `analysis.sample_data`. (default: Write all words.)")
+    output.add_argument(
+        "--delta", action="store_true",
+        default=False,
+        help="Write every language as its differences to the closest written"
+        " ancestor, given in an additional Parent_ID column, instead of in"
+        " full. Use `simuling.io.DeltaReader` to reconstruct languages.")
+    output.add_argument(
+        "--keyframe-interval", type=int,
+        default=16,
+        help="With --delta, write a language in full if it would be this many"
+        " differences away from the last language written in full, so"
+        " reconstructing a language needs to read at most this many"
+        " languages. (default: 16)")
     return parser
 
 
 def phylogeny(args):
+    """Load or construct the phylogeny described by `args`.
+
+    Return the root of the tree as `simuling.tree.Node`.
+
+    """
     if args.tree is None:
-        tree = newick.Node("0")
-        parent = tree
+        lengths = [numpy.nan]
+        names = ["0"]
         length = 0
         for i in range(args.branchlength + 1):
             new_length = 2 ** i
-            child = newick.Node(
-                str(new_length),
-                str(new_length - length))
-            parent.add_descendant(child)
-            parent = child
+            names.append(str(new_length))
+            lengths.append(new_length - length)
             length = new_length
+        tree = Tree(numpy.arange(len(names)) - 1, lengths, names)
     else:
         try:
-            file = Path(args.tree).open()
-            tree = newick.load(file)[0]
+            tree = read_tree(args.tree)
         except (OSError, FileNotFoundError):
-            if ":" in args.tree or "(" in args.tree:
-                tree = newick.loads(args.tree)[0]
+            if ":" in str(args.tree) or "(" in str(args.tree):
+                tree = next(parse(args.tree))
             else:
                 raise ValueError(
                     "Argument for --tree looked like a filename, not like a"
                     " Newick tree, but no such file could be opened.")
-    args.tree = tree.newick
-    return tree
+    if args.taxa:
+        tree = tree.pruned(args.taxa)
+    return tree.root
 
 
 def echo(args):
@@ -160,14 +265,22 @@ def echo(args):
             continue
         if arg == "multiprocess":
             continue
+        if arg == "burn_in_cache_size":
+            continue
         if arg == "resume":
             continue
         if arg == "root_language_data":
             continue
         if arg == "phylogeny":
             continue
+        if arg == "tree" and "phylogeny" in args:
+            # Serialize the tree only when needed, so the parameters can
+            # be reproduced even where the tree was given as file.
+            value = args.phylogeny.newick
         if arg == "simulator":
             continue
+        if arg == "taxa" and value:
+            value = " ".join(value)
         if value is not None:
             try:
                 value = value.name
@@ -178,29 +291,44 @@ def echo(args):
 
 def read_wordlist(wordlist, semantics,
                   only_language=None, all_languages=False, weight=100):
+    # csvw is slow to import, so only import it when it is needed.
+    from csvw import UnicodeDictReader
+    from csvw.dsv_dialects import Dialect
     languages = collections.OrderedDict()
     with UnicodeDictReader(
             wordlist, dialect=Dialect(commentPrefix="#")) as reader:
         for line in reader:
             language_id = line["Language_ID"]
-            if (only_language and language_id != only_language):
+            # Output written with --delta lists languages as differences
+            # to their parents, so all languages are needed there.
+            parent = line.get("Parent_ID")
+            if (only_language and language_id != only_language and
+                    parent is None):
                 continue
+            if language_id not in languages:
+                languages[language_id] = Language({}, semantics)
+                if parent:
+                    for concept, words in languages[parent].items():
+                        languages[language_id][concept].update(words)
             try:
                 concept = line["Parameter_ID"]
             except KeyError:
                 concept = line["Feature_ID"]
+            if not concept:
+                # A language without differences to its parent
+                continue
             try:
                 wt = float(line["Weight"])
             except KeyError:
                 wt = weight()
-            if language_id not in languages:
-                languages[language_id] = Language({}, semantics)
             try:
                 word = int(line["Cognateset_ID"])
             except KeyError:
                 word = int(line["Concept_CogID"])
-            languages[language_id][concept][word] = wt
-            Language.max_word = max(Language.max_word, word)
+            if wt:
+                languages[language_id][concept][word] = wt
+            else:
+                languages[language_id][concept].pop(word, None)
     if all_languages:
         return languages
     else:
@@ -209,34 +337,35 @@ def read_wordlist(wordlist, semantics,
         return languages[only_language]
 
 
-class concept_weight:
-    def __init__(self, weight, semantics):
-        self.weight = weight
-        self.semantics = semantics
+def configure(language, args, engine=None):
+    """Turn a language into one of the engine and scoring given in `args`.
+
+    The language's dictionaries of words are shared, not copied.
 
-    def __call__(self, concept):
-        return concept_weights[self.weight](len(self.semantics[concept]))
+    """
+    if engine is None:
+        engine = args.engine
+    language = engines[engine](language, language.semantics)
+    language.scoring = args.scoring
+    if engine == "leaping":
+        language.tolerance = args.leap_tolerance
+    return language
 
 
-def prepare(parser):
-    args = parser.parse_args()
+def prepare(parser, args=None):
+    if args is None:
+        args = parser.parse_args()
 
-    args.simulator = simulate
+    args.simulator = functools.partial(
+        simulate, rng=args.rng, retain=args.retain)
 
     if args.multiprocess != 1:
         def simulator(phylogeny, language,
                       seed=0, writer=None):
-            for r in Multiprocess(args.multiprocess).simulate(
+            for r in Multiprocess(
+                    args.multiprocess, retain=args.retain).simulate(
                     phylogeny, language,
-                    seed=0, writer=None):
-                yield r
-        args.simulator = simulator
-    if args.resume:
-        def simulator(phylogeny, language,
-                      seed=0, writer=None):
-            for r in Multiprocess(args.multiprocess).simulate_remainder(
-                    phylogeny, language,
-                    seed=0, writer=None):
+                    seed=seed, writer=writer, rng=args.rng):
                 yield r
         args.simulator = simulator
 
@@ -255,13 +384,13 @@ def prepare(parser):
             args.weight_attribute)
     semantics.neighbor_factor = args.neighbor_factor
 
-    semantics.concept_weight = concept_weight(args.concept_weight,
-                                              semantics)
+    semantics._concept_weight = concept_weights[args.concept_weight]
 
     if args.resume:
-        mp = Multiprocess(args.multiprocess)
+        mp = Multiprocess(args.multiprocess, retain=args.retain)
         resume_from = mp.generated_languages
-        args.simulator = mp.simulate_remainder
+        args.simulator = functools.partial(
+            mp.simulate_remainder, rng=args.rng)
         # Resuming when the root language is not available doesn't make any
         # sense, so fill the root language with a nonsense value that will
         # raise an error later. FIXME: Make the later error message more
@@ -269,7 +398,7 @@ def prepare(parser):
         for language_id, language in read_wordlist(
                 args.wordlist, semantics,
                 all_languages=True, weight=weight).items():
-            resume_from[language_id] = language
+            resume_from[language_id] = configure(language, args)
         args.root_language_data = None
     elif args.wordlist:
         args.root_language_data = read_wordlist(
@@ -280,24 +409,94 @@ def prepare(parser):
                 constant_zero, {c: weight()})
             for c, concept in enumerate(semantics)}
         args.root_language_data = Language(raw_language, semantics)
+    if args.root_language_data is not None:
+        args.root_language_data = configure(args.root_language_data, args)
+        if args.burn_in:
+            args.root_language_data = burned_in(
+                args.root_language_data, args.burn_in,
+                seed=args.seed, rng=args.rng,
+                cache=args.burn_in_cache_size > 0,
+                max_size=args.burn_in_cache_size * 2 ** 20)
 
     return args
 
 
+class TaxonFilter ():
+    """Pass on only the rows of some languages to a writer."""
+    def __init__(self, writer, taxa):
+        self.writer = writer
+        self.taxa = set(taxa)
+
+    def writerow(self, row):
+        if row[0] in self.taxa:
+            self.writer.writerow(row)
+
+
 def run_and_write(args):
-    print(Path(args.output).absolute())
-    with CommentedUnicodeWriter(
-            args.output, commentPrefix="# ") as writer:
-        writer.writerow(
-            ["Language_ID", "Parameter_ID", "Cognateset_ID", "Weight"])
-        if args.embed_parameters:
-            for arg, value in echo(args):
-                writer.writecomment(
-                    "--{:s} {:}".format(
-                        arg, value))
-        for id, data in args.simulator(
-                args.phylogeny, args.root_language_data,
-                seed=args.seed,
-                writer=writer):
-            print("Language {:} generated.".format(id))
-            yield id, data
+    from .io import CommentedUnicodeWriter, DeltaWriter, WeightFilter
+    output = args.output
+    if output is None:
+        handle, output = tempfile.mkstemp(suffix=".csv")
+        os.close(handle)
+    if isinstance(output, (str, Path)):
+        output = open_output(output)
+    print(Path(getattr(output, "name", output)).absolute())
+    try:
+        with CommentedUnicodeWriter(
+                output, commentPrefix="# ") as writer:
+            writer.writerow(
+                ["Language_ID", "Parameter_ID", "Cognateset_ID", "Weight"] +
+                (["Parent_ID"] if args.delta else []))
+            if args.embed_parameters:
+                for arg, value in echo(args):
+                    writer.writecomment(
+                        "--{:s} {:}".format(
+                            arg, value))
+            taxa = set(args.taxa) if args.taxa else None
+            # Stages that hold back rows, to be closed from the outside in.
+            stages = []
+            if args.delta:
+                writer = DeltaWriter(
+                    writer, args.phylogeny, taxa, args.keyframe_interval)
+                stages.append(writer)
+            if not (args.min_weight is None and args.top_k is None and
+                    args.relative is None):
+                writer = WeightFilter(
+                    writer, args.min_weight, args.top_k, args.relative)
+                stages.append(writer)
+            if args.taxa:
+                # The pruned tree may still contain other named nodes, where
+                # the paths to the requested ones branch.
+                writer = TaxonFilter(writer, taxa)
+            try:
+                for id, data in args.simulator(
+                        args.phylogeny, args.root_language_data,
+                        seed=args.seed,
+                        writer=writer):
+                    if args.taxa and id not in taxa:
+                        continue
+                    print("Language {:} generated.".format(id))
+                    yield id, data
+            finally:
+                for stage in reversed(stages):
+                    stage.close()
+    finally:
+        # Compressed output is only complete when it is closed.
+        if output is not sys.stdout:
+            output.close()
+    print("Peak memory: {:.1f} MiB (main process), {:.1f} MiB (largest"
+          " worker process)".format(*[m / 2 ** 20 for m in peak_memory()]))
+
+
+def peak_memory():
+    """The peak resident set sizes of this process and its children.
+
+    Return the peak resident set size of this process, and the largest
+    of those of its terminated child processes, in bytes.
+
+    """
+    import resource
+    # Linux reports kibibytes, macOS bytes.
+    unit = 1 if sys.platform == "darwin" else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit)
@@ -0,0 +1,165 @@
+"""Read and write compressed simulation output as streams.
+
+Output files whose names end in .gz or .zst are compressed while they are
+written. Compression runs in a background thread, so it overlaps with the
+simulation: zlib releases the global interpreter lock while it
+compresses, and Zstandard compresses with as many threads as there are
+cores. Input files are decompressed transparently, recognized by their
+content instead of their name. Zstandard needs the optional `zstandard`
+package.
+
+"""
+
+import io
+import sys
+import zlib
+import gzip
+import queue
+import threading
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def zstandard():
+    """Import the optional zstandard package."""
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError(
+            "Zstandard compressed files need the zstandard package")
+    return zstandard
+
+
+def gzip_compressor():
+    """A compressor object writing the gzip format."""
+    return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def zstd_compressor():
+    """A compressor object writing the Zstandard format, multithreaded."""
+    return zstandard().ZstdCompressor(threads=-1).compressobj()
+
+
+compressors = {
+    ".gz": gzip_compressor,
+    ".zst": zstd_compressor}
+
+
+class CompressingWriter (io.RawIOBase):
+    """A binary stream that compresses into a file in a background thread.
+
+    Written chunks are handed to the thread through a bounded queue, so a
+    slow disk slows down the writer instead of filling the memory. Errors
+    of the thread are raised by the next `write` or by `close`.
+
+    """
+    def __init__(self, file, compressor, queue_size=16):
+        self.file = file
+        self.name = file.name
+        self.compressor = compressor
+        self.chunks = queue.Queue(queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self.compress, daemon=True)
+        self.thread.start()
+
+    def compress(self):
+        try:
+            while True:
+                chunk = self.chunks.get()
+                if chunk is None:
+                    break
+                self.file.write(self.compressor.compress(chunk))
+            self.file.write(self.compressor.flush())
+        except Exception as error:
+            self.error = error
+            # Keep consuming, so the writer never blocks on a full queue.
+            while self.chunks.get() is not None:
+                pass
+        finally:
+            self.file.close()
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.check()
+        self.chunks.put(bytes(data))
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.chunks.put(None)
+            self.thread.join()
+            super().close()
+            self.check()
+
+
+class DecompressingReader (io.RawIOBase):
+    """A binary stream reading from a decompressing reader."""
+    def __init__(self, reader, name):
+        self.reader = reader
+        self.name = name
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.reader.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.reader.close()
+            super().close()
+
+
+def open_output(path):
+    """Open a file for writing text, compressed according to its suffix.
+
+    "-" stands for the standard output. Files ending in .gz or .zst are
+    compressed in a background thread, and must be closed to complete
+    them. Other files are opened like `open(path, "w")`.
+
+    """
+    if path == "-":
+        return sys.stdout
+    path = str(path)
+    for suffix, compressor in compressors.items():
+        if path.endswith(suffix):
+            compressor = compressor()
+            raw = CompressingWriter(open(path, "wb"), compressor)
+            return io.TextIOWrapper(
+                io.BufferedWriter(raw, buffer_size=2 ** 20),
+                encoding="utf-8", newline="")
+    return open(path, "w")
+
+
+def open_input(path, mode="r"):
+    """Open a file for reading, decompressing it if necessary.
+
+    "-" stands for the standard input. gzip and Zstandard compressed files
+    are recognized by their first bytes. `mode` is "r" for text or "rb"
+    for bytes.
+
+    """
+    if path == "-":
+        return sys.stdin if mode == "r" else sys.stdin.buffer
+    file = open(str(path), "rb")
+    magic = file.peek(4)[:4]
+    if magic.startswith(GZIP_MAGIC):
+        file.close()
+        stream = gzip.open(str(path), "rb")
+    elif magic == ZSTD_MAGIC:
+        stream = io.BufferedReader(DecompressingReader(
+            zstandard().ZstdDecompressor().stream_reader(file), file.name))
+    else:
+        stream = file
+    if mode == "rb":
+        return stream
+    return io.TextIOWrapper(stream, encoding="utf-8")
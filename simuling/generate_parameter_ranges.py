@@ -37,7 +37,9 @@ def new_output_file():
     return "long_branch_{:08x}.csv".format(file_id)
 
 
-def write_parameter_line(updater, arguments=default_properties):
+def write_parameter_line(updater, arguments=None):
+    if arguments is None:
+        arguments = default_properties()
     arguments = arguments.copy()
     arguments.update(updater)
     arguments["--output"] = new_output_file()
@@ -1,5 +1,12 @@
+"""Write and read simulation output."""
+
+import csv
+import collections
+
 from csvw import UnicodeWriter
 
+from .compression import open_input
+
 
 class CommentedUnicodeWriter (UnicodeWriter):
     def __init__(self, f=None, dialect=None, **kw):
@@ -15,3 +22,235 @@ class CommentedUnicodeWriter (UnicodeWriter):
             self.f.write(self.comment_prefix)
             self.f.write(row)
             self.f.write('\n')
+
+
+class WeightFilter ():
+    """Pass on only the heavy words of every concept to a writer.
+
+    Rows of a language and concept must come in one block, as
+    `Language.write` writes them, and the last block is only written by
+    `close`. A row is kept if its weight is at least `min_weight`, larger
+    than `relative` times the largest weight for the concept, and among
+    the `top_k` largest weights for the concept (earlier rows first among
+    equal weights), for those of the three that are given. Kept rows stay
+    in their order.
+
+    """
+    def __init__(self, writer, min_weight=None, top_k=None, relative=None):
+        self.writer = writer
+        self.min_weight = min_weight
+        self.top_k = top_k
+        self.relative = relative
+        self.group = None
+        self.rows = []
+
+    def writerow(self, row):
+        if (row[0], row[1]) != self.group:
+            self.flush()
+            self.group = (row[0], row[1])
+        self.rows.append(row)
+
+    def flush(self):
+        """Write the kept rows of the block collected."""
+        rows = self.rows
+        if rows and self.relative is not None:
+            threshold = self.relative * max(row[3] for row in rows)
+            rows = [row for row in rows if row[3] > threshold]
+        if self.min_weight is not None:
+            rows = [row for row in rows if row[3] >= self.min_weight]
+        if self.top_k is not None and len(rows) > self.top_k:
+            heaviest = sorted(range(len(rows)), key=lambda i: -rows[i][3])
+            rows = [rows[i] for i in sorted(heaviest[:self.top_k])]
+        for row in rows:
+            self.writer.writerow(row)
+        self.group = None
+        self.rows = []
+
+    def close(self):
+        """Write the last block."""
+        self.flush()
+
+
+class DeltaWriter ():
+    """Write languages as differences to the language of their parent.
+
+    Rows are passed on to `writer` with an additional Parent_ID column.
+    The parent of a language is the closest ancestor in `phylogeny` that
+    is written too (that is, is named and, if `taxa` is given, in `taxa`).
+    Languages without parent, and every language that is
+    `keyframe_interval` steps of differences away from the previous full
+    language, are written in full, with empty Parent_ID. Other languages
+    are written as the rows that differ from their parent's, with weight 0
+    for words that were lost. A language equal to its parent is written as
+    one row with empty Parameter_ID, so that it is not lost.
+
+    Languages are recognized by their Language_ID, so rows of a language
+    must come in one block, as `Language.write` writes them, and the last
+    language is only written by `close`. The state of a language is kept
+    only until all its children have been written.
+
+    """
+    def __init__(self, writer, phylogeny, taxa=None, keyframe_interval=16):
+        self.writer = writer
+        self.keyframe_interval = keyframe_interval
+        self.parent = {}
+        self.children = collections.Counter()
+        stack = [(phylogeny, None)]
+        while stack:
+            node, parent = stack.pop()
+            if node.name and (taxa is None or node.name in taxa):
+                self.parent[node.name] = parent
+                self.children[parent] += 1
+                parent = node.name
+            for child in node.descendants:
+                stack.append((child, parent))
+        self.hops = {}
+        self.states = {}
+        self.name = None
+        self.rows = []
+
+    def writerow(self, row):
+        if row[0] != self.name:
+            self.flush()
+            self.name = row[0]
+        self.rows.append(row)
+
+    def flush(self):
+        """Write the language whose rows have been collected."""
+        if self.name is None:
+            return
+        name = self.name
+        state = collections.OrderedDict(
+            ((concept, word), weight)
+            for _, concept, word, weight in self.rows)
+        parent = self.parent.get(name)
+        hops = 0
+        if parent is not None:
+            hops = self.hops.get(parent, 0) + 1
+        if parent is None or hops >= self.keyframe_interval:
+            hops = 0
+            rows = [row + [""] for row in self.rows]
+        else:
+            old = self.states.get(parent, {})
+            rows = [[name, concept, word, weight, parent]
+                    for (concept, word), weight in state.items()
+                    if old.get((concept, word)) != weight]
+            rows.extend([name, concept, word, 0, parent]
+                        for concept, word in old
+                        if (concept, word) not in state)
+            if not rows:
+                rows = [[name, "", "", "", parent]]
+        for row in rows:
+            self.writer.writerow(row)
+
+        self.hops[name] = hops
+        if self.children[name]:
+            self.states[name] = state
+        if parent is not None:
+            self.children[parent] -= 1
+            if self.children[parent] <= 0:
+                self.states.pop(parent, None)
+        self.name = None
+        self.rows = []
+
+    def close(self):
+        """Write the last language."""
+        self.flush()
+
+
+def parse_value(text):
+    """Parse an ID or weight written by the simulation.
+
+    >>> parse_value("12"), parse_value("0.5"), parse_value("left")
+    (12, 0.5, 'left')
+
+    """
+    for number in (int, float):
+        try:
+            return number(text)
+        except ValueError:
+            pass
+    return text
+
+
+class DeltaReader ():
+    """Reconstruct languages from output written by `DeltaWriter`.
+
+    One pass over the file indexes the byte ranges of the rows of every
+    language, and its parent. `language` then reads only the rows of the
+    requested language and its ancestors up to the last full language.
+    Output without Parent_ID column, which holds every language in full,
+    can be read the same way, and so can compressed output, but there,
+    reaching the rows of a language means decompressing all rows before.
+
+    """
+    def __init__(self, path):
+        self.path = str(path)
+        self.index = collections.OrderedDict()
+        with open_input(self.path, "rb") as file:
+            columns = None
+            offset = 0
+            for line in file:
+                start = offset
+                offset += len(line)
+                if line.startswith(b"#") or not line.strip():
+                    continue
+                row = next(csv.reader([line.decode("utf-8")]))
+                if columns is None:
+                    columns = {c: i for i, c in enumerate(row)}
+                    self.columns = columns
+                    continue
+                name = row[columns["Language_ID"]]
+                parent = None
+                if "Parent_ID" in columns:
+                    parent = row[columns["Parent_ID"]] or None
+                try:
+                    entry = self.index[name]
+                except KeyError:
+                    self.index[name] = [parent, start, offset]
+                else:
+                    entry[2] = offset
+
+    def names(self):
+        """The IDs of all languages in the file, in order."""
+        return list(self.index)
+
+    def rows(self, name):
+        """Read the (concept, word, weight) rows stored for a language."""
+        _, start, end = self.index[name]
+        concept = self.columns["Parameter_ID"]
+        word = self.columns["Cognateset_ID"]
+        weight = self.columns["Weight"]
+        with open_input(self.path, "rb") as file:
+            if file.seekable():
+                file.seek(start)
+            else:
+                skip = start
+                while skip > 0:
+                    skip -= len(file.read(min(skip, 2 ** 20)))
+            lines = file.read(end - start).decode("utf-8").splitlines()
+        for row in csv.reader(
+                line for line in lines if not line.startswith("#")):
+            if row[concept]:
+                yield (row[concept], parse_value(row[word]),
+                       parse_value(row[weight]))
+
+    def language(self, name):
+        """Reconstruct a language, as dictionary of word weights by concept.
+
+        """
+        chain = [name]
+        while self.index[chain[-1]][0] is not None:
+            chain.append(self.index[chain[-1]][0])
+        state = collections.OrderedDict()
+        for ancestor in reversed(chain):
+            for concept, word, weight in self.rows(ancestor):
+                if weight:
+                    state[concept, word] = weight
+                else:
+                    state.pop((concept, word), None)
+        language = collections.OrderedDict()
+        for (concept, word), weight in state.items():
+            language.setdefault(concept, collections.OrderedDict())[
+                word] = weight
+        return language
@@ -0,0 +1,430 @@
+"""A step kernel over flat arrays, compiled with Numba where available.
+
+`KernelLanguage.advance` converts the language into flat arrays once per
+node of the phylogeny, runs all steps of the branch in `run_steps`, and
+converts the arrays back. With Numba installed, `run_steps` and its
+helpers are compiled, so the whole branch runs without returning to the
+interpreter. Without Numba, `KernelLanguage` runs the pure-Python steps of
+`Language`.
+
+The kernel follows the dynamics of `Language.step`, but breaks ties by
+its own (deterministic) order and draws its random numbers from Numba's
+generator, seeded from the node's random stream, so its results are
+statistically, not exactly, equal to those of the exact engine. Use
+`simuling.validation` to compare them.
+
+The language is stored as cells, (concept, word, weight) triples. The
+cells of each concept form a doubly linked list in insertion order, and a
+Fenwick tree over the cell weights allows drawing a random cell, weighted
+by weight, in logarithmic time.
+
+"""
+
+import numbers
+import importlib.util
+
+import numpy
+
+from .simulation import Language
+
+# Numba is slow to import, so it is only imported by `compile_kernel`.
+available = importlib.util.find_spec("numba") is not None
+
+kernel_functions = []
+compiled = False
+
+
+def jit(function):
+    """Mark a function to be compiled with Numba by `compile_kernel`."""
+    kernel_functions.append(function.__name__)
+    return function
+
+
+def compile_kernel():
+    """Compile the kernel functions with Numba, if it is installed.
+
+    The compiled functions replace the plain ones in this module, where
+    the compiled `run_steps` looks up its helpers when it is first called.
+
+    """
+    global compiled
+    if available and not compiled:
+        import numba
+        namespace = globals()
+        for name in kernel_functions:
+            namespace[name] = numba.njit(cache=True)(namespace[name])
+        compiled = True
+
+
+@jit
+def fenwick_add(tree, index, delta):
+    """Add `delta` to the value at `index` of a Fenwick tree."""
+    index += 1
+    while index < len(tree):
+        tree[index] += delta
+        index += index & -index
+
+
+@jit
+def fenwick_find(tree, value):
+    """Find the first index whose cumulative value exceeds `value`."""
+    position = 0
+    mask = 1
+    while mask * 2 < len(tree):
+        mask *= 2
+    while mask:
+        if position + mask < len(tree) and tree[position + mask] <= value:
+            position += mask
+            value -= tree[position]
+        mask //= 2
+    return position
+
+
+@jit
+def fenwick_build(weights):
+    """Build a Fenwick tree over an array of weights."""
+    tree = numpy.zeros(len(weights) + 1)
+    for index in range(len(weights)):
+        if weights[index] > 0:
+            fenwick_add(tree, index, weights[index])
+    return tree
+
+
+@jit
+def draw(cumulative, value):
+    """Find the first index whose cumulative weight exceeds `value`."""
+    low = 0
+    high = len(cumulative)
+    while low < high:
+        middle = (low + high) // 2
+        if cumulative[middle] <= value:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+@jit
+def score_words(concept, indptr, indices, weights, head, cell_next,
+                cell_word, cell_weight, score, rank, order):
+    """Score the words for a concept, like `Language.calculate_scores`.
+
+    Fill `score` and `rank` (the 1-based position in `order`, 0 for words
+    without score) for all words with a score, list them in `order`, and
+    return their number.
+
+    """
+    count = 0
+    for edge in range(indptr[concept], indptr[concept + 1]):
+        connection = weights[edge]
+        cell = head[indices[edge]]
+        while cell >= 0:
+            if cell_weight[cell] > 0:
+                word = cell_word[cell]
+                if rank[word] == 0:
+                    order[count] = word
+                    count += 1
+                    rank[word] = count
+                    score[word] = 0.0
+                score[word] += cell_weight[cell] * connection
+            cell = cell_next[cell]
+    return count
+
+
+@jit
+def incumbent(order, count, score, other_rank):
+    """Find the best scored word which has no score for the other concept.
+
+    Return -1 if there is none.
+
+    """
+    best = -1
+    for i in range(count):
+        word = order[i]
+        if other_rank[word] == 0 and (best < 0 or score[word] > score[best]):
+            best = word
+    return best
+
+
+@jit
+def run_steps(steps, seed, concept_heap, indptr, indices, weights,
+              head, tail, cell_concept, cell_word, cell_weight,
+              cell_next, cell_prev, free, n_free, n_cells,
+              word_label, n_words):
+    """Run `steps` simulation steps on a language stored as flat arrays.
+
+    The cell and word arrays grow as needed, so return them all, with
+    the new numbers of free cells, used cells and words.
+
+    """
+    numpy.random.seed(seed)
+    tree = fenwick_build(cell_weight)
+    total = 0.0
+    for cell in range(n_cells):
+        if cell_weight[cell] > 0:
+            total += cell_weight[cell]
+    capacity = len(word_label)
+    score_1 = numpy.zeros(capacity)
+    score_2 = numpy.zeros(capacity)
+    rank_1 = numpy.zeros(capacity, dtype=numpy.int64)
+    rank_2 = numpy.zeros(capacity, dtype=numpy.int64)
+    order_1 = numpy.zeros(capacity, dtype=numpy.int64)
+    order_2 = numpy.zeros(capacity, dtype=numpy.int64)
+    combined = numpy.zeros(len(head))
+    seen = numpy.zeros(len(head), dtype=numpy.bool_)
+    targets = numpy.zeros(len(head), dtype=numpy.int64)
+
+    for step in range(steps):
+        # Make sure there is room for two new words and two new cells.
+        if n_words + 2 > capacity:
+            capacity *= 2
+            word_label = numpy.concatenate((
+                word_label, numpy.zeros(capacity - len(word_label),
+                                        dtype=numpy.int64)))
+            score_1 = numpy.zeros(capacity)
+            score_2 = numpy.zeros(capacity)
+            rank_1 = numpy.zeros(capacity, dtype=numpy.int64)
+            rank_2 = numpy.zeros(capacity, dtype=numpy.int64)
+            order_1 = numpy.zeros(capacity, dtype=numpy.int64)
+            order_2 = numpy.zeros(capacity, dtype=numpy.int64)
+        if n_free + len(cell_weight) - n_cells < 2:
+            grow = len(cell_weight)
+            cell_concept = numpy.concatenate((
+                cell_concept, numpy.zeros(grow, dtype=numpy.int64)))
+            cell_word = numpy.concatenate((
+                cell_word, numpy.zeros(grow, dtype=numpy.int64)))
+            cell_weight = numpy.concatenate((cell_weight, numpy.zeros(grow)))
+            cell_next = numpy.concatenate((
+                cell_next, numpy.zeros(grow, dtype=numpy.int64)))
+            cell_prev = numpy.concatenate((
+                cell_prev, numpy.zeros(grow, dtype=numpy.int64)))
+            free = numpy.concatenate((
+                free, numpy.zeros(grow, dtype=numpy.int64)))
+            tree = fenwick_build(cell_weight)
+
+        # Choose two different concepts
+        concept_1 = draw(concept_heap,
+                         numpy.random.random() * concept_heap[-1])
+        concept_2 = concept_1
+        while concept_2 == concept_1:
+            concept_2 = draw(concept_heap,
+                             numpy.random.random() * concept_heap[-1])
+
+        count_1 = score_words(concept_1, indptr, indices, weights, head,
+                              cell_next, cell_word, cell_weight,
+                              score_1, rank_1, order_1)
+        count_2 = score_words(concept_2, indptr, indices, weights, head,
+                              cell_next, cell_word, cell_weight,
+                              score_2, rank_2, order_2)
+
+        # Strengthen the incumbents, or introduce new words.
+        for concept, word in (
+                (concept_1, incumbent(order_1, count_1, score_1, rank_2)),
+                (concept_2, incumbent(order_2, count_2, score_2, rank_1))):
+            if word < 0:
+                word = n_words
+                word_label[word] = numpy.random.randint(0, 2 ** 40)
+                n_words += 1
+                cell = -1
+            else:
+                cell = head[concept]
+                while cell >= 0 and cell_word[cell] != word:
+                    cell = cell_next[cell]
+            if cell < 0:
+                if n_free:
+                    n_free -= 1
+                    cell = free[n_free]
+                else:
+                    cell = n_cells
+                    n_cells += 1
+                cell_concept[cell] = concept
+                cell_word[cell] = word
+                cell_weight[cell] = 0.0
+                cell_next[cell] = -1
+                cell_prev[cell] = tail[concept]
+                if tail[concept] >= 0:
+                    cell_next[tail[concept]] = cell
+                else:
+                    head[concept] = cell
+                tail[concept] = cell
+            cell_weight[cell] += 1
+            fenwick_add(tree, cell, 1.0)
+            total += 1
+
+        # Find the most confusing cell: the heaviest cell, weighted by
+        # connection, of a word scored for both concepts on a concept
+        # close to either of them.
+        n_targets = 0
+        for concept in (concept_1, concept_2):
+            for edge in range(indptr[concept], indptr[concept + 1]):
+                target = indices[edge]
+                if not seen[target]:
+                    seen[target] = True
+                    targets[n_targets] = target
+                    n_targets += 1
+                combined[target] += weights[edge]
+        confusing = -1
+        confusing_weight = 0.0
+        confusing_rank = 0
+        for t in range(n_targets):
+            cell = head[targets[t]]
+            while cell >= 0:
+                word = cell_word[cell]
+                if rank_1[word] > 0 and rank_2[word] > 0:
+                    weight = cell_weight[cell] * combined[targets[t]]
+                    if weight > confusing_weight or (
+                            weight > 0 and weight == confusing_weight and
+                            rank_1[word] < confusing_rank):
+                        confusing = cell
+                        confusing_weight = weight
+                        confusing_rank = rank_1[word]
+                cell = cell_next[cell]
+        for t in range(n_targets):
+            combined[targets[t]] = 0
+            seen[targets[t]] = False
+        for i in range(count_1):
+            rank_1[order_1[i]] = 0
+        for i in range(count_2):
+            rank_2[order_2[i]] = 0
+
+        # Remove a unit of weight from the most confusing cell (or a
+        # random cell), and one from a random cell.
+        for removal in range(2):
+            cell = confusing
+            while cell < 0 or cell_weight[cell] <= 0:
+                cell = fenwick_find(tree, numpy.random.random() * total)
+            confusing = -1
+            cell_weight[cell] -= 1
+            fenwick_add(tree, cell, -1.0)
+            total -= 1
+            if cell_weight[cell] <= 0:
+                fenwick_add(tree, cell, -cell_weight[cell])
+                total -= cell_weight[cell]
+                cell_weight[cell] = 0
+                concept = cell_concept[cell]
+                if cell_prev[cell] >= 0:
+                    cell_next[cell_prev[cell]] = cell_next[cell]
+                else:
+                    head[concept] = cell_next[cell]
+                if cell_next[cell] >= 0:
+                    cell_prev[cell_next[cell]] = cell_prev[cell]
+                else:
+                    tail[concept] = cell_prev[cell]
+                free[n_free] = cell
+                n_free += 1
+
+    return (cell_concept, cell_word, cell_weight, cell_next, cell_prev,
+            free, n_free, n_cells, word_label, n_words)
+
+
+def flat_network(semantics):
+    """Store the connections of a semantic network as flat arrays.
+
+    Return the list of concepts, their cumulative concept weights, and
+    the neighbor weights of every concept (see
+    `SemanticNetwork.neighbor_weights`) in compressed sparse row format.
+    The arrays are cached on the network for its current
+    `neighbor_factor`.
+
+    """
+    try:
+        factor, arrays = semantics._flat_network
+        if factor == semantics.neighbor_factor:
+            return arrays
+    except AttributeError:
+        pass
+    concepts, heap = semantics.cumulative_concept_weights()
+    index = {concept: i for i, concept in enumerate(concepts)}
+    indptr = [0]
+    indices = []
+    weights = []
+    for concept in concepts:
+        for neighbor, weight in semantics.neighbor_weights(concept).items():
+            indices.append(index[neighbor])
+            weights.append(weight)
+        indptr.append(len(indices))
+    arrays = (concepts, numpy.array(heap, dtype=float),
+              numpy.array(indptr, dtype=numpy.int64),
+              numpy.array(indices, dtype=numpy.int64),
+              numpy.array(weights, dtype=float))
+    semantics._flat_network = semantics.neighbor_factor, arrays
+    return arrays
+
+
+class KernelLanguage (Language):
+    """A language which runs the steps of each branch in `run_steps`."""
+    use_kernel = available
+
+    def advance(self, steps, random=numpy.random):
+        """Run `steps` steps of the simulation.
+
+        This consumes exactly one `random.randint(2 ** 32)`, to seed the
+        kernel's random number generator, unless the kernel is not used.
+
+        """
+        if not self.use_kernel:
+            return super().advance(steps, random=random)
+        compile_kernel()
+        concepts, heap, indptr, network, weights = flat_network(
+            self.semantics)
+        # Concepts outside the semantic network are never drawn, but their
+        # cells can lose weight.
+        concepts = concepts + [c for c in self if c not in self.semantics]
+        indptr = numpy.concatenate((
+            indptr, numpy.full(len(concepts) + 1 - len(indptr), indptr[-1])))
+
+        words = []
+        word_index = {}
+        cells = []
+        integral = True
+        for concept, concept_words in self.items():
+            for word, weight in concept_words.items():
+                if weight > 0:
+                    if word not in word_index:
+                        word_index[word] = len(words)
+                        words.append(word)
+                    cells.append((concept, word_index[word], weight))
+                    if not isinstance(weight, numbers.Integral):
+                        integral = False
+        capacity = 2 * len(cells) + 2
+        concept_index = {concept: i for i, concept in enumerate(concepts)}
+        cell_concept = numpy.zeros(capacity, dtype=numpy.int64)
+        cell_word = numpy.zeros(capacity, dtype=numpy.int64)
+        cell_weight = numpy.zeros(capacity)
+        cell_next = numpy.full(capacity, -1, dtype=numpy.int64)
+        cell_prev = numpy.full(capacity, -1, dtype=numpy.int64)
+        head = numpy.full(len(concepts), -1, dtype=numpy.int64)
+        tail = numpy.full(len(concepts), -1, dtype=numpy.int64)
+        for cell, (concept, word, weight) in enumerate(cells):
+            c = concept_index[concept]
+            cell_concept[cell] = c
+            cell_word[cell] = word
+            cell_weight[cell] = weight
+            if tail[c] >= 0:
+                cell_next[tail[c]] = cell
+                cell_prev[cell] = tail[c]
+            else:
+                head[c] = cell
+            tail[c] = cell
+        word_label = numpy.zeros(2 * len(words) + 2, dtype=numpy.int64)
+
+        (cell_concept, cell_word, cell_weight, cell_next, cell_prev,
+         free, n_free, n_cells, word_label, n_words) = run_steps(
+             steps, random.randint(2 ** 32), heap, indptr, network, weights,
+             head, tail, cell_concept, cell_word, cell_weight,
+             cell_next, cell_prev, numpy.zeros(capacity, dtype=numpy.int64),
+             0, len(cells), word_label, len(words))
+
+        words.extend(word_label[len(words):n_words].tolist())
+        for concept_words in self.values():
+            concept_words.clear()
+        self._scores = {}
+        self._support = {}
+        for c, concept in enumerate(concepts):
+            cell = head[c]
+            while cell >= 0:
+                weight = float(cell_weight[cell])
+                self[concept][words[cell_word[cell]]] = (
+                    int(weight) if integral and weight.is_integer()
+                    else weight)
+                cell = cell_next[cell]
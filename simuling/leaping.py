@@ -0,0 +1,111 @@
+"""Approximate simulation of long branches, leaping over many steps.
+
+The exact simulation runs `Language.step` once per unit of branch length,
+so long branches take very long. A `LeapingLanguage` advances in leaps of
+many steps instead, in the spirit of tau-leaping for stochastic
+simulations: The most expensive part of a step is drawing the (concept,
+word) pair that loses a random unit of weight, because it needs the
+cumulative weights of the whole language. Within a leap, these random
+losses are drawn at once from the language as it was at the start of the
+leap, and applied together at the end of the leap.
+
+"""
+
+import numpy
+
+from .simulation import Language
+
+
+class LeapingLanguage (Language):
+    """A language that advances in approximate leaps of many steps.
+
+    The size of a leap is controlled by `tolerance`: Every step removes
+    up to two units of weight from (concept, word) pairs chosen with
+    probability proportional to their weight, so during a leap of L steps,
+    every pair is expected to lose up to a fraction 2 L / W of its weight
+    without this loss being visible to the competition of words, where W
+    is the total weight of the language. Leaps are as long as possible
+    while keeping that fraction below `tolerance`. Stretches that would be
+    shorter than `min_leap` steps are simulated exactly.
+
+    """
+    tolerance = 0.01
+    min_leap = 16
+
+    def leap_size(self):
+        """The number of steps the next leap may span."""
+        total = 0
+        for words in self.values():
+            for weight in words.values():
+                if weight > 0:
+                    total += weight
+        return int(self.tolerance * total / 2)
+
+    def advance(self, steps, random=numpy.random):
+        """Run approximately `steps` steps of the simulation."""
+        while steps > 0:
+            size = min(steps, self.leap_size())
+            if size < self.min_leap:
+                size = min(steps, self.min_leap)
+                super().advance(size, random=random)
+            else:
+                self.leap(size, random=random)
+            steps -= size
+
+    def leap(self, size, random=numpy.random):
+        """Run `size` steps of the simulation as one leap.
+
+        The concept pairs of all steps are drawn at once and compete in
+        order, as in `Language.step`. The units of weight that every step
+        removes from a random (concept, word) pair, however, are drawn
+        from the language as it was at the start of the leap, summed up
+        per pair, and removed at the end of the leap. Pairs whose weight
+        drops to zero or below are removed.
+
+        The random numbers are consumed in a fixed order: One
+        `rand(size)` each for the first and the second concepts, one
+        `rand(n)` for each round of re-drawing the n second concepts equal
+        to their first concept, one `randint(2 ** 40)` for each new word
+        (in order of the steps, first concept first), and finally one
+        `rand(m)` for the m random pairs that lose weight.
+
+        A language without any positive weight has no pairs to draw from,
+        so it runs `size` exact steps instead.
+
+        """
+        cells = []
+        weights = []
+        for concept, words in self.items():
+            for word, weight in words.items():
+                if weight > 0:
+                    cells.append((concept, word))
+                    weights.append(weight)
+        if not cells:
+            return super().advance(size, random=random)
+        cumulative = numpy.cumsum(weights)
+
+        concepts, _ = self.semantics.cumulative_concept_weights()
+        first = self.semantics.random_concepts(size, random=random)
+        second = self.semantics.random_concepts(size, random=random)
+        same = numpy.flatnonzero(first == second)
+        while len(same):
+            second[same] = self.semantics.random_concepts(
+                len(same), random=random)
+            same = same[first[same] == second[same]]
+
+        random_decrements = size
+        for concept_1, concept_2 in zip(first.tolist(), second.tolist()):
+            cell = self.compete(
+                concepts[concept_1], concepts[concept_2], random=random)
+            if cell is None:
+                random_decrements += 1
+            else:
+                self.change_weight(*cell, -1)
+
+        hits, counts = numpy.unique(
+            numpy.searchsorted(
+                cumulative, random.rand(random_decrements) * cumulative[-1],
+                side="right"),
+            return_counts=True)
+        for index, count in zip(hits.tolist(), counts.tolist()):
+            self.change_weight(*cells[index], -count)
@@ -0,0 +1,148 @@
+"""Random number streams for the nodes of a phylogeny.
+
+Every node of a phylogeny gets its own random number stream. Streams are
+derived from the raw seed and the position of the node in the tree using
+NumPy's `SeedSequence`, so they are independent of node names, of each
+other, and of the order in which nodes are simulated (which matters for
+parallel simulations).
+
+"""
+
+import hashlib
+
+import numpy
+
+# The stream key of the root of a phylogeny. The key of any other node is
+# derived from its ancestor's key and its position among its siblings.
+ROOT = b""
+
+bit_generators = {
+    "pcg64": numpy.random.PCG64,
+    "philox": numpy.random.Philox}
+
+
+def child_key(key, index):
+    """Derive the stream key of the `index`th child of a node.
+
+    Keys are hashes of the path from the root, so they have a fixed size
+    independent of the depth of the node.
+
+    """
+    return hashlib.blake2b(
+        key + index.to_bytes(8, "little"), digest_size=16).digest()
+
+
+def with_stream_keys(walk):
+    """Add the stream key to every (node, height) pair of a tree walk.
+
+    The walk must visit every node after its ancestor. Its first node is
+    taken as root.
+
+    """
+    keys = {}
+    for node, height in walk:
+        key = keys.pop(node, ROOT)
+        # Derive the keys of the children here, where their indices are
+        # known, instead of looking each child up among its siblings.
+        for index, child in enumerate(node.descendants):
+            keys[child] = child_key(key, index)
+        yield node, height, key
+
+
+def local_seed(node, raw_seed):
+    """Given a Node object and a raw seed, calculate a node-specific seed.
+
+    This is the legacy seed for `numpy.random.RandomState`. It uses the
+    node's name, so for equal raw seeds, the local seeds of anonymous nodes
+    will be identical.
+
+    """
+    name_hash = int(hashlib.sha256(
+        (node.name or "").encode("utf-8")).hexdigest(), 16)
+    return (name_hash + raw_seed) % 2**32
+
+
+class BlockRandom ():
+    """Draw random numbers from a SeedSequence in blocks.
+
+    Calling a numpy Generator for every single number has a large overhead
+    compared to the generation itself, so draw `block_size` numbers at
+    once and hand them out one by one. This object provides the two
+    methods of `numpy.random.RandomState` used by the simulations.
+
+    The sequence spawns two independent streams, the first for `rand`, the
+    second for `randint`. The k-th call of `rand` returns the k-th double
+    of the first stream's `Generator.random`. The k-th call of `randint`
+    consumes exactly the k-th raw 64-bit output of the second stream. So
+    the numbers do not depend on the block size, nor on how calls of the
+    two methods interleave.
+
+    """
+    def __init__(self, sequence, bit_generator=numpy.random.PCG64,
+                 block_size=1024):
+        uniform_sequence, integer_sequence = sequence.spawn(2)
+        self._uniform_generator = numpy.random.Generator(
+            bit_generator(uniform_sequence))
+        self._integer_generator = bit_generator(integer_sequence)
+        self.block_size = block_size
+        self._uniforms = []
+        self._next_uniform = 0
+        self._raw = []
+        self._next_raw = 0
+
+    def rand(self, *size):
+        """Return a random float in [0, 1), or an array of such floats.
+
+        Like `numpy.random.RandomState.rand`, the optional arguments give
+        the shape of the array. The array holds the next numbers of the
+        stream, in the order they would be returned one by one.
+
+        """
+        if size:
+            count = int(numpy.prod(size))
+            values = self._uniforms[
+                self._next_uniform:self._next_uniform + count]
+            self._next_uniform += len(values)
+            if len(values) < count:
+                values = values + self._uniform_generator.random(
+                    count - len(values)).tolist()
+            return numpy.array(values).reshape(size)
+        if self._next_uniform >= len(self._uniforms):
+            self._uniforms = self._uniform_generator.random(
+                self.block_size).tolist()
+            self._next_uniform = 0
+        self._next_uniform += 1
+        return self._uniforms[self._next_uniform - 1]
+
+    def randint(self, high):
+        """Return a random integer in [0, high).
+
+        For powers of two, take the lowest bits of a raw 64-bit output.
+        Otherwise scale the raw output by multiplication and shift, which
+        has a bias of at most high / 2^64.
+
+        """
+        if self._next_raw >= len(self._raw):
+            self._raw = self._integer_generator.random_raw(
+                self.block_size).tolist()
+            self._next_raw = 0
+        raw = self._raw[self._next_raw]
+        self._next_raw += 1
+        if high & (high - 1) == 0:
+            return raw & (high - 1)
+        return (raw * high) >> 64
+
+
+def node_random(node, key, seed, rng="pcg64"):
+    """Create the random number stream for a node.
+
+    `key` is the node's stream key (see `child_key`). With `rng="legacy"`,
+    return the RandomState seeded from the node name that was used before
+    per-node streams were introduced, to reproduce older simulations.
+
+    """
+    if rng == "legacy":
+        return numpy.random.RandomState(local_seed(node, seed))
+    sequence = numpy.random.SeedSequence(
+        seed, spawn_key=tuple(numpy.frombuffer(key, dtype=numpy.uint32)))
+    return BlockRandom(sequence, bit_generators[rng])
@@ -3,8 +3,13 @@
 
 """
 
+import os
+import json
+import math
+import heapq
 import bisect
 import hashlib
+import tempfile
 import collections
 import numpy.random
 
@@ -13,6 +18,9 @@ import multiprocessing as mp
 
 import networkx
 
+from .cache import cache_directory
+from .randomness import ROOT, child_key, node_random, with_stream_keys
+
 
 def constant_zero():
     """lambda: 0
@@ -24,13 +32,66 @@ def constant_zero():
     return 0
 
 
-# We need pickle-able functions for multiprocessing, so define this as named
-# function.
+# We need pickle-able functions for multiprocessing, so define these as named
+# functions.
+def one(x):
+    """Return 1."""
+    return 1
+
+
+def identity(x):
+    """Return the argument."""
+    return x
+
+
 def square(x):
     """Square a number."""
     return x**2
 
 
+def exponential(x):
+    """Return 2 to the power of a number."""
+    return 2 ** x
+
+
+concept_weights = {
+    "one": one,
+    "degree": identity,
+    "square": square,
+    "exponential": exponential}
+
+
+def network_cache_path(digest, weight_attribute):
+    """Return the path of the cached network for a GML digest."""
+    key = hashlib.sha256(
+        "{:}\0{:}".format(digest, weight_attribute).encode("utf-8"))
+    return cache_directory() / "networks" / (key.hexdigest() + ".npz")
+
+
+# The semantic networks known to this process, by `registry_key`.
+_registry = {}
+
+
+def registered_network(key):
+    """Return the semantic network described by `key`.
+
+    Semantic networks are pickled by reference to their cached GML, so
+    this function loads every network only once per process.
+
+    """
+    try:
+        return _registry[key]
+    except KeyError:
+        pass
+    cls, digest, weight_attribute, neighbor_factor, concept_weight = key
+    network = cls.load_cached(digest, weight_attribute)
+    network.neighbor_factor = neighbor_factor
+    if concept_weight is not None:
+        network._concept_weight = concept_weights[concept_weight]
+    _registry[key] = network
+    return network
+
+
 class SemanticNetwork (networkx.Graph):
     """A network describing relations between concepts.
 
@@ -43,12 +104,146 @@ class SemanticNetwork (networkx.Graph):
         self.neighbor_factor = neighbor_factor
 
     @classmethod
-    def load_from_gml(cls, lines, weight_attribute):
+    def load_from_gml(cls, lines, weight_attribute, cache=True):
+        """Load a semantic network from GML.
+
+        Parsing GML is slow, so the parsed network is cached in a binary
+        format, keyed by the digest of the GML and the weight attribute.
+        Networks loaded this way are pickled by reference to the cache, so
+        they must not be modified after loading.
+
+        """
+        if isinstance(lines, str):
+            lines = lines.split("\n")
+        lines = [line.rstrip("\n") for line in lines]
+        digest = hashlib.sha256(
+            "\n".join(lines).encode("utf-8")).hexdigest()
+        if cache:
+            try:
+                return cls.load_cached(digest, weight_attribute)
+            except (OSError, ValueError, KeyError):
+                pass
         related_concepts = networkx.parse_gml(lines)
         network = cls(related_concepts)
         network.weight_attribute = weight_attribute
+        if cache:
+            try:
+                network.save_cached(digest)
+            except (OSError, TypeError, ValueError):
+                # Not cacheable, but still usable.
+                return network
+            network._gml_digest = digest
+        return network
+
+    def save_cached(self, digest):
+        """Store the network as arrays in the cache.
+
+        The arrays hold the node labels, the degree of each node, the
+        neighbors of each node (as indices, in adjacency order) and the
+        index of each edge. The attributes of the graph, of the nodes and
+        of the edges are stored as JSON.
+
+        """
+        labels = list(self)
+        index = {label: i for i, label in enumerate(labels)}
+        neighbors = []
+        edges = []
+        edge_index = {}
+        edge_data = []
+        for label in labels:
+            for neighbor, data in self._adj[label].items():
+                neighbors.append(index[neighbor])
+                edge = frozenset((label, neighbor))
+                if edge not in edge_index:
+                    edge_index[edge] = len(edge_data)
+                    edge_data.append(data)
+                edges.append(edge_index[edge])
+        attributes = json.dumps({
+            "graph": self.graph,
+            "nodes": [self.nodes[label] for label in labels],
+            "edges": edge_data})
+        path = network_cache_path(digest, self.weight_attribute)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(
+            dir=str(path.parent), suffix=".npz")
+        with os.fdopen(handle, "wb") as file:
+            numpy.savez(
+                file,
+                labels=numpy.array(labels, dtype=str),
+                degrees=numpy.array([len(self._adj[label])
+                                     for label in labels], dtype=int),
+                neighbors=numpy.array(neighbors, dtype=int),
+                edges=numpy.array(edges, dtype=int),
+                attributes=numpy.array(attributes))
+        os.replace(temporary, str(path))
+
+    @classmethod
+    def load_cached(cls, digest, weight_attribute):
+        """Load a network stored by `save_cached`.
+
+        The edges are added for every node in adjacency order, like
+        `networkx.Graph` copies a graph, which keeps the node and adjacency
+        order of the original network, so random concepts are drawn
+        exactly as from the parsed GML.
+
+        """
+        path = network_cache_path(digest, weight_attribute)
+        with numpy.load(str(path), allow_pickle=False) as arrays:
+            labels = arrays["labels"].tolist()
+            offsets = numpy.concatenate(
+                [[0], numpy.cumsum(arrays["degrees"])]).tolist()
+            neighbors = arrays["neighbors"].tolist()
+            edges = arrays["edges"].tolist()
+            attributes = json.loads(str(arrays["attributes"]))
+        network = cls()
+        network.graph.update(attributes["graph"])
+        network.add_nodes_from(zip(labels, attributes["nodes"]))
+        edge_data = attributes["edges"]
+        network.add_edges_from(
+            (label, labels[neighbors[i]], edge_data[edges[i]])
+            for node, label in enumerate(labels)
+            for i in range(offsets[node], offsets[node + 1]))
+        network.weight_attribute = weight_attribute
+        network._gml_digest = digest
         return network
 
+    def registry_key(self):
+        """Describe this network for `registered_network`.
+
+        Return None if the network cannot be reconstructed from the
+        cache.
+
+        """
+        digest = getattr(self, "_gml_digest", None)
+        if digest is None or "concept_weight" in self.__dict__:
+            return None
+        concept_weight = None
+        if hasattr(self, "_concept_weight"):
+            for name, function in concept_weights.items():
+                if function is self._concept_weight:
+                    concept_weight = name
+                    break
+            else:
+                return None
+        return (type(self), digest, self.weight_attribute,
+                self.neighbor_factor, concept_weight)
+
+    def __reduce_ex__(self, protocol):
+        key = self.registry_key()
+        if key is None:
+            return super().__reduce_ex__(protocol)
+        _registry.setdefault(key, self)
+        return registered_network, (key,)
+
+    def concept_index(self):
+        """Map every concept to its position in the order of nodes."""
+        try:
+            return self._concept_index
+        except AttributeError:
+            self._concept_index = {
+                concept: i for i, concept in enumerate(self)}
+            return self._concept_index
+
     def edge_weight(self, original_meaning, connected_meaning):
         try:
             edge_properties = self[original_meaning][connected_meaning]
@@ -61,21 +256,65 @@ class SemanticNetwork (networkx.Graph):
             raw_weight = 1
         return self.neighbor_factor * raw_weight
 
+    def neighbor_weights(self, concept):
+        """Map a concept and its neighbors to the weights of the connections.
+
+        The concept itself has weight 1. The dictionaries are cached for
+        the current `neighbor_factor`, so they must not be changed.
+
+        """
+        try:
+            factor, cache = self._neighbor_weights
+        except AttributeError:
+            factor, cache = None, {}
+        if factor != self.neighbor_factor:
+            cache = {}
+            self._neighbor_weights = self.neighbor_factor, cache
+        try:
+            return cache[concept]
+        except KeyError:
+            weights = {x: self.edge_weight(concept, x) for x in self[concept]}
+            weights[concept] = 1
+            cache[concept] = weights
+            return weights
+
     def concept_weight(self, concept):
         return len(self[concept]) ** 2
 
-    def random(self, random=numpy.random):
+    def cumulative_concept_weights(self):
+        """Return the list of concepts and their cumulative weights."""
         try:
-            max_heap = self._heap[-1]
+            return self._concepts, self._heap
         except AttributeError:
             self._heap = []
+            self._concepts = list(self.nodes())
             max_heap = 0
-            for concept in self.nodes():
+            for concept in self._concepts:
                 max_heap += self.concept_weight(concept)
                 self._heap.append(max_heap)
-        index = bisect.bisect(self._heap,
-                              random.rand() * max_heap)
-        return list(self.nodes())[index]
+            return self._concepts, self._heap
+
+    def random(self, random=numpy.random):
+        """Draw a random concept, weighted by concept weight.
+
+        This consumes exactly one `random.rand()`.
+
+        """
+        concepts, heap = self.cumulative_concept_weights()
+        index = bisect.bisect(heap, random.rand() * heap[-1])
+        return concepts[index]
+
+    def random_concepts(self, size, random=numpy.random):
+        """Draw many random concepts at once, weighted by concept weight.
+
+        Return an array of the positions of the concepts in the list of
+        nodes. This consumes exactly one `random.rand(size)`, and draws the
+        same concepts as `size` calls of `random` would.
+
+        """
+        concepts, heap = self.cumulative_concept_weights()
+        return numpy.searchsorted(
+            heap, random.rand(size) * heap[-1], side="right")
 
 
 class SemanticNetworkWithConceptWeight (SemanticNetwork):
@@ -102,28 +341,189 @@ class WeightedBipartiteGraph (dict):
         self[left][right] = weight
 
 
+def compact_array(values):
+    """Store values in a small NumPy array, keeping their Python type.
+
+    Plain ints become the smallest integer array that holds them, plain
+    floats a float64 array. Everything else (including mixtures of ints
+    and floats) is kept in an object array.
+
+    """
+    types = set(map(type, values))
+    if values and types <= {int}:
+        dtype = numpy.result_type(numpy.min_scalar_type(min(values)),
+                                  numpy.min_scalar_type(max(values)))
+        if dtype.kind in "iu":
+            return numpy.array(values, dtype=dtype)
+    elif types <= {float}:
+        return numpy.array(values, dtype=numpy.float64)
+    array = numpy.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def rebuild_language(cls, semantics, concepts, counts, words, weights):
+    """Reconstruct a Language from the arrays made by its __reduce__."""
+    language = cls.__new__(cls)
+    language.semantics = semantics
+    language._scores = {}
+    language._support = {}
+    if isinstance(concepts, numpy.ndarray):
+        labels = list(semantics)
+        concepts = [labels[i] for i in concepts.tolist()]
+    words = words.tolist()
+    weights = weights.tolist()
+    start = 0
+    for concept, count in zip(concepts, counts.tolist()):
+        language[concept] = collections.defaultdict(
+            constant_zero,
+            zip(words[start:start + count], weights[start:start + count]))
+        start += count
+    return language
+
+
 class Language (WeightedBipartiteGraph):
+    # How `calculate_scores` works: "cached" reads the scores from a cache
+    # that `change_weight` keeps up to date, "full" recomputes them every
+    # time, and "verify" checks the cache against a full recomputation.
+    scoring = "cached"
+
     def __init__(self, dictionary, semantics):
         super().__init__(dictionary)
         self.semantics = semantics
+        self._scores = {}
+        self._support = {}
+
+    def __reduce__(self):
+        """Pickle the language as flat arrays.
+
+        Instead of one defaultdict per concept, store the concepts (as
+        positions in the semantic network, where possible), the number of
+        words for each concept, and all words and weights in parallel
+        arrays. The semantic network itself is pickled by registry key
+        where possible.
+
+        """
+        concepts = list(self)
+        words = []
+        weights = []
+        for words_for_concept in self.values():
+            words.extend(words_for_concept)
+            weights.extend(words_for_concept.values())
+        try:
+            index = self.semantics.concept_index()
+            concepts = compact_array([index[c] for c in concepts])
+        except (AttributeError, KeyError):
+            pass
+        state = self.__dict__.copy()
+        for attribute in ["semantics", "_scores", "_support"]:
+            state.pop(attribute, None)
+        return (rebuild_language,
+                (type(self), self.semantics, concepts,
+                 compact_array([len(ws) for ws in self.values()]),
+                 compact_array(words), compact_array(weights)),
+                state)
 
     def weighted_neighbors(self, concept):
-        weights = {
-            x: self.semantics.edge_weight(concept, x)
-            for x in self.semantics[concept]}
-        weights[concept] = 1
-        return weights
+        return dict(self.semantics.neighbor_weights(concept))
 
-    def calculate_scores(self, concept):
+    def full_scores(self, concept):
+        """Calculate the scores of the words for a concept from scratch.
+
+        The score of a word is the sum of its weights for the concept and
+        for the concept's neighbors, each multiplied by the weight of the
+        connection. Return the scores and, for each word, the number of
+        concepts contributing to its score.
+
+        """
         score = {}
-        for s_concept, s_weight in self.weighted_neighbors(concept).items():
+        support = {}
+        for s_concept, s_weight in self.semantics.neighbor_weights(
+                concept).items():
             for word, weight in self[s_concept].items():
                 if weight > 0:
                     score.setdefault(word, 0)
                     score[word] += weight * s_weight
-        return score
+                    support[word] = support.get(word, 0) + 1
+        return score, support
+
+    def calculate_scores(self, concept):
+        """Return a new dictionary of the scores of the words for a concept.
+
+        Unless `scoring` is "full", the scores are computed once per
+        concept and then kept up to date by `change_weight`.
+
+        """
+        if self.scoring == "full":
+            return self.full_scores(concept)[0]
+        try:
+            score = self._scores[concept]
+        except KeyError:
+            score, self._support[concept] = self.full_scores(concept)
+            self._scores[concept] = score
+        if self.scoring == "verify":
+            self.verify_scores(concept)
+        return dict(score)
+
+    def verify_scores(self, concept):
+        """Check the cached scores of a concept against a recomputation."""
+        expected = self.full_scores(concept)[0]
+        cached = self._scores[concept]
+        if set(cached) != set(expected) or not all(
+                math.isclose(cached[word], score,
+                             rel_tol=1e-9, abs_tol=1e-12)
+                for word, score in expected.items()):
+            raise AssertionError(
+                "Cached scores {:} for concept {:} differ from the "
+                "recomputed scores {:}".format(cached, concept, expected))
+
+    def set_weight(self, concept, word, weight):
+        """Set the weight of a word for a concept.
+
+        Words with weight zero or below are removed. The cached scores of
+        the concept and its neighbors are adjusted by the weighted change.
+
+        """
+        words = self[concept]
+        old = words.get(word, 0)
+        if weight > 0:
+            words[word] = weight
+        else:
+            words.pop(word, None)
+        if not self._scores or concept not in self.semantics:
+            # Concepts outside the semantic network contribute to no score.
+            return
+        change = max(weight, 0) - max(old, 0)
+        support = (weight > 0) - (old > 0)
+        if not change:
+            return
+        for target, wt in self.semantics.neighbor_weights(concept).items():
+            try:
+                score = self._scores[target]
+            except KeyError:
+                continue
+            counts = self._support[target]
+            count = counts.get(word, 0) + support
+            if count:
+                counts[word] = count
+                score[word] = score.get(word, 0) + change * wt
+            else:
+                del counts[word]
+                del score[word]
+
+    def change_weight(self, concept, word, delta):
+        """Change the weight of a word for a concept by `delta`."""
+        self.set_weight(concept, word, self[concept].get(word, 0) + delta)
+
+    def add_edge(self, concept, word, weight):
+        self.set_weight(concept, word, weight)
 
     def random_edge(self, random=numpy.random):
+        """Draw a random (concept, word) pair, weighted by its weight.
+
+        This consumes exactly one `random.rand()`.
+
+        """
         weights = []
         edges = []
         max_weight = 0
@@ -137,12 +537,42 @@ class Language (WeightedBipartiteGraph):
         return edges[index]
 
     def step(self, random=numpy.random):
+        """Run one step of the simulation.
+
+        The random numbers are consumed in a fixed order: One `rand()` for
+        the first concept and one for each attempt at drawing a different
+        second concept, one `randint(2 ** 40)` for each of the two concepts
+        that gets a new word (first concept first), one `rand()` for a
+        random edge if there is no confusing word, and a final `rand()` for
+        the edge that loses weight.
+
+        """
         # Choose v_0
         concept_1 = self.semantics.random(random=random)
         # Choose v_1
         concept_2 = self.semantics.random(random=random)
         while concept_1 == concept_2:
             concept_2 = self.semantics.random(random=random)
+
+        # Reduce confusing word.
+        cell = self.compete(concept_1, concept_2, random=random)
+        if cell is None:
+            cell = self.random_edge(random=random)
+        self.change_weight(*cell, -1)
+
+        # Remove a unit of weight.
+        concept, word = self.random_edge(random=random)
+        self.change_weight(concept, word, -1)
+
+    def compete(self, concept_1, concept_2, random=numpy.random):
+        """Strengthen the words of two concepts drawn in a step.
+
+        Each concept's best word that is not also used for the other
+        concept gains a unit of weight, or, if there is no such word, the
+        concept gets a new word. Return the most confusing (concept, word)
+        pair of the two concepts (see `confusing_cell`), or None.
+
+        """
         # Calculate scores x_w0 for v_0
         neighbors_1 = self.calculate_scores(concept_1)
         # Calculate scores x_w1 for v_1
@@ -152,7 +582,7 @@ class Language (WeightedBipartiteGraph):
         # Adapt the language
         if words_for_c1_only:
             incumbent = max(words_for_c1_only, key=neighbors_1.get)
-            self[concept_1][incumbent] += 1
+            self.change_weight(concept_1, incumbent, 1)
         else:
             new_word = random.randint(2 ** 40)
             self.add_edge(concept_1, new_word, 1)
@@ -161,40 +591,59 @@ class Language (WeightedBipartiteGraph):
         # Adapt the language
         if words_for_c2_only:
             incumbent = max(words_for_c2_only, key=neighbors_2.get)
-            self[concept_2][incumbent] += 1
+            self.change_weight(concept_2, incumbent, 1)
         else:
             new_word = random.randint(2 ** 40)
             self.add_edge(concept_2, new_word, 1)
 
-        # Reduce confusing word.
+        return self.confusing_cell(
+            concept_1, concept_2, neighbors_1, neighbors_2)
+
+    def confusing_cell(self, concept_1, concept_2, neighbors_1, neighbors_2):
+        """Find the (concept, word) pair that most confuses two concepts.
+
+        Among the words with scores `neighbors_1` and `neighbors_2` for
+        both concepts, find the one with the highest weight for a concept
+        close to either of them, multiplied by the connection weight.
+        Return None if there is no such word.
+
+        """
         all_neighbors = self.weighted_neighbors(concept_1)
-        for neighbor, wt in self.weighted_neighbors(concept_2).items():
+        for neighbor, wt in self.semantics.neighbor_weights(
+                concept_2).items():
             all_neighbors[neighbor] = all_neighbors.get(neighbor, 0) + wt
 
-        confusing_weight = 0
-        for word, weight in neighbors_1.items():
+        # Look at the words of every close concept once, instead of looking
+        # up every shared word for every close concept. Of several cells
+        # with the same weight, take the first in order of the shared words
+        # and then of the close concepts, as the direct nested loop would.
+        shared = {}
+        for rank, word in enumerate(neighbors_1):
             if word in neighbors_2:
-                for target, wt in all_neighbors.items():
-                    weight = self[target].get(word, 0) * wt
-                    if weight > confusing_weight:
-                        confusing_word = word
-                        confusing_meaning = target
-                        confusing_weight = weight
-        if confusing_weight:
-            self[confusing_meaning][confusing_word] -= 1
-            if self[confusing_meaning][confusing_word] <= 0:
-                del self[confusing_meaning][confusing_word]
-        else:
-            concept, word = self.random_edge(random=random)
-            self[concept][word] -= 1
-            if self[concept][word] <= 0:
-                del self[concept][word]
-
-        # Remove a unit of weight.
-        concept, word = self.random_edge(random=random)
-        self[concept][word] -= 1
-        if self[concept][word] <= 0:
-            del self[concept][word]
+                shared[word] = rank
+        if not shared:
+            return None
+        best = None
+        for target_rank, (target, wt) in enumerate(all_neighbors.items()):
+            for word, weight in self[target].items():
+                word_rank = shared.get(word)
+                if word_rank is None:
+                    continue
+                weight = weight * wt
+                if weight <= 0:
+                    continue
+                if (best is None or weight > best[0] or
+                        weight == best[0] and
+                        (word_rank, target_rank) < best[1]):
+                    best = weight, (word_rank, target_rank), (target, word)
+        if best is None:
+            return None
+        return best[2]
+
+    def advance(self, steps, random=numpy.random):
+        """Run `steps` steps of the simulation."""
+        for i in range(steps):
+            self.step(random=random)
 
     def __str__(self):
         return ",\n".join([
@@ -208,13 +657,20 @@ class Language (WeightedBipartiteGraph):
             if ws])
 
     def copy(self):
-        return Language(
+        language = type(self)(
             {concept: collections.defaultdict(
                 constant_zero,
                 {word: weight
                  for word, weight in words.items()})
              for concept, words in self.items()},
             self.semantics)
+        # The score cache is not copied: The order of the cached scores
+        # breaks ties in `step`, so a copy must behave like a language
+        # sent to another process, which starts with an empty cache.
+        for attribute, value in self.__dict__.items():
+            if attribute not in {"semantics", "_scores", "_support"}:
+                setattr(language, attribute, value)
+        return language
 
     def write(self, name, writer):
         for concept, words in self.items():
@@ -224,35 +680,48 @@ class Language (WeightedBipartiteGraph):
                         name, concept, word, weight])
 
 
-def local_seed(node, raw_seed):
-    """Given a Node object and a raw seed, calculate a node-specific seed.
+# Which of the languages generated in a simulation are handed on to the
+# caller. All named languages are written in any case.
+retention = {
+    "all": lambda node: True,
+    "leaves": lambda node: not node.descendants,
+    "none": lambda node: False}
 
-    Currently, this function uses the node's name, so for equal raw seeds, the
-    local seeds of anonymous nodes will be identical.
 
-    """
-    name_hash = int(hashlib.sha256(
-        (node.name or "").encode("utf-8")).hexdigest(), 16)
-    return (name_hash + raw_seed) % 2**32
+def simulate(phylogeny, language,
+             seed=0, writer=None, rng="pcg64", retain="all"):
+    """Run a simulation of a root language down a phylogeny.
 
+    Walk the phylogeny in pre-order, using an explicit stack instead of
+    recursion, so the depth of the tree is not limited. Every node starts
+    from a copy of its ancestor's language, and the language of every
+    named node is written to `writer` (if given) and, if it matches the
+    `retain` policy (see `retention`), generated. A language is kept only
+    until the last of its children has started, so at any time there are
+    at most as many languages in memory as the tree is deep, plus those
+    the caller keeps.
 
-def simulate(phylogeny, language,
-             seed=0, writer=None):
-    """Run a simulation of a root language down a phylogeny."""
-    random = numpy.random.RandomState(local_seed(phylogeny, seed))
-    for i in range(int(phylogeny.length)):
-        language.step(random=random)
-
-    if phylogeny.name:
-        if writer:
-            language.write(phylogeny.name, writer)
-        yield (phylogeny.name, language)
-    for c, child in enumerate(phylogeny.descendants):
-        for (name, l) in simulate(child, language.copy(),
-                                  seed=seed):
+    Every node uses its own random number stream, see
+    `simuling.randomness.node_random` for the options for `rng`.
+
+    """
+    retained = retention[retain]
+    stack = [(phylogeny, language, ROOT)]
+    while stack:
+        node, language, key = stack.pop()
+        if node is not phylogeny:
+            language = language.copy()
+        random = node_random(node, key, seed, rng)
+        language.advance(int(node.length), random=random)
+
+        if node.name:
             if writer:
-                language.write(name, writer)
-            yield (name, l)
+                language.write(node.name, writer)
+            if retained(node):
+                yield (node.name, language)
+        children = node.descendants
+        for c in range(len(children) - 1, -1, -1):
+            stack.append((children[c], language, child_key(key, c)))
 
 
 def walk_depth_order(tree, root_depth=0):
@@ -270,56 +739,100 @@ def walk_depth_order(tree, root_depth=0):
  (Node("G"), 9.3), (Node("F"), 9.4), (Node("E"), 9.5), (Node("D"), 9.6),\
  (Node("C"), 9.7), (Node("B"), 9.8), (Node("A"), 9.9)]
 
+    Nodes of equal depth come in pre-order.
+
     """
-    yield tree, root_depth
-    walkers = [
-        walk_depth_order(descendant, root_depth + descendant.length)
-        for descendant in tree.descendants]
-    next_ones = [next(w) for w in walkers]
-    while next_ones:
-        highest = min(range(len(next_ones)),
-                      key=lambda i: next_ones[i][1])
-        yield next_ones[highest]
-        try:
-            replacement = next(walkers[highest])
-            next_ones[highest] = replacement
-        except StopIteration:
-            del walkers[highest]
-            del next_ones[highest]
+    # Calculate depth and pre-order position of every node in one pass.
+    key = {}
+    stack = [(tree, root_depth)]
+    while stack:
+        node, depth = stack.pop()
+        key[node] = (depth, len(key))
+        for descendant in reversed(node.descendants):
+            stack.append((descendant, depth + descendant.length))
+
+    # The frontier contains the nodes whose ancestors have all been
+    # yielded, so no node comes before its ancestor.
+    frontier = [key[tree] + (tree,)]
+    while frontier:
+        depth, _, node = heapq.heappop(frontier)
+        yield node, depth
+        for descendant in node.descendants:
+            heapq.heappush(frontier, key[descendant] + (descendant,))
 
 
 class Multiprocess ():
-        def __init__(self, n):
+        def __init__(self, n, retain="all"):
             self.n = n
+            self.retain = retain
             manager = mp.Manager()
             self.generated_languages = manager.dict()
+            self.pending = manager.dict()
             self.io_lock = manager.Lock()
 
-        def worker(self, node_with_height):
-            node, height = node_with_height
+        def count_uses(self, phylogeny, done=()):
+            """Count how often the language of every node will be used.
+
+            The language of a node is used once by each child that has to be
+            simulated, and once for being written, except for the root
+            language (stored under the name None). Store the counts in
+            `pending`, and return the names of the nodes whose languages are
+            not retained.
+
+            """
+            uses = {None: 0}
+            not_retained = set()
+            nodes = [node for node, _ in walk_depth_order(phylogeny)]
+            for node in nodes:
+                if node.name in uses:
+                    raise ValueError(
+                        "Duplicate node name or unnamed node found:"
+                        " {:}".format(node.name))
+                uses[node.name] = 1
+                if not retention[self.retain](node):
+                    not_retained.add(node.name)
+            for node in nodes:
+                if node.name not in done:
+                    parent = (None if node.ancestor is None
+                              else node.ancestor.name)
+                    uses[parent] += 1
+            self.pending.update(uses)
+            return not_retained
+
+        def release(self, name):
+            """Count down the uses of a language, and drop it after the last.
+
+            """
+            with self.io_lock:
+                count = self.pending.get(name, 0) - 1
+                if count > 0:
+                    self.pending[name] = count
+                else:
+                    self.pending.pop(name, None)
+                    self.generated_languages.pop(name, None)
+
+        def worker(self, node_with_height_and_key):
+            node, height, key = node_with_height_and_key
             name = node.name
-            if name in self.generated_languages:
-                raise ValueError(
-                    "Duplicate node name or unnamed node found: {:}".format(
-                        name))
             parent = None if node.ancestor is None else node.ancestor.name
 
             start_from = self.generated_languages.get(parent)
             while not start_from:
                 time.sleep(2)
                 start_from = self.generated_languages.get(parent)
+            # The language arrived here as a copy, so the shared one can go.
+            self.release(parent)
 
-            random = numpy.random.RandomState(local_seed(node, self.raw_seed))
+            random = node_random(node, key, self.raw_seed, self.rng)
             end_at = start_from.copy()
-            for i in range(int(node.length)):
-                end_at.step(random=random)
+            end_at.advance(int(node.length), random=random)
 
             self.generated_languages[name] = end_at
 
             return name, end_at
 
         def simulate_remainder(self, phylogeny, language=None,
-                               seed=0, writer=None):
+                               seed=0, writer=None, rng="pcg64"):
             """Run a simulation restricted to generating new languages.
 
             Run a simulation of a root language down a phylogeny, skipping
@@ -329,24 +842,34 @@ class Multiprocess ():
             continuing from an interrupted simulation.
 
             """
+            done = set(self.generated_languages.keys())
+            not_retained = self.count_uses(phylogeny, done)
             for name, language in self.generated_languages.items():
                 if writer:
                     language.write(name, writer)
-                yield name, language
+                self.release(name)
+                if name not in not_retained:
+                    yield name, language
             self.generated_languages[None] = language
             self.raw_seed = seed
-            p = mp.Pool(self.n)
-            for name, language in p.imap(
-                    self.worker,
-                    ((node, height)
-                     for node, height in walk_depth_order(phylogeny)
-                     if node.name not in self.generated_languages)):
-                if writer:
-                    language.write(name, writer)
-                yield name, language
+            self.rng = rng
+            # Leaving the pool context, also by closing this generator early,
+            # terminates all outstanding work.
+            with mp.Pool(self.n) as p:
+                for name, language in p.imap(
+                        self.worker,
+                        ((node, height, key)
+                         for node, height, key in with_stream_keys(
+                                 walk_depth_order(phylogeny))
+                         if node.name not in done)):
+                    if writer:
+                        language.write(name, writer)
+                    self.release(name)
+                    if name not in not_retained:
+                        yield name, language
 
         def simulate(self, phylogeny, language,
-                     seed=0, writer=None):
+                     seed=0, writer=None, rng="pcg64"):
             """Run a simulation of a root language down a phylogeny.
 
             As opposed to the `simulate` function, this method makes use of
@@ -354,15 +877,21 @@ class Multiprocess ():
 
             This method tracks languages which have already been generated by
             name, and therefore expects a tree where all nodes are uniquely
-            named, and raises ValueError otherwise.
+            named, and raises ValueError otherwise. A language is dropped
+            from `generated_languages` as soon as all its children have
+            started and it has been written.
 
             """
+            not_retained = self.count_uses(phylogeny)
             self.generated_languages[None] = language
             self.raw_seed = seed
-            p = mp.Pool(self.n)
-
-            for name, language in p.imap(
-                    self.worker, walk_depth_order(phylogeny)):
-                if writer:
-                    language.write(name, writer)
-                yield name, language
+            self.rng = rng
+            with mp.Pool(self.n) as p:
+                for name, language in p.imap(
+                        self.worker,
+                        with_stream_keys(walk_depth_order(phylogeny))):
+                    if writer:
+                        language.write(name, writer)
+                    self.release(name)
+                    if name not in not_retained:
+                        yield name, language
@@ -0,0 +1,402 @@
+"""Phylogenies stored in arrays."""
+
+import re
+import os
+import zipfile
+import hashlib
+import tempfile
+
+import numpy
+
+from .cache import cache_directory
+
+tokens = re.compile(r"""
+    \s+ |                          # whitespace, ignored
+    \[[^\]]*\] |                   # comment, ignored
+    (?P<symbol>[(),:;]) |
+    '(?P<quoted>(?:[^']|'')*)' |
+    (?P<label>[^\s()\[\]',:;]+)""", re.VERBOSE)
+
+unquoted_label = re.compile(r"[^\s()\[\]',:;]+")
+
+
+def format_label(name):
+    """Format a node name for Newick, quoting it if necessary."""
+    if unquoted_label.fullmatch(name):
+        return name
+    return "'{:}'".format(name.replace("'", "''"))
+
+
+def format_length(length):
+    """Format a branch length for Newick.
+
+    Integral lengths are written without decimal point, so that numbers of
+    change events come out as plain integers.
+
+    >>> format_length(1000.0), format_length(0.25)
+    ('1000', '0.25')
+
+    """
+    length = float(length)
+    if length.is_integer():
+        return "{:d}".format(int(length))
+    return repr(length)
+
+
+class Tree ():
+    """A rooted tree, stored as arrays indexed by node.
+
+    Nodes are numbered in pre-order, so the root is node 0 and every node
+    comes after its ancestor. `parent` holds the index of each node's
+    ancestor (-1 for the root), `length` the length of the branch leading
+    to each node (NaN where no length is given), and `name` the node names
+    (None for anonymous nodes).
+
+    """
+    def __init__(self, parent, length=None, name=None):
+        self.parent = numpy.asarray(parent, dtype=int)
+        if length is None:
+            length = numpy.full(len(self.parent), numpy.nan)
+        self.length = numpy.asarray(length, dtype=float)
+        if name is None:
+            name = [None] * len(self.parent)
+        self.name = list(name)
+
+    def __len__(self):
+        return len(self.parent)
+
+    @property
+    def root(self):
+        """The root of the tree, as `Node`."""
+        return Node(self, 0)
+
+    @property
+    def size(self):
+        """The number of nodes in the subtree of each node."""
+        try:
+            return self._size
+        except AttributeError:
+            self._size = numpy.ones(len(self), dtype=int)
+            for node in range(len(self) - 1, 0, -1):
+                self._size[self.parent[node]] += self._size[node]
+            return self._size
+
+    @property
+    def children(self):
+        """The list of direct descendants for each node, in order."""
+        try:
+            return self._children
+        except AttributeError:
+            self._children = [[] for node in self.parent]
+            for node, parent in enumerate(self.parent[1:], 1):
+                self._children[parent].append(node)
+            return self._children
+
+    def scaled(self, scale):
+        """Return a copy of the tree with all branch lengths multiplied.
+
+        >>> Tree([-1, 0, 0], [2, 0.5, 1], [None, "A", "B"]).scaled(2).newick()
+        '(A:1,B:2):4'
+
+        """
+        tree = Tree(self.parent, self.length * scale, self.name)
+        for cached in ["_children", "_size"]:
+            try:
+                setattr(tree, cached, getattr(self, cached))
+            except AttributeError:
+                pass
+        return tree
+
+    def pruned(self, names):
+        """Return the part of the tree needed to simulate the named nodes.
+
+        Keep the root, the nodes named in `names` and the nodes where the
+        paths from the root to them branch. Every other node on these paths
+        is merged into the branch below it, which gets the summed length.
+        Raise ValueError for names that are not in the tree.
+
+        >>> tree = next(parse("((A:1,B:2)C:3,(D:4,E:5)F:6)G:7;"))
+        >>> tree.pruned(["A", "D"]).newick()
+        '(A:4,D:10)G:7'
+        >>> tree.pruned(["A", "B", "F"]).newick()
+        '((A:1,B:2)C:3,F:6)G:7'
+
+        """
+        index = {name: node for node, name in enumerate(self.name)}
+        marked = numpy.zeros(len(self), dtype=bool)
+        marked[0] = True
+        requested = numpy.zeros(len(self), dtype=bool)
+        for name in names:
+            try:
+                node = index[name]
+            except KeyError:
+                raise ValueError(
+                    "Node {:} not found in the tree".format(name))
+            requested[node] = True
+            while not marked[node]:
+                marked[node] = True
+                node = self.parent[node]
+        branches = numpy.zeros(len(self), dtype=int)
+        for node in numpy.flatnonzero(marked[1:]) + 1:
+            branches[self.parent[node]] += 1
+        kept = marked & (requested | (branches > 1))
+        kept[0] = True
+
+        # Nodes stay in pre-order, so every kept node's new ancestor is
+        # already numbered when the node is reached.
+        number = {}
+        parent = []
+        length = []
+        name = []
+        top = numpy.zeros(len(self), dtype=int)
+        total = numpy.full(len(self), numpy.nan)
+        for node in numpy.flatnonzero(marked):
+            if node == 0:
+                top[node] = -1
+                total[node] = self.length[node]
+            else:
+                ancestor = self.parent[node]
+                if kept[ancestor]:
+                    top[node] = ancestor
+                    total[node] = self.length[node]
+                else:
+                    top[node] = top[ancestor]
+                    total[node] = (
+                        self.length[node] if numpy.isnan(total[ancestor])
+                        else total[ancestor] if numpy.isnan(self.length[node])
+                        else total[ancestor] + self.length[node])
+            if kept[node]:
+                number[node] = len(parent)
+                parent.append(-1 if node == 0 else number[top[node]])
+                length.append(total[node])
+                name.append(self.name[node])
+        return Tree(parent, length, name)
+
+    def newick(self, length_formatter=format_length, root=0):
+        """Serialize the tree in Newick format, without final semicolon.
+
+        If `root` is given, serialize only the subtree below that node.
+
+        >>> Tree([-1, 0, 0], [2, 0.5, 1], [None, "A", "B"]).newick()
+        '(A:0.5,B:1):2'
+
+        """
+        end = len(self) if root == 0 else root + self.size[root]
+        strings = {}
+        children = self.children
+        # Every node comes after its ancestor, so walking the nodes
+        # backwards builds all subtrees before they are needed.
+        for node in range(end - 1, root - 1, -1):
+            label = format_label(self.name[node]) if self.name[node] else ""
+            if not numpy.isnan(self.length[node]):
+                label += ":" + length_formatter(self.length[node])
+            if children[node]:
+                label = "({:}){:}".format(
+                    ",".join([strings[c] for c in children[node]]), label)
+                for c in children[node]:
+                    del strings[c]
+            strings[node] = label
+        return strings[root]
+
+    def save(self, file):
+        """Store the tree arrays in NumPy's .npz format."""
+        numpy.savez(
+            file, parent=self.parent, length=self.length,
+            name=numpy.array([n or "" for n in self.name], dtype=str),
+            named=numpy.array([n is not None for n in self.name]))
+
+    @classmethod
+    def load(cls, file):
+        """Load tree arrays stored by `save`."""
+        with numpy.load(file, allow_pickle=False) as arrays:
+            return cls(arrays["parent"], arrays["length"],
+                       [str(n) if named else None
+                        for n, named in zip(arrays["name"],
+                                            arrays["named"])])
+
+
+class Node ():
+    """A view on one node of a `Tree`.
+
+    Nodes provide the attributes of `newick.Node` objects that the
+    simulation uses, so they can be used in their place. Two views on the
+    same node of the same tree compare equal.
+
+    >>> tree = next(parse("((A:1,B:2)C:3,D)E;"))
+    >>> tree.root.descendants
+    [Node("C"), Node("D")]
+    >>> tree.root.descendants[0].descendants[1].length
+    2.0
+    >>> tree.root.descendants[0].ancestor == tree.root
+    True
+    >>> tree.root.descendants[0].newick
+    '(A:1,B:2)C:3'
+
+    """
+    __slots__ = ("tree", "index")
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def name(self):
+        return self.tree.name[self.index]
+
+    @property
+    def length(self):
+        """The branch length, 0.0 if none is given, like newick.Node."""
+        length = self.tree.length[self.index]
+        return 0.0 if numpy.isnan(length) else float(length)
+
+    @property
+    def descendants(self):
+        return [Node(self.tree, c) for c in self.tree.children[self.index]]
+
+    @property
+    def ancestor(self):
+        parent = self.tree.parent[self.index]
+        return None if parent < 0 else Node(self.tree, int(parent))
+
+    @property
+    def newick(self):
+        return self.tree.newick(root=self.index)
+
+    def __eq__(self, other):
+        return (isinstance(other, Node) and
+                self.tree is other.tree and self.index == other.index)
+
+    def __hash__(self):
+        return hash((id(self.tree), self.index))
+
+    def __repr__(self):
+        return 'Node("{:}")'.format(self.name)
+
+
+def parse(text):
+    """Parse Newick trees from a string, and generate `Tree` objects.
+
+    The parser keeps a stack of the currently open clades instead of
+    recursing, so arbitrarily deep trees can be read. Comments are
+    dropped. The end of the text ends the last tree like a ";", and text
+    without any tree is an error.
+
+    >>> [t.newick() for t in parse("((A:1,B:2)C:3,'D E');(F)")]
+    ["((A:1,B:2)C:3,'D E')", '(F)']
+
+    """
+    trees = 0
+    parent = []
+    length = []
+    name = []
+    open_clades = []
+    current = None
+    expect_node = True
+    read_length = False
+
+    def new_node():
+        parent.append(open_clades[-1] if open_clades else -1)
+        length.append(numpy.nan)
+        name.append(None)
+        return len(parent) - 1
+
+    position = 0
+    while position < len(text):
+        token = tokens.match(text, position)
+        if token is None:
+            raise ValueError(
+                "Unexpected character in Newick string at position "
+                "{:d}: {:s}".format(position, text[position:position + 20]))
+        position = token.end()
+        symbol = token.group("symbol")
+        if symbol is None:
+            value = token.group("label")
+            if value is None:
+                value = token.group("quoted")
+                if value is None:
+                    continue
+                value = value.replace("''", "'")
+            if expect_node:
+                current = new_node()
+                expect_node = False
+            if read_length:
+                length[current] = float(value)
+                read_length = False
+            else:
+                name[current] = value
+        elif symbol == "(":
+            open_clades.append(new_node())
+        elif symbol == ":":
+            if expect_node:
+                current = new_node()
+                expect_node = False
+            read_length = True
+        elif symbol == "," or symbol == ")":
+            if expect_node:
+                new_node()
+            if symbol == ")":
+                current = open_clades.pop()
+                expect_node = False
+            else:
+                expect_node = True
+        elif symbol == ";":
+            if open_clades:
+                raise ValueError("Unbalanced parentheses in Newick string")
+            if expect_node and not parent:
+                new_node()
+            yield Tree(parent, length, name)
+            trees += 1
+            parent, length, name = [], [], []
+            current = None
+            expect_node = True
+    if open_clades:
+        raise ValueError("Unbalanced parentheses in Newick string")
+    if parent:
+        yield Tree(parent, length, name)
+    elif not trees:
+        raise ValueError("No Newick tree found")
+
+
+def load(file):
+    """Read Newick trees from a file one by one, and generate `Tree`s.
+
+    The file is split at semicolons, so only one tree needs to be held in
+    memory at a time.
+
+    """
+    text = ""
+    for line in file:
+        text += line
+        if ";" in line:
+            end = text.rindex(";") + 1
+            yield from parse(text[:end])
+            text = text[end:]
+    if text.strip():
+        yield from parse(text)
+
+
+def read_tree(path, cache=True):
+    """Read the first tree from a Newick file, using a cache.
+
+    Parsed trees are cached as arrays, keyed by the SHA-256 digest of the
+    file content, so repeated simulations on the same tree file only need
+    to hash it.
+
+    """
+    with open(str(path), "rb") as file:
+        content = file.read()
+    if not cache:
+        return next(parse(content.decode("utf-8")))
+    directory = cache_directory() / "trees"
+    cached = directory / (hashlib.sha256(content).hexdigest() + ".npz")
+    try:
+        return Tree.load(str(cached))
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        pass
+    tree = next(parse(content.decode("utf-8")))
+    directory.mkdir(parents=True, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=str(directory), suffix=".npz")
+    with os.fdopen(handle, "wb") as file:
+        tree.save(file)
+    os.replace(temporary, str(cached))
+    return tree
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+"""Validate a simulation engine against the exact reference engine.
+
+Run the reference engine and a candidate engine (see `--engine`) with the
+same parameters for many seeds, compare the distributions of vocabulary
+size, synonymy, polysemy and pairwise shared vocabulary of the generated
+languages with two-sample Kolmogorov-Smirnov tests, and report them next
+to the speedup of the candidate.
+
+"""
+
+import time
+import itertools
+
+import numpy
+
+from .cli import argparser as basic_argparser, prepare, configure, engines
+from .calibration.util import shared_vocabulary
+
+
+def kolmogorov_survival(x):
+    """The survival function of the Kolmogorov distribution at `x`.
+
+    >>> round(kolmogorov_survival(1.36), 3)
+    0.049
+
+    """
+    if x < 0.2:
+        # The series converges slowly here, and the value is 1 to more
+        # than 10 digits.
+        return 1.0
+    j = numpy.arange(1, 101)
+    value = 2 * numpy.sum((-1.0) ** (j - 1) * numpy.exp(-2 * (j * x) ** 2))
+    return float(min(1.0, max(0.0, value)))
+
+
+def ks_two_sample(sample1, sample2):
+    """Compare two samples with the two-sample Kolmogorov-Smirnov test.
+
+    Return the statistic D, the largest difference between the empirical
+    distribution functions of the samples, and its asymptotic p-value
+    (with the small-sample correction from Numerical Recipes).
+
+    >>> ks_two_sample([1, 2, 3], [3, 2, 1])
+    (0.0, 1.0)
+    >>> d, p = ks_two_sample(range(20), range(20, 40))
+    >>> d, p < 1e-6
+    (1.0, True)
+
+    """
+    sample1 = numpy.sort(numpy.asarray(sample1, dtype=float))
+    sample2 = numpy.sort(numpy.asarray(sample2, dtype=float))
+    values = numpy.concatenate([sample1, sample2])
+    cdf1 = numpy.searchsorted(sample1, values, side="right") / len(sample1)
+    cdf2 = numpy.searchsorted(sample2, values, side="right") / len(sample2)
+    statistic = float(numpy.max(numpy.abs(cdf1 - cdf2)))
+    n = numpy.sqrt(len(sample1) * len(sample2) /
+                   (len(sample1) + len(sample2)))
+    return statistic, kolmogorov_survival((n + 0.12 + 0.11 / n) * statistic)
+
+
+def effective_number(weights):
+    """The number of equally weighted items with the same concentration.
+
+    This is the weighted count that `analysis.semantic_width` averages.
+
+    >>> effective_number([1, 1]), effective_number([3, 1])
+    (2.0, 1.6)
+
+    """
+    weights = numpy.asarray(weights, dtype=float)
+    return float(weights.sum() ** 2 / (weights ** 2).sum())
+
+
+def vocabulary_size(language):
+    """The number of different words with positive weight in a language."""
+    return len({word
+                for words in language.values()
+                for word, weight in words.items()
+                if weight > 0})
+
+
+def synonymy(language):
+    """The average weighted number of words per concept.
+
+    Like `analysis.synonymity`, but for a language instead of a data frame.
+
+    """
+    return numpy.mean([
+        effective_number([w for w in words.values() if w > 0])
+        for words in language.values()
+        if any(w > 0 for w in words.values())])
+
+
+def polysemy(language):
+    """The average weighted number of concepts per word.
+
+    Like `analysis.semantic_width`, but for a language instead of a data
+    frame.
+
+    """
+    concepts = {}
+    for words in language.values():
+        for word, weight in words.items():
+            if weight > 0:
+                concepts.setdefault(word, []).append(weight)
+    return numpy.mean([effective_number(w) for w in concepts.values()])
+
+
+statistics = {
+    "vocabulary size": vocabulary_size,
+    "synonymy": synonymy,
+    "polysemy": polysemy}
+
+
+def run(simulator, phylogeny, language, seed=0):
+    """Run one simulation and describe the generated languages.
+
+    Return a dictionary mapping each statistic (and "shared vocabulary",
+    for every pair of generated languages) to a list of values, and the
+    time the simulation took in seconds.
+
+    """
+    start = time.perf_counter()
+    languages = dict(simulator(phylogeny, language, seed=seed))
+    duration = time.perf_counter() - start
+    values = {
+        name: [statistic(language) for language in languages.values()]
+        for name, statistic in statistics.items()}
+    values["shared vocabulary"] = [
+        shared_vocabulary(languages[l1], languages[l2], threshold=None)
+        for l1, l2 in itertools.combinations(sorted(languages), 2)]
+    return values, duration
+
+
+def compare(reference, candidate):
+    """Compare the statistics of two sets of runs.
+
+    `reference` and `candidate` are lists of results of `run`. Generate,
+    for each statistic, its name, the mean values of reference and
+    candidate, and the KS statistic and p-value of the comparison.
+
+    """
+    for name in reference[0][0]:
+        sample1 = [v for values, _ in reference for v in values[name]]
+        sample2 = [v for values, _ in candidate for v in values[name]]
+        yield ((name, numpy.mean(sample1), numpy.mean(sample2)) +
+               ks_two_sample(sample1, sample2))
+
+
+def argparser():
+    """Parse command line arguments."""
+    parser = basic_argparser()
+    validation = parser.add_argument_group("Validation")
+    validation.add_argument(
+        "--reference", choices=sorted(engines), default="exact",
+        help="The engine to compare against. (default: exact)")
+    validation.add_argument(
+        "--runs", type=int, default=20,
+        help="Number of simulations per engine, with the seeds following"
+        " --seed. (default: 20)")
+    parser._option_string_actions["--engine"].default = "leaping"
+    return parser
+
+
+def main():
+    """Run the CLI."""
+    parser = argparser()
+    args = parser.parse_args()
+    # Burn the root language in with the reference engine, so the
+    # reference runs use nothing but the reference engine.
+    candidate, args.engine = args.engine, args.reference
+    args = prepare(parser, args)
+    args.engine = candidate
+    root_language = args.root_language_data
+    results = {}
+    for engine in [args.reference, args.engine]:
+        results[engine] = [
+            run(args.simulator, args.phylogeny,
+                configure(root_language.copy(), args, engine),
+                seed=args.seed + seed)
+            for seed in range(args.runs)]
+    reference = results[args.reference]
+    candidate = results[args.engine]
+
+    print("{:20s} {:>12s} {:>12s} {:>8s} {:>8s}".format(
+        "Statistic", args.reference, args.engine, "KS D", "p"))
+    for name, mean1, mean2, d, p in compare(reference, candidate):
+        print("{:20s} {:12.4g} {:12.4g} {:8.3f} {:8.3f}".format(
+            name, mean1, mean2, d, p))
+    time1 = sum(duration for _, duration in reference) / args.runs
+    time2 = sum(duration for _, duration in candidate) / args.runs
+    print("Mean time per run: {:.3g} s ({:}), {:.3g} s ({:}), "
+          "speedup {:.2f}".format(
+              time1, args.reference, time2, args.engine, time1 / time2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import collections
+
+import numpy
+import pytest
+
+from simuling.simulation import SemanticNetwork, constant_zero
+
+
+@pytest.fixture(autouse=True)
+def cache_directory(tmpdir, monkeypatch):
+    """Keep the caches of every test out of the user's cache directory."""
+    monkeypatch.setenv("SIMULING_CACHE", str(tmpdir.join("cache")))
+
+
+@pytest.fixture
+def minimal_gml():
+    """A GML network of two linked concepts and an isolated one."""
+    return """graph [
+  node [
+    id 0
+    label "left"
+    gloss "LEFT"
+  ]
+  node [
+    id 1
+    label "right"
+  ]
+  node [
+    id 2
+    label "off"
+  ]
+  edge [
+    source 0
+    target 1
+    w 2
+    families 3
+  ]
+]"""
+
+
+@pytest.fixture
+def ring_language():
+    """Build languages with one word per concept on a ring network."""
+    def ring_language(cls, size=40, weight=50):
+        network = SemanticNetwork(
+            {str(i): [str((i + 1) % size)] for i in range(size)})
+        network.neighbor_factor = 0.1
+        return cls(
+            {str(i): collections.defaultdict(constant_zero, {i: weight})
+             for i in range(size)}, network)
+    return ring_language
+
+
+@pytest.fixture
+def synonymity():
+    """Measure the average number of words per concept of a language."""
+    def synonymity(language):
+        return numpy.mean(
+            [len(words) for words in language.values() if words])
+    return synonymity
@@ -0,0 +1,22 @@
+import newick
+import pytest
+
+from comparetrees.bipartitions import (TreeCollection, compare_pairs,
+                                       compare_one_to_many, finish)
+
+
+@pytest.mark.parametrize("rooted", [False, True])
+def test_root_edge_counts(rooted):
+    """Does the root edge count like a branch, as in dendropy?"""
+    trees1 = TreeCollection(
+        [newick.loads("((A:1,B:1):1,C:1,D:1):5;")[0]], rooted=rooted)
+    trees2 = TreeCollection(
+        [newick.loads("((A:1,B:1):1,C:1,D:1):2;")[0]],
+        trees1.taxa, trees1.bipartitions, rooted=rooted)
+    for measures in [
+            compare_pairs(trees1, trees2),
+            compare_one_to_many(*trees1.reference(0), trees2)]:
+        assert finish("rf", measures, trees1.sizes, trees2.sizes) == [0]
+        assert finish("wrf", measures, trees1.sizes, trees2.sizes) == [3]
+        assert finish("euclidean", measures,
+                      trees1.sizes, trees2.sizes) == [3]
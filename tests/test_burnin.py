@@ -0,0 +1,75 @@
+import collections
+from pathlib import Path
+
+import numpy
+
+from simuling.simulation import SemanticNetwork, Language, constant_zero
+from simuling.burnin import burned_in, evict
+
+
+def initial_language(gml):
+    network = SemanticNetwork.load_from_gml(gml, "w")
+    return Language(
+        {"left": collections.defaultdict(constant_zero, {0: 10}),
+         "right": collections.defaultdict(constant_zero, {1: 10}),
+         "off": collections.defaultdict(constant_zero, {2: 10})},
+        network)
+
+
+def test_burn_in_cached(minimal_gml, tmpdir, monkeypatch):
+    """Does a cached burn-in give the same language as a simulated one?"""
+    monkeypatch.setenv("SIMULING_CACHE", str(tmpdir))
+    language = initial_language(minimal_gml)
+    first = burned_in(language, 50, seed=3)
+    assert str(language) == str(initial_language(minimal_gml))
+    assert len(tmpdir.join("burn-in").listdir()) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("The burn-in was simulated again")
+    monkeypatch.setattr(Language, "advance", fail)
+    second = burned_in(language, 50, seed=3)
+    assert str(second) == str(first)
+    assert list(second.items()) == list(first.items())
+
+    monkeypatch.undo()
+    monkeypatch.setenv("SIMULING_CACHE", str(tmpdir))
+    burned_in(language, 50, seed=4)
+    assert len(tmpdir.join("burn-in").listdir()) == 2
+
+
+def ring_gml(size):
+    """A GML ring network of `size` concepts."""
+    return "graph [\n" + "".join(
+        '  node [ id {0:d} label "c{0:d}" ]\n'.format(i)
+        for i in range(size)) + "".join(
+        '  edge [ source {:d} target {:d} w 1 ]\n'.format(i, (i + 1) % size)
+        for i in range(size)) + "]"
+
+
+def test_burn_in_cached_empty_concepts(tmpdir, monkeypatch):
+    """Does a cached burn-in keep concepts without words, in order?"""
+    monkeypatch.setenv("SIMULING_CACHE", str(tmpdir))
+    network = SemanticNetwork.load_from_gml(ring_gml(300), "w")
+    network.neighbor_factor = 0.1
+    language = Language(
+        {"c{:d}".format(i): collections.defaultdict(constant_zero, {i: 1})
+         for i in range(300)},
+        network)
+    fresh = burned_in(language, 3000, seed=1)
+    cached = burned_in(language, 3000, seed=1)
+    assert any(not words for words in fresh.values())
+    assert list(cached) == list(fresh)
+    assert cached == fresh
+    fresh.advance(2000, numpy.random.RandomState(5))
+    cached.advance(2000, numpy.random.RandomState(5))
+    assert str(cached) == str(fresh)
+
+
+def test_evict_least_recently_used(tmpdir):
+    """Are the least recently used states removed first?"""
+    for age, name in enumerate(["c", "a", "b"]):
+        path = tmpdir.join(name + ".npz")
+        path.write("x" * 100)
+        path.setmtime(1000000 + age)
+    evict(Path(str(tmpdir)), 250)
+    assert sorted(p.basename for p in tmpdir.listdir()) == ["a.npz", "b.npz"]
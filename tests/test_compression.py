@@ -0,0 +1,44 @@
+import gzip
+
+import pytest
+
+from simuling.compression import open_input, open_output
+from simuling.cli import argparser
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".csv.gz", ".csv.zst"])
+def test_compressed_roundtrip(tmpdir, suffix):
+    """Is compressed output written completely and read back transparently?"""
+    if suffix.endswith(".zst"):
+        pytest.importorskip("zstandard")
+    path = str(tmpdir.join("output" + suffix))
+    lines = ["A,c{:d},{:d},{:d}\n".format(i % 7, i, i * i)
+             for i in range(50000)]
+    output = open_output(path)
+    for line in lines:
+        output.write(line)
+    output.close()
+    if suffix.endswith(".gz"):
+        with gzip.open(path, "rt") as file:
+            assert file.read() == "".join(lines)
+    with open_input(path) as file:
+        assert list(file) == lines
+    with open_input(path, "rb") as file:
+        assert file.read(10) == "".join(lines).encode("utf-8")[:10]
+
+
+def test_parsing_opens_no_files(tmpdir, monkeypatch):
+    """Are output files only created when the simulation runs?"""
+    monkeypatch.setattr("tempfile.tempdir", str(tmpdir))
+    args = argparser().parse_args([])
+    assert args.output is None
+    args = argparser().parse_args(["--output", str(tmpdir.join("o.csv"))])
+    assert args.output == str(tmpdir.join("o.csv"))
+    assert tmpdir.listdir() == []
+
+
+def test_missing_input_is_usage_error(tmpdir, capsys):
+    """Is a missing input file reported as usage error?"""
+    with pytest.raises(SystemExit):
+        argparser().parse_args(["--wordlist", str(tmpdir.join("missing"))])
+    assert "can't open" in capsys.readouterr().err
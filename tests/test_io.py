@@ -0,0 +1,61 @@
+import csv
+import collections
+
+import newick
+
+from simuling.simulation import SemanticNetwork, Language, simulate
+from simuling.io import DeltaWriter, DeltaReader, WeightFilter
+
+
+def test_delta_roundtrip(minimal_gml, tmpdir):
+    """Does the delta reader reconstruct every language written?"""
+    s = SemanticNetwork.load_from_gml(minimal_gml.split("\n"), "w")
+    lg = Language({"left": collections.defaultdict(lambda: 0, {0: 10}),
+                   "right": collections.defaultdict(lambda: 0, {1: 10})},
+                  s)
+    tree = newick.loads("(((A:2,B:0)C:3,D:4)E:1,F:6)G:2;")[0]
+    path = tmpdir.join("delta.csv")
+    with open(str(path), "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Language_ID", "Parameter_ID", "Cognateset_ID",
+                         "Weight", "Parent_ID"])
+        delta = DeltaWriter(writer, tree, keyframe_interval=2)
+        languages = {name: {c: dict(ws) for c, ws in language.items()
+                            if any(ws.values())}
+                     for name, language in simulate(
+                             tree, lg, seed=1, writer=delta)}
+        delta.close()
+
+    reader = DeltaReader(path)
+    assert reader.names() == ["G", "E", "C", "A", "B", "D", "F"]
+    assert [reader.index[name][0] for name in reader.names()] == [
+        None, "G", None, "C", "C", None, "G"]
+    for name, language in languages.items():
+        assert {c: dict(ws)
+                for c, ws in reader.language(name).items()} == language
+    # B has branch length 0, so it only has a marker row.
+    assert list(reader.rows("B")) == []
+
+
+def test_weight_filter():
+    """Are the filters applied per concept, keeping the order of rows?"""
+    rows = []
+
+    class ListWriter:
+        def writerow(self, row):
+            rows.append(row)
+    language = [["L", "a", 1, 10], ["L", "a", 2, 3], ["L", "a", 3, 8],
+                ["L", "a", 4, 8], ["L", "b", 5, 2], ["M", "b", 6, 1]]
+
+    writer = WeightFilter(ListWriter(), top_k=2)
+    for row in language:
+        writer.writerow(row)
+    writer.close()
+    assert [row[2] for row in rows] == [1, 3, 5, 6]
+
+    del rows[:]
+    writer = WeightFilter(ListWriter(), min_weight=2, relative=0.5)
+    for row in language:
+        writer.writerow(row)
+    writer.close()
+    assert [row[2] for row in rows] == [1, 3, 4, 5]
@@ -0,0 +1,72 @@
+import collections
+
+import numpy
+import pytest
+
+from simuling.simulation import SemanticNetwork, Language, constant_zero
+from simuling.kernel import KernelLanguage
+
+
+class UncompiledKernelLanguage (KernelLanguage):
+    """Run the kernel even if Numba is not installed."""
+    use_kernel = True
+
+
+def test_kernel_reproducible(ring_language):
+    """Do equal streams give equal kernel simulations?"""
+    l1 = ring_language(UncompiledKernelLanguage)
+    l2 = ring_language(UncompiledKernelLanguage)
+    l1.advance(500, numpy.random.RandomState(1))
+    l2.advance(500, numpy.random.RandomState(1))
+    assert str(l1) == str(l2)
+    assert all(weight > 0 and type(weight) is int
+               for words in l1.values() for weight in words.values())
+
+
+def test_kernel_close_to_exact(ring_language, synonymity):
+    """Does the kernel give similar languages as exact steps?"""
+    exact = []
+    kernel = []
+    for seed in range(10):
+        language = ring_language(Language)
+        language.advance(2000, numpy.random.RandomState(seed))
+        exact.append(synonymity(language))
+        language = ring_language(UncompiledKernelLanguage)
+        language.advance(2000, numpy.random.RandomState(seed))
+        kernel.append(synonymity(language))
+        total = sum(sum(words.values()) for words in language.values())
+        assert total == 2000
+    assert abs(numpy.mean(kernel) / numpy.mean(exact) - 1) < 0.1
+
+
+def test_kernel_zero_weight_edges():
+    """Are concepts reached only through zero-weight edges handled?"""
+    network = SemanticNetwork({"a": ["b"], "b": ["a"]})
+    network.neighbor_factor = 0
+    language = UncompiledKernelLanguage(
+        {"a": collections.defaultdict(constant_zero, {0: 5}),
+         "b": collections.defaultdict(constant_zero, {1: 5})},
+        network)
+    language.advance(200, numpy.random.RandomState(2))
+    assert sum(sum(words.values()) for words in language.values()) == 10
+
+
+def test_compiled_kernel(ring_language, synonymity):
+    """Does the kernel compiled with Numba give similar languages?"""
+    pytest.importorskip("numba")
+    assert KernelLanguage.use_kernel
+    l1 = ring_language(KernelLanguage)
+    l2 = ring_language(KernelLanguage)
+    l1.advance(500, numpy.random.RandomState(1))
+    l2.advance(500, numpy.random.RandomState(1))
+    assert str(l1) == str(l2)
+    exact = []
+    kernel = []
+    for seed in range(10):
+        language = ring_language(Language)
+        language.advance(2000, numpy.random.RandomState(seed))
+        exact.append(synonymity(language))
+        language = ring_language(KernelLanguage)
+        language.advance(2000, numpy.random.RandomState(seed))
+        kernel.append(synonymity(language))
+    assert abs(numpy.mean(kernel) / numpy.mean(exact) - 1) < 0.1
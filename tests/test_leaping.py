@@ -0,0 +1,43 @@
+import numpy
+
+from simuling.simulation import Language
+from simuling.leaping import LeapingLanguage
+
+
+def test_leaping_reproducible(ring_language):
+    """Do equal streams give equal leaping simulations?"""
+    l1 = ring_language(LeapingLanguage)
+    l2 = ring_language(LeapingLanguage)
+    l1.tolerance = l2.tolerance = 0.05
+    assert l1.leap_size() == 50
+    l1.advance(500, numpy.random.RandomState(1))
+    l2.advance(500, numpy.random.RandomState(1))
+    assert str(l1) == str(l2)
+    assert type(l1.copy()) is LeapingLanguage
+    assert l1.copy().tolerance == 0.05
+
+
+def test_leaping_close_to_exact(ring_language, synonymity):
+    """Does the leaping engine give similar languages as exact steps?"""
+    exact = []
+    leaping = []
+    for seed in range(10):
+        language = ring_language(Language)
+        language.advance(2000, numpy.random.RandomState(seed))
+        exact.append(synonymity(language))
+        language = ring_language(LeapingLanguage)
+        language.tolerance = 0.05
+        language.advance(2000, numpy.random.RandomState(seed))
+        leaping.append(synonymity(language))
+        total = sum(sum(words.values()) for words in language.values())
+        assert 2000 <= total < 2000 * 1.01
+    assert abs(numpy.mean(leaping) / numpy.mean(exact) - 1) < 0.1
+
+
+def test_leap_empty_language(ring_language):
+    """Does a leap from a language without weights run exact steps?"""
+    language = ring_language(LeapingLanguage, weight=0)
+    exact = ring_language(Language, weight=0)
+    language.leap(20, numpy.random.RandomState(1))
+    exact.advance(20, numpy.random.RandomState(1))
+    assert str(language) == str(exact)
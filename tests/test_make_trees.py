@@ -0,0 +1,129 @@
+import os
+import sys
+import subprocess
+from pathlib import Path
+
+import numpy
+import newick
+import pytest
+
+from maketrees.make_trees import (
+    create_balanced_random_tree, random_merges, balanced_merges, preorder,
+    create_trees, generate_batch)
+
+
+def check_preorder(parent, n_taxa):
+    """Assert that `parent` describes a binary tree in pre-order."""
+    n = len(parent)
+    assert n == 2 * n_taxa - 1
+    assert parent[0] == -1
+    assert all(0 <= parent[i] < i for i in range(1, n))
+    children = [[] for _ in range(n)]
+    for i in range(1, n):
+        children[parent[i]].append(i)
+    size = numpy.ones(n, dtype=int)
+    for i in range(n - 1, 0, -1):
+        size[parent[i]] += size[i]
+    for i in range(n):
+        assert len(children[i]) in (0, 2)
+        # The subtrees of the children follow each other directly.
+        start = i + 1
+        for child in children[i]:
+            assert child == start
+            start += size[child]
+        assert start == i + size[i]
+    assert sum(not c for c in children) == n_taxa
+
+
+@pytest.mark.parametrize("n_taxa", [2, 3, 8, 17])
+def test_merges_give_preorder_trees(n_taxa):
+    """Do the merges of both generators give valid pre-order trees?"""
+    rng = numpy.random.Generator(numpy.random.PCG64(n_taxa))
+    lengths = rng.uniform(1, 2, size=(20, 2 * n_taxa - 1))
+    for merges in [random_merges(rng, n_taxa, 20),
+                   balanced_merges(rng, n_taxa, lengths)]:
+        assert merges.shape == (20, n_taxa - 1, 2)
+        position, parent = preorder(merges)
+        for row in range(20):
+            assert sorted(position[row]) == list(range(2 * n_taxa - 1))
+            check_preorder(parent[row], n_taxa)
+            assert sorted(position[row, :n_taxa]) == sorted(
+                i for i in range(2 * n_taxa - 1)
+                if i not in parent[row])
+
+
+def structure(node):
+    """Describe a newick.Node by leaf names, lengths and child order."""
+    return (node.name or None, round(float(node.length), 6),
+            [structure(child) for child in node.descendants])
+
+
+def old_parents(tree):
+    """The pre-order parent array of a newick.Node."""
+    nodes = list(tree.walk())
+    index = {id(node): i for i, node in enumerate(nodes)}
+    return [-1] + [index[id(node.ancestor)] for node in nodes[1:]]
+
+
+@pytest.mark.parametrize("ties", [False, True])
+def test_balanced_like_per_tree_version(ties):
+    """Do balanced merges join clades like `create_balanced_random_tree`?"""
+    taxa = list("ABCDEFGHIJ")
+    rng = numpy.random.Generator(numpy.random.PCG64(1))
+    if ties:
+        lengths = rng.integers(1, 4, size=(30, 19)).astype(float)
+    else:
+        lengths = rng.uniform(900, 1100, size=(30, 19))
+    _, parent = preorder(balanced_merges(rng, len(taxa), lengths))
+    for row, merged in zip(lengths, parent):
+        old = create_balanced_random_tree(taxa, iter(row).__next__)
+        assert list(merged) == old_parents(old)
+
+
+def test_balanced_trees_like_per_tree_version():
+    """Are balanced trees, with names and lengths, the per-tree ones?"""
+    taxa = list("ABCDEFGHIJ")
+    lengths = numpy.random.Generator(numpy.random.PCG64(1)).uniform(
+        900, 1100, size=(30, 19))
+    trees = create_trees(taxa, numpy.random.Generator(
+        numpy.random.PCG64(1)), 30, 900, 1100, balanced=True)
+    for row, tree in zip(lengths, trees):
+        old = create_balanced_random_tree(taxa, iter(row).__next__)
+        new = newick.loads(tree.newick() + ";")[0]
+        assert structure(new) == structure(old)
+
+
+def test_batches_reproducible():
+    """Does a seed give the same batch of trees every time?"""
+    taxa = list("ABCDE")
+    seed1, seed2 = numpy.random.SeedSequence(5).spawn(2)
+    first = generate_batch(seed1, 10, taxa, 900, 1100)
+    assert generate_batch(numpy.random.SeedSequence(5).spawn(2)[0],
+                          10, taxa, 900, 1100) == first
+    assert generate_batch(seed2, 10, taxa, 900, 1100) != first
+    assert len(set(first)) == 10
+    assert all(tree.endswith(";\n") for tree in first)
+
+
+def make_trees(*arguments):
+    """Run the tree generator command line, and return its output."""
+    root = Path(__file__).absolute().parent.parent
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(
+        [str(root)] + environment.get("PYTHONPATH", "").split(os.pathsep))
+    return subprocess.run(
+        [sys.executable, str(root / "maketrees" / "make_trees.py")] +
+        list(arguments),
+        stdout=subprocess.PIPE, universal_newlines=True,
+        env=environment, check=True).stdout
+
+
+def test_seed_reproducible():
+    """Does --seed give the same trees, independent of --processes?"""
+    arguments = ["-t", "7", "--batch-size", "3", "--seed", "12", "-l",
+                 "A", "B", "C", "D"]
+    output = make_trees(*arguments)
+    assert len(output.splitlines()) == 7
+    assert make_trees(*arguments) == output
+    assert make_trees("--processes", "2", *arguments) == output
+    assert make_trees("--balanced", *arguments) != output
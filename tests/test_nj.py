@@ -0,0 +1,43 @@
+import io
+
+import numpy
+import pandas
+
+from reconstructtrees.nj import (presence_matrix, hamming_distances,
+                                 nj_wordlist, nj, upgma)
+
+
+def equidistant_wordlist(languages):
+    """A word list in which all languages have the same distances."""
+    return "Language_ID\tValue\n" + "".join(
+        "{:}\t{:}\n".format(language, language) for language in languages)
+
+
+def test_numeric_language_order():
+    """Are numeric language IDs sorted as numbers, not as strings?"""
+    wordlist = pandas.read_csv(
+        io.StringIO(equidistant_wordlist([10, 2, 1, 11])), sep="\t")
+    languages, matrix = presence_matrix(wordlist)
+    assert list(languages) == [1, 2, 10, 11]
+    assert matrix.dtype == bool
+    assert matrix.tolist() == [
+        [0, 0, 1, 0], [0, 1, 0, 0], [1, 0, 0, 0], [0, 0, 0, 1]]
+
+
+def test_numeric_language_ties():
+    """Are ties between numeric language IDs broken in numeric order?"""
+    text = equidistant_wordlist(range(11, 0, -1))
+    assert nj_wordlist(io.StringIO(text), method=nj).startswith(
+        "(((((((((1:1,2:1)Inner1:0,3:1)Inner2:0,4:1)")
+    assert nj_wordlist(io.StringIO(text), method=upgma) == (
+        "((((((((((11:1,10:1)Inner1:0,9:1)Inner2:0,8:1)Inner3:0,7:1)"
+        "Inner4:0,6:1)Inner5:0,5:1)Inner6:0,4:1)Inner7:0,3:1)Inner8:0,"
+        "2:1)Inner9:0,1:1)Inner10:0;")
+
+
+def test_hamming_distances_blocks():
+    """Do blockwise matrix products give the sizes of the differences?"""
+    matrix = numpy.random.RandomState(0).rand(12, 500) < 0.3
+    expected = (matrix[:, None, :] != matrix[None, :, :]).sum(axis=2)
+    assert (hamming_distances(matrix, block_size=50) == expected).all()
+    assert (hamming_distances(matrix) == expected).all()
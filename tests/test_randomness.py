@@ -0,0 +1,63 @@
+import numpy
+import newick
+
+from simuling.randomness import (ROOT, BlockRandom, child_key, node_random,
+                                 with_stream_keys)
+from simuling.simulation import walk_depth_order
+
+
+def test_anonymous_nodes_differ():
+    """Do anonymous sibling nodes get different random streams?"""
+    tree = newick.loads("(:1,:1):1;")[0]
+    left, right = tree.descendants
+    r1 = node_random(left, child_key(ROOT, 0), 0)
+    r2 = node_random(right, child_key(ROOT, 1), 0)
+    assert [r1.rand() for i in range(5)] != [r2.rand() for i in range(5)]
+
+
+def test_streams_reproducible():
+    """Does the same node and seed give the same numbers?"""
+    key = child_key(child_key(ROOT, 1), 0)
+    for rng in ["pcg64", "philox", "legacy"]:
+        r1 = node_random(None if rng != "legacy" else newick.Node("A"),
+                         key, 3, rng)
+        r2 = node_random(None if rng != "legacy" else newick.Node("A"),
+                         key, 3, rng)
+        assert ([r1.rand() for i in range(2000)] ==
+                [r2.rand() for i in range(2000)])
+        assert ([r1.randint(2 ** 40) for i in range(2000)] ==
+                [r2.randint(2 ** 40) for i in range(2000)])
+
+
+def test_stream_keys_follow_tree_paths():
+    """Are stream keys derived from the path of each node?"""
+    tree = newick.loads("((A:1,B:2)C:1,D:1)E;")[0]
+    keys = {node.name: key
+            for node, height, key in with_stream_keys(
+                walk_depth_order(tree))}
+    assert keys["E"] == ROOT
+    assert keys["C"] == child_key(ROOT, 0)
+    assert keys["B"] == child_key(child_key(ROOT, 0), 1)
+    assert keys["D"] == child_key(ROOT, 1)
+    tree = newick.loads("(A:1,B:1,(C:1,D:1)E:1,F:1)G;")[0]
+    keys = {node.name: key
+            for node, height, key in with_stream_keys(
+                walk_depth_order(tree))}
+    assert keys["F"] == child_key(ROOT, 3)
+    assert keys["D"] == child_key(child_key(ROOT, 2), 1)
+
+
+def test_block_random_consumption_order():
+    """Do the numbers depend neither on block size nor on interleaving?"""
+    small = BlockRandom(numpy.random.SeedSequence(5), block_size=3)
+    large = BlockRandom(numpy.random.SeedSequence(5))
+    uniforms = [large.rand() for i in range(10)]
+    integers = [large.randint(10) for i in range(10)]
+    interleaved = [(small.rand(), small.randint(10)) for i in range(10)]
+    assert interleaved == list(zip(uniforms, integers))
+    assert all(0 <= u < 1 for u in uniforms)
+    assert all(0 <= i < 10 for i in integers)
+    again = BlockRandom(numpy.random.SeedSequence(5), block_size=4)
+    assert again.rand() == uniforms[0]
+    assert again.rand(2, 3).tolist() == [uniforms[1:4], uniforms[4:7]]
+    assert again.rand() == uniforms[7]
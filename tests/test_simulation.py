@@ -1,8 +1,11 @@
+import pickle
 import collections
 
 import newick
 
-from simuling.simulation import SemanticNetwork, Language
+from simuling.simulation import (
+    SemanticNetwork, SemanticNetworkWithConceptWeight, Language, simulate,
+    concept_weights, Multiprocess)
 
 
 # Tests
@@ -14,19 +17,19 @@ def test_dumb_semantic_loader():
         "FamilyWeight")
 
 
-def test_semantic_weight():
+def test_semantic_weight(minimal_gml):
     """Does a semantic network have expected edge weights?"""
     s = SemanticNetwork.load_from_gml(minimal_gml.split("\n"), "w")
     assert s.edge_weight("left", "right") == 2 * 0.004
 
 
-def test_semantic_concept_weight():
+def test_semantic_concept_weight(minimal_gml):
     """Does a semantic network have the expected concept weights?"""
     s = SemanticNetwork.load_from_gml(minimal_gml.split("\n"), "w")
     assert s.concept_weight("left") == 1 ** 2
 
 
-def test_semantic_random():
+def test_semantic_random(minimal_gml):
     """Does the network produce the expected distribution of meanings?"""
     s = SemanticNetwork.load_from_gml(minimal_gml.split("\n"), "w")
     c = collections.Counter()
@@ -37,7 +40,53 @@ def test_semantic_random():
     assert c["left"] + c["right"] == 200
 
 
-def test_language_wn():
+def test_semantic_network_cache(minimal_gml, tmpdir, monkeypatch):
+    """Does the cached network equal the parsed one, in the same order?"""
+    monkeypatch.setenv("SIMULING_CACHE", str(tmpdir))
+    parsed = SemanticNetwork.load_from_gml(minimal_gml.split("\n"), "w")
+    cached = SemanticNetwork.load_from_gml(minimal_gml.split("\n"), "w")
+    assert len(tmpdir.join("networks").listdir()) == 1
+    assert list(cached) == list(parsed)
+    for concept in parsed:
+        assert list(cached[concept]) == list(parsed[concept])
+    assert cached.edge_weight("left", "right") == 2 * 0.004
+    assert list(cached.nodes(data=True)) == list(parsed.nodes(data=True))
+    assert list(cached.edges(data=True)) == list(parsed.edges(data=True))
+
+
+def test_semantic_network_pickle(minimal_gml, tmpdir, monkeypatch):
+    """Are cached networks pickled by reference?"""
+    monkeypatch.setenv("SIMULING_CACHE", str(tmpdir))
+    s = SemanticNetworkWithConceptWeight.load_from_gml(
+        minimal_gml.split("\n"), "w")
+    s._concept_weight = concept_weights["exponential"]
+    s.neighbor_factor = 0.1
+    data = pickle.dumps(Language({"left": {0: 1}}, s))
+    assert len(data) < 500
+    assert pickle.loads(data).semantics is s
+
+
+def test_language_pickle(minimal_gml):
+    """Does a language survive pickling with words, weights and types?"""
+    s = SemanticNetwork.load_from_gml(minimal_gml.split("\n"), "w")
+    lg = Language({"left": collections.defaultdict(
+        lambda: 0, {0: 10, 2 ** 40: 2.5}),
+                   "right": collections.defaultdict(lambda: 0),
+                   "elsewhere": collections.defaultdict(
+                       lambda: 0, {"x": 1})},
+                  s)
+    lg.extra = "kept"
+    copy = pickle.loads(pickle.dumps(lg))
+    assert type(copy) is Language
+    assert copy == lg
+    assert list(copy) == list(lg)
+    assert [type(wt) for wt in copy["left"].values()] == [int, float]
+    assert copy["right"]["new"] == 0
+    assert copy.extra == "kept"
+    assert copy.semantics is s
+
+
+def test_language_wn(minimal_gml):
     """Does the language have the expected weights for related concepts?"""
     s = SemanticNetwork.load_from_gml(minimal_gml.split("\n"), "w")
     lg = Language({"top": collections.defaultdict(lambda: 0, {0: 10})},
@@ -45,7 +94,7 @@ def test_language_wn():
     assert lg.weighted_neighbors("left") == {'right': 0.008, 'left': 1}
 
 
-def test_language_cs():
+def test_language_cs(minimal_gml):
     """Does the language calculate the scores correctly?"""
     s = SemanticNetwork.load_from_gml(minimal_gml.split("\n"), "w")
     lg = Language({"left": collections.defaultdict(lambda: 0, {0: 10})},
@@ -54,7 +103,33 @@ def test_language_cs():
     assert lg.calculate_scores("right") == {0: 0.08}
 
 
-def test_language_re():
+def test_language_score_cache(minimal_gml):
+    """Are cached scores updated when weights change?"""
+    s = SemanticNetwork.load_from_gml(minimal_gml.split("\n"), "w")
+    lg = Language({"left": collections.defaultdict(lambda: 0, {0: 10})},
+                  s)
+    lg.scoring = "verify"
+    scores = lg.calculate_scores("right")
+    scores[5] = 1
+    lg.change_weight("right", 1, 2)
+    lg.change_weight("left", 0, -10)
+    assert lg.calculate_scores("right") == {1: 2}
+    assert lg.calculate_scores("left") == {1: 0.016}
+    assert 0 not in lg["left"]
+
+
+def test_language_steps_verified(minimal_gml):
+    """Do cached scores match full recomputation during a simulation?"""
+    s = SemanticNetwork.load_from_gml(minimal_gml.split("\n"), "w")
+    lg = Language({"left": collections.defaultdict(lambda: 0, {0: 10}),
+                   "right": collections.defaultdict(lambda: 0, {1: 5})},
+                  s)
+    lg.scoring = "verify"
+    for i in range(200):
+        lg.step()
+
+
+def test_language_re(minimal_gml):
     """Does the language provide the right weighted distribution of edges?"""
     s = SemanticNetwork.load_from_gml(minimal_gml.split("\n"), "w")
     lg = Language({"top": collections.defaultdict(lambda: 0, {0: 10}),
@@ -68,24 +143,59 @@ def test_language_re():
     assert c[("left", 0)] + c[("top", 0)] == 200
 
 
-minimal_tree = newick.loads("(A:2,B:2):1;")[0]
+def test_simulate_writer(minimal_gml):
+    """Does the simulation write every named node's own language?"""
+    s = SemanticNetwork.load_from_gml(minimal_gml.split("\n"), "w")
+    lg = Language({"left": collections.defaultdict(lambda: 0, {0: 10})},
+                  s)
+    rows = []
+
+    class ListWriter:
+        def writerow(self, row):
+            rows.append(row)
+    languages = dict(simulate(minimal_tree, lg, writer=ListWriter()))
+    assert sorted(languages) == ["A", "B"]
+    for name, language in languages.items():
+        assert sorted(row[1:] for row in rows if row[0] == name) == sorted(
+            [c, w, wt] for c, ws in language.items()
+            for w, wt in ws.items() if wt)
 
-minimal_gml = """graph [
-  node [
-    id 0
-    label "left"
-  ]
-  node [
-    id 1
-    label "right"
-  ]
-  node [
-    id 2
-    label "off"
-  ]
-  edge [
-    source 0
-    target 1
-    w 2
-  ]
-]"""
+
+def test_simulate_deep_tree(minimal_gml):
+    """Can the simulation run down a tree deeper than the recursion limit?"""
+    s = SemanticNetwork.load_from_gml(minimal_gml.split("\n"), "w")
+    lg = Language({"left": collections.defaultdict(lambda: 0, {0: 10})},
+                  s)
+    root = node = newick.Node("0", length="0")
+    for i in range(1, 5000):
+        child = newick.Node(str(i), length="0")
+        node.add_descendant(child)
+        node = child
+    names = [name for name, language in simulate(root, lg)]
+    assert names == [str(i) for i in range(5000)]
+
+
+def test_simulate_retain_leaves(minimal_gml):
+    """Are only leaves generated, and all languages released at the end?"""
+    s = SemanticNetwork.load_from_gml(minimal_gml.split("\n"), "w")
+    lg = Language({"left": collections.defaultdict(lambda: 0, {0: 10})},
+                  s)
+    tree = newick.loads("((A:2,B:2)C:1,D:3)E:1;")[0]
+    rows = []
+
+    class ListWriter:
+        def writerow(self, row):
+            rows.append(row)
+    names = [name for name, language in simulate(
+        tree, lg.copy(), writer=ListWriter(), retain="leaves")]
+    assert names == ["A", "B", "D"]
+    assert {row[0] for row in rows} == {"A", "B", "C", "D", "E"}
+
+    process = Multiprocess(2, retain="leaves")
+    names = [name for name, language in process.simulate(tree, lg.copy())]
+    assert sorted(names) == ["A", "B", "D"]
+    assert not process.generated_languages
+    assert not process.pending
+
+
+minimal_tree = newick.loads("(A:2,B:2):1;")[0]
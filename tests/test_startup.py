@@ -0,0 +1,27 @@
+import sys
+import subprocess
+
+import pytest
+
+from simuling.benchmark import import_times
+
+
+@pytest.mark.parametrize("module", [
+    "simuling.cli", "simuling.analysis", "simuling.__main__"])
+def test_no_heavy_imports(module):
+    """Do the command line modules avoid importing heavy libraries?"""
+    imported = import_times(module)
+    assert module in imported
+    for heavy in ["matplotlib", "pandas", "csvw", "numba"]:
+        assert heavy not in imported
+
+
+def test_help_does_not_import_csvw():
+    """Does `python -m simuling --help` run without csvw?"""
+    output = subprocess.run(
+        [sys.executable, "-c",
+         "import sys, runpy; sys.argv = ['simuling', '--help'];"
+         "\ntry:\n runpy.run_module('simuling', run_name='__main__')"
+         "\nexcept SystemExit:\n print('csvw' in sys.modules)"],
+        stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    assert output.stdout.strip().endswith("False")
@@ -0,0 +1,258 @@
+import io
+import os
+import sys
+import csv
+import subprocess
+import collections
+from pathlib import Path
+
+import numpy
+import pytest
+
+from sample.subsample import (
+    Aggregates, read_vocabulary, most_common, swadesh_sampler,
+    conceptlist_sampler_factory, cognate_presence_sampler, write_fasta,
+    write_nexus, conceptlist_glosses, argparser, parse_sampler)
+
+HEADER = "Language_ID\tFeature_ID\tWeight\tConcept_CogID\tGlobal_CogID\n"
+
+
+def vocabulary_text(seed=0):
+    """A random vocabulary, in which language L3 lacks some concepts."""
+    random = numpy.random.RandomState(seed)
+    lines = [HEADER]
+    for row in range(300):
+        language = "L{:d}".format(random.randint(4))
+        concept = "c{:d}".format(random.randint(8))
+        if language == "L3" and concept in {"c0", "c1", "c2"}:
+            continue
+        cognate_class = random.randint(5)
+        lines.append("{:}\t{:}\t{:d}\t{:d}\t{:d}\n".format(
+            language, concept, random.randint(1, 10 ** 6), cognate_class,
+            int(concept[1:]) * 10 + cognate_class))
+    return "".join(lines)
+
+
+def aggregates(text, chunksize=2 ** 20, concepts=None):
+    return Aggregates(read_vocabulary(io.StringIO(text), chunksize),
+                      {"weights", "activation"}, concepts)
+
+
+def old_swadesh_sampler(vocabulary, n_items=200, max_synonyms=1,
+                        cross_semantic_cognates=False):
+    """The Counter-based Swadesh sampler the aggregates replaced."""
+    basic_concepts = collections.Counter()
+    words_for_concept = {}
+    languages = set()
+    set_mapper = {}
+    for line in vocabulary:
+        concept = line["Feature_ID"]
+        language = line["Language_ID"]
+        concept_set = line["Concept_CogID"]
+        if not cross_semantic_cognates:
+            concept_set = set_mapper.setdefault(
+                (concept, concept_set), len(set_mapper))
+        languages.add(language)
+        basic_concepts[concept] += float(line["Weight"])
+        words_for_concept.setdefault(concept, {}).setdefault(
+            language, collections.Counter())[concept_set] += float(
+                line["Weight"])
+    for concept, _ in basic_concepts.most_common(n_items):
+        for language in languages:
+            items = words_for_concept[concept].get(language)
+            if not items:
+                yield (language, concept, "-")
+            else:
+                for cognate_set, _ in items.most_common(max_synonyms):
+                    yield (language, concept, str(cognate_set))
+
+
+def old_cognate_presence_sampler(vocabulary, min_activation=1):
+    """The set-based etymological sampler the aggregates replaced."""
+    languages = set()
+    cognate_classes = set()
+    present = set()
+    for line in vocabulary:
+        if float(line["Weight"]) > min_activation:
+            languages.add(line["Language_ID"])
+            cognate_classes.add(line["Global_CogID"])
+            present.add((line["Language_ID"], line["Global_CogID"]))
+    for language in languages:
+        for cognate_class in cognate_classes:
+            yield (language, cognate_class,
+                   str((language, cognate_class) in present))
+
+
+def rows(sample):
+    """The data rows of a sample written as CLDF."""
+    file = io.StringIO()
+    sample.write_cldf(file)
+    return list(csv.reader(io.StringIO(file.getvalue())))[1:]
+
+
+def test_chunked_aggregates():
+    """Do chunks of any size give the same aggregates, in the same order?"""
+    text = vocabulary_text()
+    whole = aggregates(text)
+    for chunksize in [1, 7, 100]:
+        chunked = aggregates(text, chunksize)
+        assert chunked.weights.index.equals(whole.weights.index)
+        assert numpy.allclose(chunked.weights.values, whole.weights.values)
+        assert chunked.activation.equals(whole.activation)
+
+
+def test_most_common_ties():
+    """Are the heaviest words kept, with ties in order of appearance?"""
+    text = HEADER + "".join([
+        "A\tc\t1\tx\t1\n", "A\tc\t3\ty\t2\n", "A\tc\t1\tz\t3\n",
+        "A\td\t2\tx\t4\n", "B\tc\t2\tz\t3\n"])
+    weights = aggregates(text).weights
+    assert list(most_common(weights, 2).index) == [
+        ("c", "A", "y"), ("d", "A", "x"), ("c", "B", "z"), ("c", "A", "x")]
+
+
+@pytest.mark.parametrize("options", [
+    {}, {"n_items": 5}, {"max_synonyms": 2},
+    {"cross_semantic_cognates": True, "n_items": 6, "max_synonyms": 3}])
+def test_swadesh_like_old_sampler(options):
+    """Does the Swadesh sampler pick the words of the old sampler?"""
+    text = vocabulary_text()
+    old = list(old_swadesh_sampler(
+        csv.DictReader(io.StringIO(text), dialect="excel-tab"), **options))
+    new = rows(swadesh_sampler(aggregates(text, 50), **options))
+    assert ["L3", "c0", "-"] in new
+    assert sorted(map(list, old)) == sorted(new)
+    # Concepts come in order of prevalence, as before.
+    assert [row[1] for row in new] == [row[1] for row in old]
+
+
+def test_conceptlist_like_old_sampler():
+    """Does a concept list sampler pick the words of the listed concepts?"""
+    text = vocabulary_text()
+    sampler = conceptlist_sampler_factory(["C6", "C1", "C9"], "test")
+    new = rows(sampler(aggregates(text, 50)))
+    old = [row for row in old_swadesh_sampler(
+        csv.DictReader(io.StringIO(text), dialect="excel-tab"))
+        if row[1] in {"c1", "c6"} and row[2] != "-"]
+    assert sorted((row[0], row[1].lower()) for row in new) == sorted(
+        (row[0], row[1]) for row in old)
+    assert [row[1] for row in new] == sorted(
+        [row[1] for row in new], key=["C6", "C1"].index)
+
+
+def test_etymo_like_old_sampler():
+    """Does the etymological sampler list the presences of the old one?"""
+    text = vocabulary_text()
+    old = old_cognate_presence_sampler(
+        csv.DictReader(io.StringIO(text), dialect="excel-tab"),
+        min_activation=500000)
+    new = rows(cognate_presence_sampler(
+        aggregates(text, 50), min_activation=500000))
+    assert sorted(map(list, old)) == sorted(new)
+
+
+def test_presence_matrix_formats():
+    """Are presence matrices written as FASTA and NEXUS, with '?' for '-'?"""
+    text = HEADER + "".join([
+        "A\tc1\t3\t1\t10\n", "A\tc1\t2\t2\t11\n",
+        "B\tc1\t4\t1\t10\n", "B\tc2\t1\t3\t12\n", "C D\tc2\t5\t3\t12\n"])
+    words = swadesh_sampler(aggregates(text))
+    assert rows(words) == [
+        ["A", "c1", "0"], ["B", "c1", "0"], ["C D", "c1", "-"],
+        ["A", "c2", "-"], ["B", "c2", "2"], ["C D", "c2", "2"]]
+    fasta = io.StringIO()
+    write_fasta(words.presence_matrix(), fasta)
+    assert fasta.getvalue() == ">A\n1?\n>B\n11\n>C D\n?1\n"
+    nexus = io.StringIO()
+    write_nexus(cognate_presence_sampler(aggregates(text)), nexus)
+    assert nexus.getvalue().splitlines()[3:] == [
+        "  DIMENSIONS NTAX=3 NCHAR=3;",
+        '  FORMAT DATATYPE=STANDARD MISSING=? GAP=- SYMBOLS="01";',
+        "  MATRIX",
+        "    A  110",
+        "    B  100",
+        "    'C D'  001",
+        "  ;",
+        "END;"]
+
+
+def test_empty_cached_conceptlist(tmpdir):
+    """Is an empty cached concept list read as a list without glosses?"""
+    tmpdir.join("empty.txt").write("")
+    tmpdir.join("two.txt").write("HAND\nFOOT")
+    cache = Path(str(tmpdir))
+    assert conceptlist_glosses("empty", cache=cache) == []
+    assert conceptlist_glosses("two", cache=cache) == ["HAND", "FOOT"]
+
+
+def test_parse_sampler(tmpdir):
+    """Are sampler options parsed like the command line options?"""
+    parser = argparser()
+    assert parse_sampler("swadesh", parser) == ("swadesh", {})
+    assert parse_sampler(
+        "swadesh:n-items=5,max_synonyms=2,cross-semantic-cognates,"
+        "format=nexus", parser) == ("swadesh", {
+            "n_items": 5, "max_synonyms": 2,
+            "cross_semantic_cognates": True, "format": "nexus"})
+    assert parse_sampler(
+        "etymo:cross-semantic-cognates=no,min-activation=2.5", parser) == (
+            "etymo", {"min_activation": 2.5})
+    name, settings = parse_sampler(
+        "etymo:output=" + str(tmpdir.join("etymo.csv")), parser)
+    assert settings["output"].name == str(tmpdir.join("etymo.csv"))
+    settings["output"].close()
+    for spec in ["swadesh:colour=red", "swadesh:chunksize=5",
+                 "swadesh:format=pdf"]:
+        with pytest.raises(SystemExit):
+            parse_sampler(spec, parser)
+
+
+def run_sampler(tmpdir, *arguments):
+    """Run the sampler command line on a vocabulary file."""
+    vocabulary = tmpdir.join("vocabulary.tsv")
+    vocabulary.write(vocabulary_text())
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(
+        [str(Path(__file__).absolute().parent.parent)] +
+        environment.get("PYTHONPATH", "").split(os.pathsep))
+    return subprocess.run(
+        [sys.executable,
+         str(Path(__file__).absolute().parent.parent / "sample" /
+             "subsample.py"),
+         "--vocabulary-file", str(vocabulary), "--chunksize", "50"] +
+        list(arguments),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, env=environment)
+
+
+def test_several_samplers(tmpdir):
+    """Do several samplers in one run write what separate runs write?"""
+    swadesh = str(tmpdir.join("swadesh.csv"))
+    etymo = str(tmpdir.join("etymo.fasta"))
+    run = run_sampler(tmpdir, "-s", "swadesh:n-items=4,output=" + swadesh,
+                      "-s", "etymo:format=fasta,output=" + etymo,
+                      "-s", "swadesh:max-synonyms=2")
+    assert run.returncode == 0, run.stderr
+    for arguments, path in [
+            (["--n-items", "4"], swadesh),
+            (["--etymo", "--fasta"], etymo)]:
+        single = run_sampler(tmpdir, *arguments)
+        assert single.returncode == 0, single.stderr
+        with open(path) as file:
+            assert file.read() == single.stdout
+    assert run.stdout == run_sampler(
+        tmpdir, "--max-synonyms", "2").stdout
+
+
+def test_samplers_with_same_output(tmpdir):
+    """Are several samplers writing to the same file rejected?"""
+    output = str(tmpdir.join("sample.csv"))
+    run = run_sampler(tmpdir, "-s", "swadesh:output=" + output,
+                      "-s", "etymo:output=" + output)
+    assert run.returncode == 2
+    assert "overwrite" in run.stderr
+    run = run_sampler(tmpdir, "-o", output, "-s", "swadesh",
+                      "-s", "etymo:output=" + output)
+    assert run.returncode == 2
+    run = run_sampler(tmpdir, "-o", output, "-s", "swadesh", "-s", "etymo")
+    assert run.returncode == 0, run.stderr
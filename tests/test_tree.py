@@ -0,0 +1,73 @@
+import newick
+import pytest
+
+from simuling.tree import parse, read_tree
+from simuling.simulation import walk_depth_order
+
+
+def test_parse_roundtrip():
+    """Does a parsed tree serialize to equivalent Newick?"""
+    text = "((A:1,B:2.5)C:3,'D E':0.5)F:1"
+    tree = next(parse(text + ";"))
+    assert tree.newick() == text
+    assert newick.loads(tree.newick() + ";")[0].newick == text
+
+
+def test_parse_without_semicolon(tmpdir, monkeypatch):
+    """Does the end of the input end a tree, and is empty input an error?"""
+    monkeypatch.setenv("SIMULING_CACHE", str(tmpdir.join("cache")))
+    assert [tree.newick() for tree in parse("(A:10,B:10)C")] == [
+        "(A:10,B:10)C"]
+    file = tmpdir.join("tree.nwk")
+    file.write("(A:1,B:2)C:3\n")
+    assert read_tree(str(file)).newick() == "(A:1,B:2)C:3"
+    assert read_tree(str(file), cache=False).newick() == "(A:1,B:2)C:3"
+    with pytest.raises(ValueError):
+        list(parse(" \n"))
+    file.write("")
+    with pytest.raises(ValueError):
+        read_tree(str(file))
+
+
+def test_parse_deep_tree():
+    """Can trees deeper than the recursion limit be parsed?"""
+    n = 5000
+    text = "(" * n + "A" + "".join(
+        ",L{:d}){:d}".format(i, i) for i in range(n)) + ";"
+    tree = next(parse(text))
+    assert len(tree) == 2 * n + 1
+    assert [node.name for node, depth in walk_depth_order(
+        tree.root)][:3] == [str(n - 1), str(n - 2), str(n - 3)]
+
+
+def test_scaled():
+    """Does scaling change the branch lengths, but not the original?"""
+    tree = next(parse("(A:1,B:2)C:3;"))
+    assert tree.scaled(2.5).newick() == "(A:2.5,B:5)C:7.5"
+    assert tree.newick() == "(A:1,B:2)C:3"
+
+
+def test_read_tree_cache(tmpdir, monkeypatch):
+    """Does the tree cache return the same tree as parsing the file?"""
+    monkeypatch.setenv("SIMULING_CACHE", str(tmpdir.join("cache")))
+    file = tmpdir.join("tree.nwk")
+    file.write("(A:1,(B:2,C)D:3);\n")
+    first = read_tree(str(file))
+    assert len(tmpdir.join("cache", "trees").listdir()) == 1
+    second = read_tree(str(file))
+    assert second.newick() == first.newick() == "(A:1,(B:2,C)D:3)"
+    assert second.name == first.name
+
+
+def test_pruned():
+    """Does pruning keep the paths to the requested nodes, merged?"""
+    tree = next(parse("(((A:1,B:2)C:3,D:4)E:5,(F:6,G)H:7)I:8;"))
+    assert tree.pruned(["A"]).newick() == "(A:9)I:8"
+    assert tree.pruned(["A", "D"]).newick() == "((A:4,D:4)E:5)I:8"
+    assert tree.pruned(["G", "C"]).newick() == "(C:8,G:7)I:8"
+    assert tree.pruned(["I"]).newick() == "I:8"
+    pruned = tree.pruned(["B", "F"])
+    assert [node.name for node, depth in walk_depth_order(pruned.root)] == [
+        "I", "B", "F"]
+    with pytest.raises(ValueError):
+        tree.pruned(["X"])
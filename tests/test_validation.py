@@ -0,0 +1,74 @@
+import collections
+
+import numpy
+import pytest
+
+from simuling.simulation import SemanticNetwork, Language, simulate
+from simuling.tree import parse
+from simuling.validation import (ks_two_sample, vocabulary_size, synonymy,
+                                 polysemy, run, compare, argparser, main)
+
+
+def test_ks_two_sample():
+    """Does the KS test separate different and accept equal samples?"""
+    random = numpy.random.RandomState(0)
+    same = ks_two_sample(random.normal(size=200), random.normal(size=300))
+    shifted = ks_two_sample(random.normal(size=200),
+                            random.normal(1, size=300))
+    assert same[1] > 0.05
+    assert shifted[1] < 1e-6
+    assert ks_two_sample([0, 1], [2, 3, 4]) == (1.0, ks_two_sample(
+        [5, 6], [2, 3, 4])[1])
+
+
+def test_language_statistics():
+    """Are vocabulary size, synonymy and polysemy as expected?"""
+    language = Language({
+        "a": collections.defaultdict(int, {1: 2, 2: 2}),
+        "b": collections.defaultdict(int, {1: 3, 3: 0})}, None)
+    assert vocabulary_size(language) == 2
+    assert synonymy(language) == 1.5
+    assert polysemy(language) == (25 / 13 + 1) / 2
+
+
+def test_run_and_compare():
+    """Does an engine compared with itself show no divergence?"""
+    network = SemanticNetwork({str(i): [str(i + 1)] for i in range(10)})
+    tree = next(parse("(A:20,B:30)C:10;")).root
+    language = Language({str(i): collections.defaultdict(int, {i: 10})
+                         for i in range(10)}, network)
+    runs = [run(simulate, tree, language.copy(), seed=seed)
+            for seed in range(3)]
+    for values, duration in runs:
+        assert len(values["vocabulary size"]) == 3
+        assert len(values["shared vocabulary"]) == 3
+        assert duration > 0
+    for name, mean1, mean2, d, p in compare(runs, runs):
+        assert mean1 == mean2
+        assert (d, p) == (0.0, 1.0)
+
+
+def test_unknown_reference_engine():
+    """Is an unknown reference engine a usage error?"""
+    with pytest.raises(SystemExit):
+        argparser().parse_args(["--reference", "exakt"])
+
+
+def test_burn_in_with_reference_engine(minimal_gml, tmpdir, monkeypatch,
+                                       capsys):
+    """Is the root language burned in with the reference engine?"""
+    network = tmpdir.join("network.gml")
+    network.write(minimal_gml)
+    burned_in = []
+
+    def burn_in(language, steps, **kwargs):
+        burned_in.append(type(language))
+        return language
+    monkeypatch.setattr("simuling.cli.burned_in", burn_in)
+    monkeypatch.setattr("sys.argv", [
+        "validation", "--semantic-network", str(network),
+        "--weight-attribute", "w", "--tree", "(A:5,B:5)C:1;",
+        "--burn-in", "10", "--runs", "2"])
+    main()
+    assert burned_in == [Language]
+    assert "leaping" in capsys.readouterr().out